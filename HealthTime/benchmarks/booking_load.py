@@ -0,0 +1,411 @@
+"""
+Concurrent booking load test. Many clients book, cancel, reschedule and
+open/close slots at the same time on a few doctors of one specialty, then the database is
+checked for double bookings. Reports throughput, latency percentiles and
+ok / conflict / error counts per operation.
+
+The test seeds its own doctors (load_doc_*), patients (load_pat_*) and the
+slots of a single day, so that contention is high by design, and removes
+them at the end (--keep to inspect them). Use a dedicated database.
+
+    python -m benchmarks.booking_load --clients 200 --operations 20
+    python -m benchmarks.booking_load --mode http --url http://127.0.0.1:5000
+
+In dao mode the clients call the DAOs in this process: raise DB_POOL_MAX to
+let them all reach PostgreSQL at once. In http mode they drive a running
+server through /book_appointment, /cancel_appointment and /api/toggle_slot;
+the portal has no reschedule page, so --reschedule only applies to dao mode.
+"""
+import argparse
+import http.cookiejar
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from datetime import date, timedelta
+
+from dao.appointment_dao import AppointmentDAO, PATIENT_BUSY, SLOT_TAKEN
+from dao.doctor_dao import DoctorDAO
+from database.db import get_connection, pooled_connection
+from benchmarks.stats import summarize, format_summary
+
+SPECIALTY = "Load Test"
+PASSWORD = "load"
+FIRST_HOUR = 8
+
+CLEAR = """
+    DELETE FROM users WHERE username LIKE 'load_doc_%' OR username LIKE 'load_pat_%';
+    DELETE FROM specialties WHERE name = 'Load Test';
+"""
+
+# Scheduled appointments that share a doctor (or patient) hour
+DOUBLE_BOOKINGS = """
+    SELECT
+        (SELECT COUNT(*) FROM (
+            SELECT 1 FROM appointments a JOIN users u ON u.id = a.doctor_id
+            WHERE u.username LIKE 'load_doc_%%' AND a.status = 'scheduled' AND a.slot_date = %(day)s
+            GROUP BY a.doctor_id, a.appointment_date HAVING COUNT(*) > 1) d),
+        (SELECT COUNT(*) FROM (
+            SELECT 1 FROM appointments a JOIN users u ON u.id = a.patient_id
+            WHERE u.username LIKE 'load_pat_%%' AND a.status = 'scheduled' AND a.slot_date = %(day)s
+            GROUP BY a.patient_id, a.appointment_date HAVING COUNT(*) > 1) p)
+"""
+
+# Slots whose status disagrees with the appointments
+SLOT_MISMATCHES = """
+    SELECT
+        (SELECT COUNT(*) FROM appointments a JOIN users u ON u.id = a.doctor_id
+         WHERE u.username LIKE 'load_doc_%%' AND a.status = 'scheduled' AND a.slot_date = %(day)s
+         AND NOT EXISTS (SELECT 1 FROM time_slots ts
+                         WHERE ts.doctor_id = a.doctor_id AND ts.slot_date = a.slot_date
+                         AND ts.slot_hour = a.slot_hour AND ts.status = 'booked')),
+        (SELECT COUNT(*) FROM time_slots ts JOIN users u ON u.id = ts.doctor_id
+         WHERE u.username LIKE 'load_doc_%%' AND ts.slot_date = %(day)s AND ts.status = 'booked'
+         AND NOT EXISTS (SELECT 1 FROM appointments a
+                         WHERE a.doctor_id = ts.doctor_id AND a.slot_date = ts.slot_date
+                         AND a.slot_hour = ts.slot_hour AND a.status = 'scheduled'))
+"""
+
+
+def prepare(doctors, patients, day, hours):
+    """Creates the load test specialty, users and slots; returns their ids."""
+    conn = get_connection()
+    if not conn:
+        raise SystemExit("Connexion à la base impossible")
+    cursor = conn.cursor()
+    cursor.execute(CLEAR)
+    cursor.execute("INSERT INTO specialties (name) VALUES (%s) RETURNING id", (SPECIALTY,))
+    specialty_id = cursor.fetchone()[0]
+
+    cursor.execute("""
+        INSERT INTO users (name, username, password, role, status)
+        SELECT 'Load Doctor ' || g, 'load_doc_' || g, %s, 'doctor', 'active'
+        FROM generate_series(1, %s) g
+        RETURNING id
+    """, (PASSWORD, doctors))
+    doctor_ids = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute("""
+        INSERT INTO users (name, username, password, role, status)
+        SELECT 'Load Patient ' || g, 'load_pat_' || g, %s, 'patient', 'active'
+        FROM generate_series(1, %s) g
+        RETURNING id
+    """, (PASSWORD, patients))
+    patient_ids = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute("""
+        INSERT INTO doctor_specialties (doctor_id, specialty_id)
+        SELECT unnest(%s::int[]), %s
+    """, (doctor_ids, specialty_id))
+    cursor.execute("""
+        INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status)
+        SELECT d, %s, h, 'available'
+        FROM unnest(%s::int[]) d, generate_series(%s, %s) h
+    """, (day, doctor_ids, FIRST_HOUR, FIRST_HOUR + hours - 1))
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return {"doctors": doctor_ids, "patients": patient_ids, "specialty_id": specialty_id}
+
+
+def clear():
+    conn = get_connection()
+    if not conn:
+        raise SystemExit("Connexion à la base impossible")
+    cursor = conn.cursor()
+    cursor.execute(CLEAR)
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def scheduled_appointment_ids(patient_id, day):
+    # Read on the primary: a replica could still show a canceled appointment
+    with pooled_connection() as conn:
+        if not conn:
+            return []
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id FROM appointments
+            WHERE patient_id = %s AND status = 'scheduled'
+            AND appointment_date >= %s AND appointment_date < %s::date + 1
+        """, (patient_id, day, day))
+        ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    return ids
+
+
+class DaoClient:
+    """Calls the DAOs directly, as the web views do."""
+
+    def __init__(self, patient_id, specialty_id, day):
+        self.patient_id = patient_id
+        self.specialty_id = specialty_id
+        self.day = day
+        self.errors = Counter()
+
+    def book(self, doctor_id, hour):
+        time_str = f"{hour:02d}:00"
+        if doctor_id == "any":
+            success, msg = AppointmentDAO.book_first_available(self.patient_id, self.specialty_id, self.day, time_str)
+        else:
+            success, msg = AppointmentDAO.create_appointment(self.patient_id, doctor_id, self.day, time_str)
+        if success:
+            return "ok"
+        if msg in (SLOT_TAKEN, PATIENT_BUSY):
+            return "conflict"
+        self.errors[msg] += 1
+        return "error"
+
+    def cancel(self, appointment_id):
+        success, msg = AppointmentDAO.cancel_appointment(appointment_id, self.patient_id)
+        if not success:
+            self.errors[msg] += 1
+        return "ok" if success else "error"
+
+    def reschedule(self, appointment_id, doctor_id, hour):
+        success, msg = AppointmentDAO.modify_appointment(appointment_id, doctor_id, self.day, f"{hour:02d}:00",
+                                                         patient_id=self.patient_id)
+        if success:
+            return "ok"
+        if msg in (SLOT_TAKEN, PATIENT_BUSY):
+            return "conflict"
+        self.errors[msg] += 1
+        return "error"
+
+    def toggle(self, doctor_id, hour):
+        action = DoctorDAO.toggle_doctor_slot(doctor_id, self.day, hour)
+        if action is None:
+            return "error"
+        return "conflict" if action == "booked" else "ok"
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """Drives a running web server, logged in as one patient and one doctor."""
+
+    def __init__(self, base_url, patient_username, specialty_id, day):
+        self.base_url = base_url.rstrip("/")
+        self.specialty_id = specialty_id
+        self.day = day
+        self.errors = Counter()
+        self.patient = self._login(patient_username)
+        self.doctors = {}
+
+    def _opener(self):
+        return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def _request(self, opener, path, form=None, payload=None):
+        """Returns (status, redirect location or response body)."""
+        headers, data = {}, None
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+        elif payload is not None:
+            data = json.dumps(payload).encode()
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+        try:
+            with opener.open(request, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            if e.code >= 400:
+                self.errors[f"HTTP {e.code} {path}"] += 1
+            return e.code, e.headers.get("Location")
+
+    def _login(self, username):
+        opener = self._opener()
+        status, location = self._request(opener, "/login", form={"username": username, "password": PASSWORD})
+        if status != 302 or "dashboard" not in (location or ""):
+            raise SystemExit(f"Connexion de {username} impossible sur {self.base_url}")
+        return opener
+
+    def doctor(self, doctor_id):
+        if doctor_id not in self.doctors:
+            self.doctors[doctor_id] = self._login(f"load_doc_{doctor_id}")
+        return self.doctors[doctor_id]
+
+    def book(self, doctor_id, hour):
+        status, location = self._request(self.patient, "/book_appointment", form={
+            "doc_id": doctor_id, "specialty_id": self.specialty_id,
+            "date": str(self.day), "time": f"{hour:02d}:00",
+        })
+        if status != 302:
+            return "error"
+        return "ok" if "tab=dashboard" in (location or "") else "conflict"
+
+    def cancel(self, appointment_id):
+        status, _ = self._request(self.patient, f"/cancel_appointment/{appointment_id}", form={})
+        return "ok" if status == 302 else "error"
+
+    def toggle(self, doctor_id, hour):
+        status, body = self._request(self.doctor(doctor_id), "/api/toggle_slot",
+                                     payload={"date": str(self.day), "hour": hour})
+        if status != 200:
+            return "error"
+        return "conflict" if json.loads(body).get("action") == "booked" else "ok"
+
+
+def run_client(client, patient_id, ids, args, start, results, lock):
+    rng = random.Random(patient_id)
+    weights = [args.book, args.cancel, args.toggle, 0 if isinstance(client, HttpClient) else args.reschedule]
+    local = []
+
+    start.wait()
+    for _ in range(args.operations):
+        operation = rng.choices(["book", "cancel", "toggle", "reschedule"], weights)[0]
+        hour = FIRST_HOUR + rng.randrange(args.hours)
+        doctor_index = rng.randrange(len(ids["doctors"]))
+
+        if operation in ("cancel", "reschedule"):
+            appointment_ids = scheduled_appointment_ids(patient_id, args.day)
+            if not appointment_ids:
+                operation = "book"
+
+        started = time.perf_counter()
+        try:
+            if operation == "book":
+                any_doctor = rng.random() < args.any_ratio
+                doctor_id = "any" if any_doctor else ids["doctors"][doctor_index]
+                outcome = client.book(doctor_id, hour)
+                operation = "book_any" if any_doctor else "book"
+            elif operation == "cancel":
+                outcome = client.cancel(rng.choice(appointment_ids))
+            elif operation == "reschedule":
+                outcome = client.reschedule(rng.choice(appointment_ids), ids["doctors"][doctor_index], hour)
+            else:
+                # In http mode doctors log in by username, load_doc_<n>
+                doctor_id = doctor_index + 1 if isinstance(client, HttpClient) else ids["doctors"][doctor_index]
+                outcome = client.toggle(doctor_id, hour)
+        except Exception as e:
+            client.errors[repr(e)] += 1
+            outcome = "error"
+        local.append((operation, outcome, time.perf_counter() - started))
+
+    with lock:
+        results.extend(local)
+
+# Day masks (migration 009) that differ from the rows they are built from
+STALE_DAY_MASKS = """
+    WITH expected AS (
+        SELECT doctor_id, slot_date AS day,
+               COALESCE(bit_or(1 << slot_hour) FILTER (WHERE kind = 'available'), 0) AS available_mask,
+               COALESCE(bit_or(1 << slot_hour) FILTER (WHERE kind = 'closed'), 0) AS closed_mask,
+               COALESCE(bit_or(1 << slot_hour) FILTER (WHERE kind = 'booked'), 0) AS booked_mask
+        FROM (
+            SELECT doctor_id, slot_date, slot_hour,
+                   CASE WHEN status = 'available' THEN 'available' ELSE 'closed' END AS kind
+            FROM time_slots WHERE slot_date = %(day)s
+            UNION ALL
+            SELECT doctor_id, slot_date, slot_hour, 'booked'
+            FROM appointments
+            WHERE status = 'scheduled' AND duration_minutes = 60 AND slot_date = %(day)s
+        ) slots
+        GROUP BY doctor_id, slot_date
+    )
+    SELECT COUNT(*)
+    FROM expected e
+    FULL JOIN (SELECT * FROM doctor_day_masks WHERE day = %(day)s) m USING (doctor_id, day)
+    JOIN users u ON u.id = doctor_id
+    WHERE u.username LIKE 'load_doc_%%'
+    AND (e.available_mask, e.closed_mask, e.booked_mask) IS DISTINCT FROM (m.available_mask, m.closed_mask, m.booked_mask)
+"""
+
+
+def check_invariants(day):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(DOUBLE_BOOKINGS, {"day": day})
+    doctor_doubles, patient_doubles = cursor.fetchone()
+    cursor.execute(SLOT_MISMATCHES, {"day": day})
+    unbooked_slots, orphan_booked_slots = cursor.fetchone()
+    cursor.execute(STALE_DAY_MASKS, {"day": day})
+    stale_masks = cursor.fetchone()[0]
+    cursor.close()
+    conn.close()
+    return {
+        "doctor_double_bookings": doctor_doubles,
+        "patient_double_bookings": patient_doubles,
+        "appointments_without_booked_slot": unbooked_slots,
+        "booked_slots_without_appointment": orphan_booked_slots,
+        "stale_day_masks": stale_masks,
+    }
+
+
+def report(results, elapsed, errors, invariants):
+    print(f"{len(results)} opérations en {elapsed:.2f}s, soit {len(results) / elapsed:.1f} op/s")
+    for operation in ("book", "book_any", "cancel", "reschedule", "toggle"):
+        rows = [r for r in results if r[0] == operation]
+        if not rows:
+            continue
+        outcomes = {o: sum(1 for r in rows if r[1] == o) for o in ("ok", "conflict", "error")}
+        print(f"{operation:10} ok={outcomes['ok']} conflits={outcomes['conflict']} erreurs={outcomes['error']}")
+        print(f"           {format_summary(summarize([r[2] for r in rows]))}")
+
+    for message, count in errors.most_common(5):
+        print(f"  erreur x{count} : {message}")
+
+    print("Invariants :")
+    for name, value in invariants.items():
+        print(f"  {name:34} {value}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["dao", "http"], default="dao")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="serveur web (mode http)")
+    parser.add_argument("--clients", type=int, default=100, help="clients simultanés, un patient chacun")
+    parser.add_argument("--operations", type=int, default=20, help="opérations par client")
+    parser.add_argument("--doctors", type=int, default=5)
+    parser.add_argument("--hours", type=int, default=8, help="créneaux horaires par docteur")
+    parser.add_argument("--any-ratio", type=float, default=0.3, help="part des réservations 'Peu importe'")
+    parser.add_argument("--book", type=int, default=70, help="poids des réservations")
+    parser.add_argument("--cancel", type=int, default=20, help="poids des annulations")
+    parser.add_argument("--reschedule", type=int, default=10, help="poids des déplacements de rendez-vous (mode dao)")
+    parser.add_argument("--toggle", type=int, default=10, help="poids des ouvertures/fermetures de créneaux")
+    parser.add_argument("--keep", action="store_true", help="conserve les données générées")
+    args = parser.parse_args(argv)
+    args.day = date.today() + timedelta(days=7)
+
+    ids = prepare(args.doctors, args.clients, args.day, args.hours)
+    try:
+        clients = []
+        for index, patient_id in enumerate(ids["patients"]):
+            if args.mode == "http":
+                clients.append(HttpClient(args.url, f"load_pat_{index + 1}", ids["specialty_id"], args.day))
+            else:
+                clients.append(DaoClient(patient_id, ids["specialty_id"], args.day))
+
+        results, lock = [], threading.Lock()
+        start = threading.Barrier(len(clients) + 1)
+        threads = [
+            threading.Thread(target=run_client, args=(client, patient_id, ids, args, start, results, lock))
+            for client, patient_id in zip(clients, ids["patients"])
+        ]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        invariants = check_invariants(args.day)
+        report(results, elapsed, sum((client.errors for client in clients), Counter()), invariants)
+        return 0 if invariants["doctor_double_bookings"] == 0 and invariants["patient_double_bookings"] == 0 else 1
+    finally:
+        if not args.keep:
+            clear()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Checks with EXPLAIN that every hot catalog query reads appointments,
+time_slots and doctor_day_masks through an index, never with a sequential
+scan, and that the date-bounded ones only read the monthly appointments
+partitions of their dates. Run it on a database filled by benchmarks.seed;
+exits with status 1 on failure.
+
+    python -m benchmarks.seed --appointments 3000000
+    python -m benchmarks.explain_check
+"""
+import json
+import sys
+from datetime import date, datetime, timedelta
+
+from database import queries
+from database.db import get_connection
+from benchmarks.seed import sample_ids
+
+CHECKED_TABLES = {"appointments", "time_slots", "doctor_day_masks"}
+
+
+def hot_queries(ids):
+    """
+    (query, params, max partitions) triples, with parameters taken from the
+    seeded data. Max partitions is the number of appointments partitions a
+    date-bounded query may read, None for the unbounded ones.
+    """
+    day = date.today() + timedelta(days=7)
+    now = datetime.now()
+    return [
+        (queries.AVAILABLE_SLOTS_FOR_DOCTOR, (ids["doctor_id"], day), 1),
+        (queries.AVAILABLE_SLOTS_BY_SPECIALTY, (ids["specialty_id"], day), 1),
+        (queries.FREE_HOURS_BY_SPECIALTY, (ids["specialty_id"], day), 0),
+        (queries.DAY_MASKS, (ids["doctor_id"], day, day + timedelta(days=6)), 0),
+        (queries.FREE_PERIODS_FOR_DOCTOR, (ids["doctor_id"], day, 30), 1),
+        (queries.NEXT_FREE_SLOTS_FOR_DOCTOR, (ids["doctor_id"], now, day + timedelta(days=60), 10), 0),
+        (queries.MONTH_FREE_SLOTS_FOR_DOCTOR, (ids["doctor_id"], day, day + timedelta(days=30), now), 0),
+        (queries.MONTH_FREE_SLOTS_BY_SPECIALTY, (ids["specialty_id"], day, day + timedelta(days=30), now), 0),
+        (queries.APPOINTMENT_BY_DOCTOR_DATE_HOUR, (ids["doctor_id"], day, 10), 1),
+        (queries.PATIENT_APPOINTMENTS, (ids["patient_id"],), None),
+        (queries.DOCTOR_APPOINTMENTS, (ids["doctor_id"],), None),
+        (queries.UPCOMING_DOCTOR_APPOINTMENTS, (ids["doctor_id"], now, now + timedelta(hours=24)), 2),
+        (queries.UPCOMING_PATIENT_APPOINTMENTS, (ids["patient_id"], now, now + timedelta(hours=24)), 2),
+        (queries.DOCTOR_SLOTS, (ids["doctor_id"], None, day + timedelta(days=28)), None),
+    ]
+
+
+def partition_stats(cursor):
+    """{partition name: (partitioned table name, estimated rows)}"""
+    cursor.execute("""
+        SELECT child.relname, parent.relname, child.reltuples
+        FROM pg_inherits i
+        JOIN pg_class child ON child.oid = i.inhrelid
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        WHERE parent.relkind = 'p'
+    """)
+    return {child: (parent, rows) for child, parent, rows in cursor.fetchall()}
+
+
+def index_names(plan):
+    if "Index Name" in plan:
+        yield plan["Index Name"]
+    for child in plan.get("Plans", []):
+        yield from index_names(child)
+
+
+def scans(plan):
+    """Yields (node type, relation, index) for every scan node of a JSON plan."""
+    if "Relation Name" in plan:
+        # A bitmap heap scan names its indexes in its Bitmap Index Scan children
+        index = plan.get("Index Name") or "+".join(index_names(plan)) or None
+        yield plan["Node Type"], plan["Relation Name"], index
+    for child in plan.get("Plans", []):
+        if "Relation Name" not in plan or child["Node Type"] not in ("Bitmap Index Scan", "BitmapAnd", "BitmapOr"):
+            yield from scans(child)
+
+
+def explain(cursor, query, params):
+    cursor.execute("EXPLAIN (FORMAT JSON) " + query.plain_sql, query.plain_params(params))
+    result = cursor.fetchone()[0]
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]["Plan"]
+
+
+def check():
+    conn = get_connection()
+    if not conn:
+        raise SystemExit("Connexion à la base impossible")
+    cursor = conn.cursor()
+    ids = sample_ids(cursor)
+    known = partition_stats(cursor)
+    parents = {child: parent for child, (parent, _) in known.items()}
+    # Future months are still empty: a Seq Scan on them costs nothing
+    empty = {child for child, (_, rows) in known.items() if rows == 0}
+
+    failures = 0
+    for query, params, max_partitions in hot_queries(ids):
+        plan = explain(cursor, query, params)
+        nodes = [n for n in scans(plan) if parents.get(n[1], n[1]) in CHECKED_TABLES]
+        seq_scans = [n for n in nodes if n[0] == "Seq Scan" and n[1] not in empty]
+        partitions = {n[1] for n in nodes if parents.get(n[1]) == "appointments"}
+        not_pruned = max_partitions is not None and len(partitions) > max_partitions
+
+        used = ", ".join(f"{relation}:{index or node_type}" for node_type, relation, index in sorted(set(nodes)))
+        if len(used) > 160:
+            used = used[:157] + "..."
+        status = "FAIL" if seq_scans or not_pruned else "ok"
+        failures += bool(seq_scans or not_pruned)
+        print(f"{status:4} {query.name:32} [{len(partitions)} partition(s)] {used}")
+
+    cursor.close()
+    conn.close()
+    return failures == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check() else 1)
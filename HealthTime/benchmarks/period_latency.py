@@ -0,0 +1,97 @@
+"""
+Hour grid against the periods of migration 013: latency of the availability
+of a doctor's day read from the hour masks (AVAILABLE_SLOTS_FOR_DOCTOR) and
+computed as a tsmultirange difference (FREE_PERIODS_FOR_DOCTOR), and of a
+booking of an open hour as an hour-long appointment (BOOK_APPOINTMENT) and
+as a shorter period checked by the GiST exclusion constraints
+(BOOK_APPOINTMENT_PERIOD). Bookings are rolled back. Run it on a database
+filled by benchmarks.seed, with migration 013 applied.
+
+    python -m benchmarks.period_latency --iterations 200
+"""
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from database import queries
+from database.db import get_connection
+from benchmarks.stats import summarize, format_summary
+
+DURATIONS = (60, 30, 15)
+
+
+def timed(cursor, query, params):
+    start = time.perf_counter()
+    cursor.execute(query.plain_sql, query.plain_params(params))
+    rows = cursor.fetchall()
+    return time.perf_counter() - start, rows
+
+
+def run(iterations, seed):
+    conn = get_connection()
+    if not conn:
+        raise SystemExit("Connexion à la base impossible")
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        SELECT ds.doctor_id
+        FROM doctor_specialties ds JOIN users u ON u.id = ds.doctor_id
+        WHERE u.username LIKE 'seed_doc_%'
+    """)
+    doctors = [r[0] for r in cursor.fetchall()]
+    cursor.execute("SELECT id FROM users WHERE username LIKE 'seed_pat_%' LIMIT 1000")
+    patients = [r[0] for r in cursor.fetchall()]
+    if not doctors or not patients:
+        raise SystemExit("Base non peuplée : lancez d'abord python -m benchmarks.seed")
+    conn.commit()
+
+    rng = random.Random(seed)
+    cases = [(rng.choice(doctors), date.today() + timedelta(days=rng.randint(1, 29)), rng.choice(patients))
+             for _ in range(iterations)]
+
+    print("Disponibilités d'un docteur sur un jour")
+    grid = [timed(cursor, queries.AVAILABLE_SLOTS_FOR_DOCTOR, (doctor_id, day)) for doctor_id, day, _ in cases]
+    print(f"  grille horaire (masques)   {format_summary(summarize([t for t, _ in grid]))}"
+          f"  débuts/jour={sum(len(rows) for _, rows in grid) / len(grid):.1f}")
+    for minutes in DURATIONS:
+        periods = [timed(cursor, queries.FREE_PERIODS_FOR_DOCTOR, (doctor_id, day, minutes))
+                   for doctor_id, day, _ in cases]
+        print(f"  périodes {minutes:2d} min (tsrange) {format_summary(summarize([t for t, _ in periods]))}"
+              f"  débuts/jour={sum(len(rows) for _, rows in periods) / len(periods):.1f}")
+    conn.commit()
+
+    # Bookings of the first open hour of each case, rolled back
+    bookable = []
+    for doctor_id, day, patient_id in cases:
+        cursor.execute("SELECT min(slot_hour) FROM healthtime_open_hours(%s, %s)", (doctor_id, day))
+        hour = cursor.fetchone()[0]
+        if hour is not None:
+            bookable.append((patient_id, doctor_id, datetime.combine(day, datetime.min.time()).replace(hour=hour)))
+    conn.commit()
+
+    print(f"Réservation d'une heure ouverte ({len(bookable)} cas, annulées)")
+    for label, query, params_of in (
+        ("grille horaire (60 min)", queries.BOOK_APPOINTMENT,
+         lambda c: (c[0], c[1], c[2], False)),
+        ("période 30 min (GiST)", queries.BOOK_APPOINTMENT_PERIOD,
+         lambda c: (c[0], c[1], c[2], 30, False)),
+    ):
+        latencies, booked = [], 0
+        for case in bookable:
+            latency, rows = timed(cursor, query, params_of(case))
+            latencies.append(latency)
+            booked += rows[0][0] is not None
+            conn.rollback()
+        print(f"  {label:26} {format_summary(summarize(latencies))}  réservées={booked}")
+
+    cursor.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    run(args.iterations, args.seed)
@@ -0,0 +1,131 @@
+"""
+Fills the configured database with a large synthetic dataset, for the
+benchmarks of this package. Seeded rows are recognisable by their usernames
+(seed_doc_*, seed_pat_*) and can be removed with --clear.
+
+    python -m benchmarks.seed --doctors 2000 --patients 50000 --appointments 3000000
+
+Use a dedicated database (DB_NAME=healthtime_bench ...), never production.
+"""
+import argparse
+import time
+
+from database.db import get_connection
+
+SEED_USERS = """
+    INSERT INTO users (name, username, password, role, status)
+    SELECT 'Seed Doctor ' || g, 'seed_doc_' || g, 'seed', 'doctor', 'active'
+    FROM generate_series(1, %(doctors)s) g
+    ON CONFLICT (username) DO NOTHING;
+
+    INSERT INTO users (name, username, password, role, status)
+    SELECT 'Seed Patient ' || g, 'seed_pat_' || g, 'seed', 'patient', 'active'
+    FROM generate_series(1, %(patients)s) g
+    ON CONFLICT (username) DO NOTHING;
+"""
+
+SEED_SPECIALTIES = """
+    INSERT INTO doctor_specialties (doctor_id, specialty_id)
+    SELECT u.id, s.ids[1 + u.id %% array_length(s.ids, 1)]
+    FROM users u, (SELECT array_agg(id ORDER BY id) AS ids FROM specialties) s
+    WHERE u.username LIKE 'seed_doc_%%'
+    ON CONFLICT DO NOTHING;
+"""
+
+# Opening hours 8h-17h, from `days` days ago to `days` days ahead
+SEED_SLOTS = """
+    INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status)
+    SELECT u.id, CURRENT_DATE + d, h, 'available'
+    FROM users u, generate_series(-%(days)s, %(days)s) d, generate_series(8, 17) h
+    WHERE u.username LIKE 'seed_doc_%%'
+    ON CONFLICT DO NOTHING;
+"""
+
+# One year of history plus two months ahead; past appointments are mostly completed
+SEED_APPOINTMENTS = """
+    SELECT healthtime_create_appointment_partitions(
+        (LOCALTIMESTAMP - interval '365 days')::date, (LOCALTIMESTAMP + interval '60 days')::date);
+    WITH doc AS (SELECT array_agg(id) AS ids FROM users WHERE username LIKE 'seed_doc_%%'),
+         pat AS (SELECT array_agg(id) AS ids FROM users WHERE username LIKE 'seed_pat_%%')
+    INSERT INTO appointments (patient_id, doctor_id, appointment_date, status, urgent)
+    SELECT pat.ids[1 + floor(random() * array_length(pat.ids, 1))::int],
+           doc.ids[1 + floor(random() * array_length(doc.ids, 1))::int],
+           x.ts,
+           CASE WHEN x.ts > LOCALTIMESTAMP THEN 'scheduled'
+                WHEN x.r < 0.1 THEN 'canceled'
+                ELSE 'completed' END,
+           x.r < 0.05
+    FROM doc, pat, (
+        SELECT date_trunc('hour', LOCALTIMESTAMP - interval '365 days' + random() * interval '425 days') AS ts,
+               random() AS r
+        FROM generate_series(1, %(appointments)s)
+    ) x
+    -- a doctor or patient already booked at that hour (migration 006)
+    ON CONFLICT DO NOTHING;
+"""
+
+CLEAR = """
+    DELETE FROM users WHERE username LIKE 'seed_doc_%' OR username LIKE 'seed_pat_%';
+"""
+
+
+def seed(doctors, patients, appointments, days):
+    conn = get_connection()
+    if not conn:
+        raise SystemExit("Connexion à la base impossible")
+
+    params = {"doctors": doctors, "patients": patients, "appointments": appointments, "days": days}
+    cursor = conn.cursor()
+    for label, sql in (("utilisateurs", SEED_USERS), ("spécialités", SEED_SPECIALTIES),
+                       ("créneaux", SEED_SLOTS), ("rendez-vous", SEED_APPOINTMENTS)):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        conn.commit()
+        print(f"{label}: {time.perf_counter() - start:.1f}s")
+
+    conn.autocommit = True
+    cursor.execute("ANALYZE")
+    cursor.close()
+    conn.close()
+
+
+def clear():
+    conn = get_connection()
+    if not conn:
+        raise SystemExit("Connexion à la base impossible")
+    cursor = conn.cursor()
+    cursor.execute(CLEAR)
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def sample_ids(cursor):
+    """A seeded doctor, patient and specialty to use as query parameters."""
+    cursor.execute("""
+        SELECT ds.doctor_id, ds.specialty_id
+        FROM doctor_specialties ds JOIN users u ON u.id = ds.doctor_id
+        WHERE u.username = 'seed_doc_1'
+    """)
+    row = cursor.fetchone()
+    if not row:
+        raise SystemExit("Base non peuplée : lancez d'abord python -m benchmarks.seed")
+    doctor_id, specialty_id = row
+    cursor.execute("SELECT id FROM users WHERE username = 'seed_pat_1'")
+    patient_id = cursor.fetchone()[0]
+    return {"doctor_id": doctor_id, "patient_id": patient_id, "specialty_id": specialty_id}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--doctors", type=int, default=2000)
+    parser.add_argument("--patients", type=int, default=50000)
+    parser.add_argument("--appointments", type=int, default=3000000)
+    parser.add_argument("--days", type=int, default=30, help="jours de créneaux avant/après aujourd'hui")
+    parser.add_argument("--clear", action="store_true", help="supprime les données générées")
+    args = parser.parse_args()
+
+    if args.clear:
+        clear()
+    else:
+        seed(args.doctors, args.patients, args.appointments, args.days)
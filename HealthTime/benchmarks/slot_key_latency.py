@@ -0,0 +1,122 @@
+"""
+Latency of the availability queries before and after the slot key of
+migration 002: the legacy DATE()/EXTRACT(HOUR) predicates against the
+(slot_date, slot_hour) columns now used by the query catalog. Run it on a
+database filled by benchmarks.seed, with migration 002 applied.
+
+    python -m benchmarks.slot_key_latency --iterations 200
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from database import queries
+from database.db import get_connection
+from benchmarks.stats import summarize, format_summary
+
+LEGACY_AVAILABLE_SLOTS_FOR_DOCTOR = """
+    SELECT ts.slot_hour
+    FROM time_slots ts
+    WHERE ts.doctor_id = %s
+    AND ts.slot_date = %s
+    AND ts.status = 'available'
+    AND NOT EXISTS (
+        SELECT 1 FROM appointments a
+        WHERE a.doctor_id = ts.doctor_id
+        AND DATE(a.appointment_date) = ts.slot_date
+        AND EXTRACT(HOUR FROM a.appointment_date) = ts.slot_hour
+        AND a.status = 'scheduled'
+    )
+    ORDER BY ts.slot_hour
+"""
+
+LEGACY_AVAILABLE_SLOTS_BY_SPECIALTY = """
+    SELECT ts.slot_hour, u.id, u.name
+    FROM time_slots ts
+    JOIN users u ON ts.doctor_id = u.id
+    JOIN doctor_specialties ds ON u.id = ds.doctor_id
+    WHERE ds.specialty_id = %s
+    AND ts.slot_date = %s
+    AND ts.status = 'available'
+    AND u.status = 'active'
+    AND NOT EXISTS (
+        SELECT 1 FROM appointments a
+        WHERE a.doctor_id = ts.doctor_id
+        AND DATE(a.appointment_date) = ts.slot_date
+        AND EXTRACT(HOUR FROM a.appointment_date) = ts.slot_hour
+        AND a.status = 'scheduled'
+    )
+    ORDER BY ts.slot_hour, u.name
+"""
+
+LEGACY_APPOINTMENT_BY_DOCTOR_DATE_HOUR = """
+    SELECT a.id, u.name, a.appointment_date, a.status
+    FROM appointments a
+    JOIN users u ON a.patient_id = u.id
+    WHERE a.doctor_id = %s
+    AND DATE(a.appointment_date) = %s
+    AND EXTRACT(HOUR FROM a.appointment_date) = %s
+    AND a.status = 'scheduled'
+"""
+
+
+def timed(cursor, sql, params):
+    start = time.perf_counter()
+    cursor.execute(sql, params)
+    cursor.fetchall()
+    return time.perf_counter() - start
+
+
+def run(iterations, seed):
+    conn = get_connection()
+    if not conn:
+        raise SystemExit("Connexion à la base impossible")
+    conn.autocommit = True
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        SELECT ds.doctor_id, ds.specialty_id
+        FROM doctor_specialties ds JOIN users u ON u.id = ds.doctor_id
+        WHERE u.username LIKE 'seed_doc_%'
+    """)
+    doctors = cursor.fetchall()
+    if not doctors:
+        raise SystemExit("Base non peuplée : lancez d'abord python -m benchmarks.seed")
+
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(iterations):
+        doctor_id, specialty_id = rng.choice(doctors)
+        day = date.today() + timedelta(days=rng.randint(0, 29))
+        cases.append((doctor_id, specialty_id, day, rng.randint(8, 17)))
+
+    comparisons = [
+        ("available_slots_for_doctor",
+         LEGACY_AVAILABLE_SLOTS_FOR_DOCTOR, queries.AVAILABLE_SLOTS_FOR_DOCTOR,
+         lambda c: (c[0], c[2])),
+        ("available_slots_by_specialty",
+         LEGACY_AVAILABLE_SLOTS_BY_SPECIALTY, queries.AVAILABLE_SLOTS_BY_SPECIALTY,
+         lambda c: (c[1], c[2])),
+        ("appointment_by_doctor_date_hour",
+         LEGACY_APPOINTMENT_BY_DOCTOR_DATE_HOUR, queries.APPOINTMENT_BY_DOCTOR_DATE_HOUR,
+         lambda c: (c[0], c[2], c[3])),
+    ]
+
+    for name, legacy_sql, query, params_of in comparisons:
+        before = [timed(cursor, legacy_sql, params_of(case)) for case in cases]
+        after = [timed(cursor, query.plain_sql, query.plain_params(params_of(case))) for case in cases]
+        print(name)
+        print("  avant (DATE/EXTRACT)       ", format_summary(summarize(before)))
+        print("  après (slot_date/slot_hour)", format_summary(summarize(after)))
+
+    cursor.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    run(args.iterations, args.seed)
@@ -0,0 +1,24 @@
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    """Mean and percentiles, in milliseconds, of latencies given in seconds."""
+    values = sorted(latency * 1000 for latency in latencies)
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else 0.0,
+    }
+
+
+def format_summary(summary):
+    return ("n={count} mean={mean:.2f}ms p50={p50:.2f}ms p95={p95:.2f}ms "
+            "p99={p99:.2f}ms max={max:.2f}ms").format(**summary)
@@ -7,4 +7,51 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
\ No newline at end of file
+DB_PORT = os.getenv("DB_PORT")
+
+# Connection pool (database.db.get_pool)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))
+
+# Run the hot queries of database.queries as server-side prepared statements
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "1").lower() not in ("0", "false", "no")
+
+# Read replicas (comma separated DSNs). Read-only DAO methods are spread over
+# the replicas whose lag is below DB_REPLICA_MAX_LAG seconds; a session that
+# wrote less than DB_READ_YOUR_WRITES_SECONDS ago keeps reading the primary.
+DB_REPLICA_URLS = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "2"))
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "10"))
+
+# Schema migrations (database.migrate): how long a statement may wait for a
+# table lock before giving up, instead of queueing the application behind it
+DB_MIGRATION_LOCK_TIMEOUT = os.getenv("DB_MIGRATION_LOCK_TIMEOUT", "5s")
+
+# Monthly appointments partitions created ahead of time (database.partitions)
+DB_APPOINTMENT_PARTITIONS_AHEAD = int(os.getenv("DB_APPOINTMENT_PARTITIONS_AHEAD", "12"))
+
+# Idempotency keys of the booking and cancellation forms (database.idempotency):
+# a replayed request returns the stored result for this many seconds
+DB_IDEMPOTENCY_KEY_TTL = int(os.getenv("DB_IDEMPOTENCY_KEY_TTL", "86400"))
+
+# How far ahead the weekly availability rules are expanded when a doctor's
+# slots are listed without an end date (DoctorDAO.get_doctor_slots)
+AVAILABILITY_HORIZON_DAYS = int(os.getenv("AVAILABILITY_HORIZON_DAYS", "90"))
+
+# In-process index of the "Peu importe" slot lists per specialty and date
+# (database.availability_index): an entry is kept at most this many seconds,
+# which bounds how long writes made by other processes go unseen. 0 disables it.
+AVAILABILITY_INDEX_TTL = float(os.getenv("AVAILABILITY_INDEX_TTL", "30"))
+AVAILABILITY_INDEX_MAX_ENTRIES = int(os.getenv("AVAILABILITY_INDEX_MAX_ENTRIES", "2048"))
+
+# "Prochains créneaux" search (AppointmentDAO.get_next_slots_*): how many days
+# ahead it looks, and how many slots it returns by default
+NEXT_SLOTS_HORIZON_DAYS = int(os.getenv("NEXT_SLOTS_HORIZON_DAYS", "60"))
+NEXT_SLOTS_LIMIT = int(os.getenv("NEXT_SLOTS_LIMIT", "10"))
+
+# Consultation lengths offered at booking, in minutes (migration 013): each
+# one must divide the hour, since an appointment stays within its hour
+APPOINTMENT_DURATIONS = [int(m) for m in os.getenv("APPOINTMENT_DURATIONS", "60,30,15").split(",") if m.strip()]
@@ -1,4 +1,7 @@
-from database.db import get_connection
+from database.db import pooled_connection
+from database import availability_index, queries
+from dao.appointment_dao import AppointmentDAO
+from datetime import datetime
 from psycopg2.extras import RealDictCursor
 
 
@@ -6,253 +9,330 @@ class AdminDAO:
 
     @staticmethod
     def get_doctors():
-        conn = get_connection()
-        if not conn:
-            return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
 
-        try:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-            cursor.execute("""
-                SELECT id, name, username, status, license_number
-                FROM users
-                WHERE role='doctor'
-            """)
+                cursor.execute("""
+                    SELECT id, name, username, status, license_number
+                    FROM users
+                    WHERE role='doctor'
+                """)
+
+                doctors = cursor.fetchall()
 
-            doctors = cursor.fetchall()
+                # Specialties of every doctor in one query, on the same connection
+                cursor.execute("""
+                    SELECT ds.doctor_id, s.id, s.name
+                    FROM specialties s
+                    JOIN doctor_specialties ds ON ds.specialty_id = s.id
+                    JOIN users u ON u.id = ds.doctor_id
+                    WHERE u.role='doctor'
+                """)
 
-            for doc in doctors:
-                doc["specialties"] = AdminDAO.get_doctor_specialties(doc["id"])
+                by_doctor = {}
+                for row in cursor.fetchall():
+                    by_doctor.setdefault(row["doctor_id"], []).append({"id": row["id"], "name": row["name"]})
 
-            cursor.close()
-            conn.close()
-            return doctors
+                for doc in doctors:
+                    doc["specialties"] = by_doctor.get(doc["id"], [])
 
-        except Exception as e:
-            conn.close()
-            print("GET_DOCTORS ERROR:", e)
-            return []
+                cursor.close()
+                return doctors
+
+            except Exception as e:
+                print("GET_DOCTORS ERROR:", e)
+                return []
 
 
     @staticmethod
     def add_doctor(name, username, password, license_number, specialties=[]):
-        conn = get_connection()
-        if not conn:
-            return False, "Database connection failed"
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
 
-        try:
-            cursor = conn.cursor()
+            try:
+                cursor = conn.cursor()
 
-            cursor.execute("""
-                INSERT INTO users (name, username, password, role, license_number, status)
-                VALUES (%s, %s, %s, 'doctor', %s, 'active')
-                RETURNING id
-            """, (name, username, password, license_number))
+                cursor.execute("""
+                    INSERT INTO users (name, username, password, role, license_number, status)
+                    VALUES (%s, %s, %s, 'doctor', %s, 'active')
+                    RETURNING id
+                """, (name, username, password, license_number))
 
-            doctor_id = cursor.fetchone()[0]
+                doctor_id = cursor.fetchone()[0]
 
-            for specialty_id in specialties:
-                cursor.execute("""
-                    INSERT INTO doctor_specialties (doctor_id, specialty_id)
-                    VALUES (%s, %s)
-                """, (doctor_id, specialty_id))
+                for specialty_id in specialties:
+                    cursor.execute("""
+                        INSERT INTO doctor_specialties (doctor_id, specialty_id)
+                        VALUES (%s, %s)
+                    """, (doctor_id, specialty_id))
 
-            conn.commit()
-            cursor.close()
-            conn.close()
+                conn.commit()
+                cursor.close()
+                availability_index.clear()
 
-            return True, "Doctor created successfully"
+                return True, "Doctor created successfully"
 
-        except Exception as e:
-            conn.rollback()
-            conn.close()
-            return False, str(e)
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
 
 
     @staticmethod
     def delete_doctor(doctor_id):
-        conn = get_connection()
-        if not conn:
-            return False, "Database connection failed"
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
 
-        try:
-            cursor = conn.cursor()
+            try:
+                cursor = conn.cursor()
 
-            cursor.execute(
-                "DELETE FROM users WHERE id=%s AND role='doctor'",
-                (doctor_id,)
-            )
+                cursor.execute(
+                    "DELETE FROM users WHERE id=%s AND role='doctor'",
+                    (doctor_id,)
+                )
 
-            conn.commit()
-            cursor.close()
-            conn.close()
+                conn.commit()
+                cursor.close()
+                availability_index.clear()
 
-            return True, "Doctor deleted"
+                return True, "Doctor deleted"
 
-        except Exception as e:
-            conn.rollback()
-            conn.close()
-            return False, str(e)
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
 
 
     @staticmethod
     def deactivate_doctor(doctor_id):
-        conn = get_connection()
-        if not conn:
-            return False, "Database connection failed"
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
 
-        try:
-            cursor = conn.cursor()
+            try:
+                cursor = conn.cursor()
 
-            cursor.execute("""
-                UPDATE users
-                SET status='inactive'
-                WHERE id=%s AND role='doctor'
-            """, (doctor_id,))
+                cursor.execute("""
+                    UPDATE users
+                    SET status='inactive'
+                    WHERE id=%s AND role='doctor'
+                """, (doctor_id,))
+                # Ses rendez-vous à venir sont annulés et les patients prévenus
+                if cursor.rowcount:
+                    AppointmentDAO.cancel_doctor_range(cursor, doctor_id, datetime.now(), None, "doctor_deactivated")
 
-            conn.commit()
-            cursor.close()
-            conn.close()
+                conn.commit()
+                cursor.close()
+                availability_index.clear()
 
-            return True, "Doctor deactivated"
+                return True, "Doctor deactivated"
 
-        except Exception as e:
-            conn.rollback()
-            conn.close()
-            return False, str(e)
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
 
 
     @staticmethod
     def get_specialties():
-        conn = get_connection()
-        if not conn:
-            return []
-
-        try:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("SELECT * FROM specialties ORDER BY name")
-            data = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return data
-
-        except Exception as e:
-            conn.close()
-            print("GET_SPECIALTIES ERROR:", e)
-            return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+
+            try:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                queries.execute(cursor, queries.SPECIALTIES)
+                data = cursor.fetchall()
+                cursor.close()
+                return data
+
+            except Exception as e:
+                print("GET_SPECIALTIES ERROR:", e)
+                return []
 
     @staticmethod
     def get_doctor_specialties(doctor_id):
-        conn = get_connection()
-        if not conn:
-            return []
-
-        try:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-            cursor.execute("""
-                SELECT s.id, s.name
-                FROM specialties s
-                JOIN doctor_specialties ds ON ds.specialty_id = s.id
-                WHERE ds.doctor_id = %s
-            """, (doctor_id,))
-
-            specialties = cursor.fetchall()
-            cursor.close()
-            conn.close()
-
-            return specialties
-
-        except Exception as e:
-            conn.close()
-            print("GET_DOCTOR_SPECIALTIES ERROR:", e)
-            return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+
+            try:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+                cursor.execute("""
+                    SELECT s.id, s.name
+                    FROM specialties s
+                    JOIN doctor_specialties ds ON ds.specialty_id = s.id
+                    WHERE ds.doctor_id = %s
+                """, (doctor_id,))
+
+                specialties = cursor.fetchall()
+                cursor.close()
+
+                return specialties
+
+            except Exception as e:
+                print("GET_DOCTOR_SPECIALTIES ERROR:", e)
+                return []
         
     @staticmethod
     def reactivate_doctor(doctor_id):
-        conn = get_connection()
-        if not conn:
-            return False, "Database connection failed"
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
 
-        try:
-            cursor = conn.cursor()
+            try:
+                cursor = conn.cursor()
 
-            cursor.execute("""
-                UPDATE users
-                SET status='active'
-                WHERE id=%s AND role='doctor'
-            """, (doctor_id,))
+                cursor.execute("""
+                    UPDATE users
+                    SET status='active'
+                    WHERE id=%s AND role='doctor'
+                """, (doctor_id,))
 
-            conn.commit()
-            cursor.close()
-            conn.close()
+                conn.commit()
+                cursor.close()
+                availability_index.clear()
 
-            return True, "Doctor reactivated"
+                return True, "Doctor reactivated"
 
-        except Exception as e:
-            conn.rollback()
-            conn.close()
-            return False, str(e)
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
 
 
 #---------------------------------------------------
 
+    @staticmethod
+    def get_statistics():
+        """
+        Compteurs du tableau de bord, lus dans admin_stats (tenue à jour par
+        triggers) : le coût ne dépend pas du nombre d'utilisateurs ni de
+        rendez-vous.
+        """
+        stats = {
+            "total_users": 0, "total_doctors": 0, "total_patients": 0, "active_doctors": 0,
+            "total_appointments": 0, "users_by_role": {}, "users_by_status": {},
+            "appointments_by_status": {}, "doctors_by_specialty": []
+        }
+
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return stats
+
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.ADMIN_STATS)
+                rows = cursor.fetchall()
+                cursor.close()
+            except Exception as e:
+                print("GET_STATISTICS ERROR:", e)
+                return stats
+
+        for metric, key, specialty, count in rows:
+            count = int(count)
+            if count == 0:
+                continue
+            if metric == "users":
+                role, _, status = key.partition("/")
+                stats["users_by_role"][role] = stats["users_by_role"].get(role, 0) + count
+                stats["users_by_status"][status] = stats["users_by_status"].get(status, 0) + count
+                if key == "doctor/active":
+                    stats["active_doctors"] = count
+            elif metric == "appointments":
+                stats["appointments_by_status"][key] = count
+            elif metric == "specialty_doctors" and specialty:
+                stats["doctors_by_specialty"].append({"name": specialty, "count": count})
+
+        stats["total_users"] = sum(stats["users_by_role"].values())
+        stats["total_doctors"] = stats["users_by_role"].get("doctor", 0)
+        stats["total_patients"] = stats["users_by_role"].get("patient", 0)
+        stats["total_appointments"] = sum(stats["appointments_by_status"].values())
+        stats["doctors_by_specialty"].sort(key=lambda s: (-s["count"], s["name"]))
+        return stats
+
+    @staticmethod
+    def rebuild_statistics():
+        """Recalcule admin_stats depuis les tables (après un TRUNCATE ou une restauration)."""
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
+
+            try:
+                cursor = conn.cursor()
+                cursor.execute("LOCK TABLE users, appointments, doctor_specialties IN SHARE MODE")
+                cursor.execute("SELECT healthtime_rebuild_admin_stats()")
+                conn.commit()
+                cursor.close()
+                return True, "Statistics rebuilt"
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
+
     @staticmethod
     def get_all_users():
-        conn = get_connection()
-        if not conn: return []
-        try:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("SELECT id, name, username, role, status FROM users ORDER BY role, name")
-            users = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return users
-        except Exception as e:
-            if conn: conn.close()
-            return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn: return []
+            try:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                cursor.execute("SELECT id, name, username, role, status FROM users ORDER BY role, name")
+                users = cursor.fetchall()
+                cursor.close()
+                return users
+            except Exception as e:
+                return []
         
 
     @staticmethod
     def toggle_user_status(user_id, current_status):
         new_status = 'inactive' if current_status == 'active' else 'active'
-        conn = get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE users SET status=%s WHERE id=%s", (new_status, user_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return True, f"User is now {new_status}"
-        except Exception as e:
-            if conn: conn.rollback(); conn.close()
-            return False, str(e)
+        with pooled_connection() as conn:
+            if not conn: return False, "Database connection failed"
+            try:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE users SET status=%s WHERE id=%s RETURNING role", (new_status, user_id))
+                row = cursor.fetchone()
+                # Un docteur désactivé depuis la liste des utilisateurs perd
+                # aussi ses rendez-vous à venir, comme avec deactivate_doctor
+                if row and row[0] == 'doctor' and new_status == 'inactive':
+                    AppointmentDAO.cancel_doctor_range(cursor, user_id, datetime.now(), None, "doctor_deactivated")
+                conn.commit()
+                cursor.close()
+                availability_index.clear()
+                return True, f"User is now {new_status}"
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
         
 
     @staticmethod
     def add_specialty(name):
-        conn = get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO specialties (name) VALUES (%s)", (name,))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return True, "Specialty added"
-        except Exception as e:
-            if conn: conn.rollback(); conn.close()
-            return False, str(e)
+        with pooled_connection() as conn:
+            if not conn: return False, "Database connection failed"
+            try:
+                cursor = conn.cursor()
+                cursor.execute("INSERT INTO specialties (name) VALUES (%s)", (name,))
+                conn.commit()
+                cursor.close()
+                return True, "Specialty added"
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
 
     @staticmethod
     def delete_specialty(s_id):
-        conn = get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM specialties WHERE id=%s", (s_id,))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return True, "Specialty deleted"
-        except Exception as e:
-            if conn: conn.rollback(); conn.close()
-            return False, "Cannot delete (it may be linked to doctors)"
+        with pooled_connection() as conn:
+            if not conn: return False, "Database connection failed"
+            try:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM specialties WHERE id=%s", (s_id,))
+                conn.commit()
+                cursor.close()
+                availability_index.clear()
+                return True, "Specialty deleted"
+            except Exception as e:
+                conn.rollback()
+                return False, "Cannot delete (it may be linked to doctors)"
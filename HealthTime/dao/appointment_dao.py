@@ -1,47 +1,100 @@
-from database.db import get_connection
-from datetime import datetime, timedelta
+import psycopg2.errors
+from database.db import pooled_connection
+from database import availability_index, idempotency, queries
+from database.partitions import booking_horizon
+from dao.waitlist_dao import WaitlistDAO
+from datetime import date, datetime, timedelta
+from config import settings
+
+# create_appointment() refusals; the web tier shows them with its own wording
+SLOT_TAKEN = "This slot is no longer available"
+PATIENT_BUSY = "You already have an appointment at this time"
+TOO_FAR_AHEAD = "Bookings are not open that far ahead yet"
+
+# book_first_available() runs BOOK_FIRST_AVAILABLE again while the doctor it
+# picked was taken by a concurrent booker
+FIRST_AVAILABLE_ATTEMPTS = 3
+
+
+def beyond_horizon(day):
+    """True when `day` (a date, datetime or "YYYY-MM-DD") is after booking_horizon()."""
+    if isinstance(day, datetime):
+        day = day.date()
+    elif not isinstance(day, date):
+        day = datetime.strptime(str(day), "%Y-%m-%d").date()
+    return day > booking_horizon()
+
+
+def next_slots_window(limit=None, days=None):
+    """(now, last day, limit) of a "next available slots" search."""
+    now = datetime.now()
+    until = now.date() + timedelta(days=settings.NEXT_SLOTS_HORIZON_DAYS if days is None else days)
+    return now, min(until, booking_horizon()), settings.NEXT_SLOTS_LIMIT if limit is None else limit
+
+
+def month_window(month):
+    """
+    (first day, last day, now) of the heatmap of the month of `month` (a
+    date or "YYYY-MM-DD"), past days and days after booking_horizon() left
+    out; None when no day is left.
+    """
+    if isinstance(month, datetime):
+        month = month.date()
+    elif not isinstance(month, date):
+        month = datetime.strptime(str(month), "%Y-%m-%d").date()
+    now = datetime.now()
+    first = month.replace(day=1)
+    last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    first = max(first, now.date())
+    last = min(last, booking_horizon())
+    return (first, last, now) if first <= last else None
+
+
+def _load_specialty_doctors(cursor, specialty_id, started):
+    # The availability index needs them to know which writes touch a specialty
+    if availability_index.enabled() and not availability_index.knows_specialty(specialty_id):
+        queries.execute(cursor, queries.SPECIALTY_DOCTOR_IDS, (specialty_id,))
+        availability_index.set_specialty_doctors(specialty_id, [r[0] for r in cursor.fetchall()], started,
+                                               cursor.connection)
 
 class AppointmentDAO:
 
     @staticmethod
     def get_active_doctors():
         """Return list of active doctors as dicts [{'id': ..., 'name': ...}]"""
-        conn = get_connection()
-        if not conn:
-            return []
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, name FROM users WHERE role='doctor' AND status='active'")
-            results = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return [{"id": r[0], "name": r[1]} for r in results]
-        except:
-            conn.close()
-            return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.ACTIVE_DOCTORS)
+                results = cursor.fetchall()
+                cursor.close()
+                return [{"id": r[0], "name": r[1]} for r in results]
+            except:
+                return []
 
     @staticmethod
     def get_appointments_for_doctor_on_date(doctor_id, date):
         """Return list of times already booked for doctor on given date"""
-        conn = get_connection()
-        if not conn:
-            return []
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                    SELECT appointment_date
-                    FROM appointments
-                    WHERE doctor_id=%s
-                    AND DATE(appointment_date)=%s
-                    AND status='scheduled'
-            """, (doctor_id, date))
-            results = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return [r[0].strftime("%H:%M") for r in results]
-        except:
-            conn.close()
-            return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                        SELECT appointment_date
+                        FROM appointments
+                        WHERE doctor_id=%(doctor_id)s
+                        AND slot_date=%(date)s
+                        AND status='scheduled'
+                        AND appointment_date >= %(date)s AND appointment_date < %(date)s::date + 1
+                """, {"doctor_id": doctor_id, "date": date})
+                results = cursor.fetchall()
+                cursor.close()
+                return [r[0].strftime("%H:%M") for r in results]
+            except:
+                return []
 
     @staticmethod
     def get_available_slots_for_doctor(doctor_id, date):
@@ -49,36 +102,46 @@ class AppointmentDAO:
         Retourne les créneaux disponibles pour un docteur spécifique à une date donnée
         en croisant la table time_slots et la table appointments.
         """
-        conn = get_connection()
-        if not conn:
+        if beyond_horizon(date):
             return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
 
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT ts.slot_hour
-                FROM time_slots ts
-                WHERE ts.doctor_id = %s
-                AND ts.slot_date = %s
-                AND ts.status = 'available'
-                AND NOT EXISTS (
-                    SELECT 1 FROM appointments a
-                    WHERE a.doctor_id = ts.doctor_id
-                    AND DATE(a.appointment_date) = ts.slot_date
-                    AND EXTRACT(HOUR FROM a.appointment_date) = ts.slot_hour
-                    AND a.status = 'scheduled'
-                )
-                ORDER BY ts.slot_hour
-            """, (doctor_id, date))
-
-            rows = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return [f"{r[0]:02d}:00" for r in rows]
-        except Exception as e:
-            if conn: conn.close()
-            print(f"Erreur get_available_slots_for_doctor: {e}")
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.AVAILABLE_SLOTS_FOR_DOCTOR, (doctor_id, date))
+
+                rows = cursor.fetchall()
+                cursor.close()
+                return [f"{r[0]:02d}:00" for r in rows]
+            except Exception as e:
+                print(f"Erreur get_available_slots_for_doctor: {e}")
+                return []
+
+    @staticmethod
+    def get_free_periods_for_doctor(doctor_id, date, duration_minutes):
+        """
+        Heures de début ("HH:MM") d'une consultation de duration_minutes chez
+        le docteur à cette date : heures libres et minutes restantes des
+        heures entamées par des consultations plus courtes.
+        """
+        if beyond_horizon(date):
             return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.FREE_PERIODS_FOR_DOCTOR, (doctor_id, date, int(duration_minutes)))
+
+                rows = cursor.fetchall()
+                cursor.close()
+                return [r[0].strftime("%H:%M") for r in rows]
+            except Exception as e:
+                print(f"Erreur get_free_periods_for_doctor: {e}")
+                return []
 
     @staticmethod
     def get_available_slots_by_specialty(specialty_id, date):
@@ -86,417 +149,577 @@ class AppointmentDAO:
         RECHERCHE MULTI-DOCTEURS (Option 'Peu importe')
         Retourne une liste de dictionnaires contenant l'heure, l'ID et le nom du docteur
         pour tous les praticiens d'une spécialité ayant des créneaux libres.
+        Servie par l'index de disponibilités quand elle y est.
         """
-        conn = get_connection()
-        if not conn:
+        if beyond_horizon(date):
             return []
-        try:
-            cursor = conn.cursor()
-            query = """
-                SELECT ts.slot_hour, u.id, u.name
-                FROM time_slots ts
-                JOIN users u ON ts.doctor_id = u.id
-                JOIN doctor_specialties ds ON u.id = ds.doctor_id
-                WHERE ds.specialty_id = %s
-                AND ts.slot_date = %s
-                AND ts.status = 'available'
-                AND u.status = 'active'
-                AND NOT EXISTS (
-                    SELECT 1 FROM appointments a
-                    WHERE a.doctor_id = ts.doctor_id
-                    AND DATE(a.appointment_date) = ts.slot_date
-                    AND EXTRACT(HOUR FROM a.appointment_date) = ts.slot_hour
-                    AND a.status = 'scheduled'
-                )
-                ORDER BY ts.slot_hour, u.name
-            """
-            cursor.execute(query, (specialty_id, date))
-            rows = cursor.fetchall()
-            cursor.close()
-            conn.close()
-
-            return [
-                {
-                    "time": f"{r[0]:02d}:00",
-                    "doctor_id": r[1],
-                    "doctor_name": r[2]
-                } for r in rows
-            ]
-        except Exception as e:
-            if conn: conn.close()
-            print(f"Erreur get_available_slots_by_specialty: {e}")
+        slots = availability_index.get("slots", specialty_id, date)
+        if slots is not None:
+            return slots
+
+        started = availability_index.read_started()
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.AVAILABLE_SLOTS_BY_SPECIALTY, (specialty_id, date))
+                rows = cursor.fetchall()
+                _load_specialty_doctors(cursor, specialty_id, started)
+                cursor.close()
+
+                slots = [
+                    {
+                        "time": f"{r[0]:02d}:00",
+                        "doctor_id": r[1],
+                        "doctor_name": r[2]
+                    } for r in rows
+                ]
+                availability_index.store("slots", specialty_id, date, slots, started, conn)
+                return slots
+            except Exception as e:
+                print(f"Erreur get_available_slots_by_specialty: {e}")
+                return []
+
+    @staticmethod
+    def get_free_hours_by_specialty(specialty_id, date):
+        """
+        Option 'Peu importe' : une entrée par heure où au moins un praticien
+        de la spécialité est libre, avec le nombre de praticiens libres.
+        Servie par l'index de disponibilités quand elle y est.
+        """
+        if beyond_horizon(date):
             return []
+        hours = availability_index.get("free_hours", specialty_id, date)
+        if hours is not None:
+            return hours
+
+        started = availability_index.read_started()
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.FREE_HOURS_BY_SPECIALTY, (specialty_id, date))
+                rows = cursor.fetchall()
+                _load_specialty_doctors(cursor, specialty_id, started)
+                cursor.close()
+                hours = [{"time": f"{r[0]:02d}:00", "doctor_count": r[1]} for r in rows]
+                availability_index.store("free_hours", specialty_id, date, hours, started, conn)
+                return hours
+            except Exception as e:
+                print(f"Erreur get_free_hours_by_specialty: {e}")
+                return []
 
+    @staticmethod
+    def get_next_slots_for_doctor(doctor_id, limit=None, days=None):
+        """
+        Les `limit` prochains créneaux libres du docteur à partir de
+        maintenant, sur `days` jours (NEXT_SLOTS_LIMIT et
+        NEXT_SLOTS_HORIZON_DAYS par défaut), en une seule requête.
+        """
+        now, until, limit = next_slots_window(limit, days)
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.NEXT_FREE_SLOTS_FOR_DOCTOR, (doctor_id, now, until, limit))
+                rows = cursor.fetchall()
+                cursor.close()
+                return [{"date": r[0].strftime("%Y-%m-%d"), "time": f"{r[1]:02d}:00"} for r in rows]
+            except Exception as e:
+                print(f"Erreur get_next_slots_for_doctor: {e}")
+                return []
 
     @staticmethod
-    def create_appointment(patient_id, doctor_id, date_str, time_str, urgent=False):
-        """Crée un rendez-vous avec gestion optionnelle du flag urgent"""
-        conn = get_connection()
-        if not conn:
-            return False, "Database connection failed"
+    def get_next_slots_by_specialty(specialty_id, limit=None, days=None):
+        """
+        Option 'Peu importe' de la recherche précédente : les prochaines
+        heures où au moins un praticien de la spécialité est libre, avec
+        le nombre de praticiens libres.
+        """
+        now, until, limit = next_slots_window(limit, days)
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.NEXT_FREE_HOURS_BY_SPECIALTY, (specialty_id, now, until, limit))
+                rows = cursor.fetchall()
+                cursor.close()
+                return [
+                    {"date": r[0].strftime("%Y-%m-%d"), "time": f"{r[1]:02d}:00", "doctor_count": r[2]}
+                    for r in rows
+                ]
+            except Exception as e:
+                print(f"Erreur get_next_slots_by_specialty: {e}")
+                return []
 
-        try:
-            cursor = conn.cursor()
-            appointment_datetime = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
-
-            # Note: Assurez-vous que votre table 'appointments' possède la colonne 'urgent' (BOOLEAN)
-            cursor.execute("""
-                INSERT INTO appointments (patient_id, doctor_id, appointment_date, status, urgent)
-                VALUES (%s, %s, %s, 'scheduled', %s)
-            """, (patient_id, doctor_id, appointment_datetime, urgent))
-
-            cursor.execute("""
-                UPDATE time_slots
-                SET status = 'booked'
-                WHERE doctor_id = %s
-                AND slot_date = %s
-                AND slot_hour = %s
-            """, (doctor_id, date_str, appointment_datetime.hour))
-
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return True, "Appointment booked successfully"
-        except Exception as e:
-            if conn: conn.rollback(); conn.close()
-            return False, str(e)
+    @staticmethod
+    def get_month_free_slots_for_doctor(doctor_id, month):
+        """
+        Carte du mois de `month` pour le calendrier de réservation : le
+        nombre d'heures libres du docteur par jour, en une seule requête.
+        Les jours sans heure libre sont absents de la liste.
+        """
+        window = month_window(month)
+        if window is None:
+            return []
+        first, last, now = window
+        days = availability_index.get("doctor_month", doctor_id, first)
+        if days is not None:
+            return days
+
+        started = availability_index.read_started()
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.MONTH_FREE_SLOTS_FOR_DOCTOR, (doctor_id, first, last, now))
+                rows = cursor.fetchall()
+                cursor.close()
+                days = [{"date": r[0].strftime("%Y-%m-%d"), "free_slots": r[1]} for r in rows]
+                availability_index.store("doctor_month", doctor_id, first, days, started, conn)
+                return days
+            except Exception as e:
+                print(f"Erreur get_month_free_slots_for_doctor: {e}")
+                return []
 
+    @staticmethod
+    def get_month_free_slots_by_specialty(specialty_id, month):
+        """
+        Même carte pour l'option 'Peu importe' : les heures libres de tous
+        les praticiens actifs de la spécialité, additionnées par jour.
+        """
+        window = month_window(month)
+        if window is None:
+            return []
+        first, last, now = window
+        days = availability_index.get("month", specialty_id, first)
+        if days is not None:
+            return days
+
+        started = availability_index.read_started()
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.MONTH_FREE_SLOTS_BY_SPECIALTY, (specialty_id, first, last, now))
+                rows = cursor.fetchall()
+                _load_specialty_doctors(cursor, specialty_id, started)
+                cursor.close()
+                days = [{"date": r[0].strftime("%Y-%m-%d"), "free_slots": r[1]} for r in rows]
+                availability_index.store("month", specialty_id, first, days, started, conn)
+                return days
+            except Exception as e:
+                print(f"Erreur get_month_free_slots_by_specialty: {e}")
+                return []
+
+    @staticmethod
+    def create_appointment(patient_id, doctor_id, date_str, time_str, urgent=False, idempotency_key=None,
+                           duration_minutes=60):
+        """
+        Crée un rendez-vous avec gestion optionnelle du flag urgent.
+        Avec une idempotency_key, une requête rejouée renvoie le résultat de la première.
+        Une durée de moins de 60 minutes réserve une période libre de
+        get_free_periods_for_doctor() au lieu d'une heure entière.
+        """
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
+
+            try:
+                cursor = conn.cursor()
+                appointment_datetime = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
+                if beyond_horizon(appointment_datetime):
+                    cursor.close()
+                    return False, TOO_FAR_AHEAD
+
+                if idempotency_key:
+                    stored = idempotency.claim(cursor, patient_id, idempotency_key, "book")
+                    if stored:
+                        cursor.close()
+                        return stored
+
+                # Un seul aller-retour : réserve le créneau et crée le rendez-vous, ou rien
+                if int(duration_minutes) < 60:
+                    queries.execute(cursor, queries.BOOK_APPOINTMENT_PERIOD,
+                                    (patient_id, doctor_id, appointment_datetime, int(duration_minutes), urgent))
+                else:
+                    queries.execute(cursor, queries.BOOK_APPOINTMENT,
+                                    (patient_id, doctor_id, appointment_datetime, urgent))
+                appointment_id, patient_busy = cursor.fetchone()
+
+                if appointment_id is None:
+                    result = (False, PATIENT_BUSY if patient_busy else SLOT_TAKEN)
+                else:
+                    result = (True, "Appointment booked successfully")
+                if idempotency_key:
+                    idempotency.save(cursor, patient_id, idempotency_key, *result)
+
+                conn.commit()
+                cursor.close()
+                if appointment_id is not None:
+                    availability_index.invalidate(doctor_id, appointment_datetime)
+                return result
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
+
+
+    @staticmethod
+    def book_first_available(patient_id, specialty_id, date_str, time_str, urgent=False, idempotency_key=None):
+        """
+        Option 'Peu importe' : réserve l'heure demandée chez n'importe quel
+        docteur actif de la spécialité ayant ce créneau libre, en une seule
+        transaction. Retourne (True, nom du docteur) ou (False, message).
+        """
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
+
+            try:
+                cursor = conn.cursor()
+                appointment_datetime = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
+                if beyond_horizon(appointment_datetime):
+                    cursor.close()
+                    return False, TOO_FAR_AHEAD
+
+                if idempotency_key:
+                    stored = idempotency.claim(cursor, patient_id, idempotency_key, "book")
+                    if stored:
+                        cursor.close()
+                        return stored
+
+                for _ in range(FIRST_AVAILABLE_ATTEMPTS):
+                    queries.execute(cursor, queries.BOOK_FIRST_AVAILABLE,
+                                    (patient_id, specialty_id, appointment_datetime, urgent))
+                    appointment_id, doctor_id, doctor_name, patient_busy, contended = cursor.fetchone()
+                    if appointment_id is not None or patient_busy or not contended:
+                        break
+
+                if appointment_id is None:
+                    result = (False, PATIENT_BUSY if patient_busy else SLOT_TAKEN)
+                else:
+                    result = (True, doctor_name)
+                if idempotency_key:
+                    idempotency.save(cursor, patient_id, idempotency_key, *result)
+
+                conn.commit()
+                cursor.close()
+                if appointment_id is not None:
+                    availability_index.invalidate(doctor_id, appointment_datetime)
+                return result
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
 
     @staticmethod
     def get_patient_appointments(patient_id):
         """Retourne tous les rendez-vous d'un patient avec le flag urgent"""
-        conn = get_connection()
-        if not conn:
-            return []
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT a.id, u.name, a.appointment_date, a.status, a.urgent
-                FROM appointments a
-                JOIN users u ON a.doctor_id = u.id
-                WHERE a.patient_id=%s
-                ORDER BY a.appointment_date ASC
-            """, (patient_id,))
-            results = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            
-            appointments = []
-            for r in results:
-                appointments.append({
-                    "id": r[0],
-                    "doctor_name": r[1],
-                    "date": r[2].strftime("%Y-%m-%d"),
-                    "time": r[2].strftime("%H:%M"),
-                    "status": r[3],
-                    "urgent": r[4] # Récupération de l'état urgent
-                })
-            return appointments
-        except:
-            if conn: conn.close()
-            return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.PATIENT_APPOINTMENTS, (patient_id,))
+                results = cursor.fetchall()
+                cursor.close()
+                
+                appointments = []
+                for r in results:
+                    appointments.append({
+                        "id": r[0],
+                        "doctor_name": r[1],
+                        "date": r[2].strftime("%Y-%m-%d"),
+                        "time": r[2].strftime("%H:%M"),
+                        "status": r[3],
+                        "urgent": r[4] # Récupération de l'état urgent
+                    })
+                return appointments
+            except:
+                return []
         
 
     @staticmethod
-    def cancel_appointment(appointment_id, patient_id):
-        conn = get_connection()
-        if not conn:
-            return False, "Database connection failed"
+    def cancel_appointment(appointment_id, patient_id, idempotency_key=None):
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
 
-        try:
-            cursor = conn.cursor()
+            try:
+                cursor = conn.cursor()
+
+                if idempotency_key:
+                    stored = idempotency.claim(cursor, patient_id, idempotency_key, "cancel")
+                    if stored:
+                        cursor.close()
+                        return stored
+
+                queries.execute(cursor, queries.CANCEL_PATIENT_APPOINTMENT, (appointment_id, patient_id))
 
-            cursor.execute("""
-                SELECT doctor_id, appointment_date
-                FROM appointments
-                WHERE id=%s AND patient_id=%s
-            """, (appointment_id, patient_id))
+                row = cursor.fetchone()
 
-            row = cursor.fetchone()
+                if not row:
+                    conn.rollback()
+                    cursor.close()
+                    return False, "Appointment not found or not yours"
 
-            if not row:
+                doctor_id = row[0]
+                appointment_date = row[1]
+                hour = appointment_date.hour
+                date_str = appointment_date.date()
+
+                queries.execute(cursor, queries.RELEASE_SLOT, (doctor_id, date_str, hour))
+                WaitlistDAO.reallocate(cursor, doctor_id, appointment_date, patient_id)
+
+                if idempotency_key:
+                    idempotency.save(cursor, patient_id, idempotency_key, True, "Appointment canceled")
+
+                conn.commit()
                 cursor.close()
-                conn.close()
-                return False, "Appointment not found or not yours"
-
-            doctor_id = row[0]
-            appointment_date = row[1]
-            hour = appointment_date.hour
-            date_str = appointment_date.date()
-
-            cursor.execute("""
-                UPDATE appointments
-                SET status='canceled'
-                WHERE id=%s AND patient_id=%s
-            """, (appointment_id, patient_id))
-
-            cursor.execute("""
-                UPDATE time_slots
-                SET status='available'
-                WHERE doctor_id=%s
-                AND slot_date=%s
-                AND slot_hour=%s
-            """, (doctor_id, date_str, hour))
-
-            conn.commit()
-            cursor.close()
-            conn.close()
-
-            return True, "Appointment canceled"
-
-        except Exception as e:
-            conn.rollback()
-            conn.close()
-            return False, str(e)
+                availability_index.invalidate(doctor_id, date_str)
+
+                return True, "Appointment canceled"
+
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
 
     @staticmethod
-    def modify_appointment(appointment_id, doctor_id, new_date_str, new_time_str):
-        conn = get_connection()
-        if not conn:
-            return False, "Database connection failed"
-        try:
-            cursor = conn.cursor()
-            new_datetime = datetime.strptime(f"{new_date_str} {new_time_str}", "%Y-%m-%d %H:%M")
-            cursor.execute("""
-                UPDATE appointments
-                SET doctor_id=%s, appointment_date=%s, status='scheduled'
-                WHERE id=%s
-            """, (doctor_id, new_datetime, appointment_id))
-            if cursor.rowcount == 0:
+    def modify_appointment(appointment_id, doctor_id, new_date_str, new_time_str, urgent=None,
+                           patient_id=None, idempotency_key=None):
+        """
+        Déplace le rendez-vous vers le créneau du docteur donné, en une
+        transaction : le rendez-vous est verrouillé, le nouveau créneau
+        vérifié et réservé comme par create_appointment(), puis l'ancien
+        libéré (et proposé à la liste d'attente). urgent=None garde le flag.
+        Avec patient_id, seul un rendez-vous de ce patient est déplacé ; avec
+        une idempotency_key en plus, une requête rejouée renvoie le résultat
+        de la première.
+        """
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
+            try:
+                cursor = conn.cursor()
+                new_datetime = datetime.strptime(f"{new_date_str} {new_time_str}", "%Y-%m-%d %H:%M")
+                if beyond_horizon(new_datetime):
+                    cursor.close()
+                    return False, TOO_FAR_AHEAD
+
+                if idempotency_key and patient_id is not None:
+                    stored = idempotency.claim(cursor, patient_id, idempotency_key, "reschedule")
+                    if stored:
+                        cursor.close()
+                        return stored
+
+                queries.execute(cursor, queries.APPOINTMENT_FOR_RESCHEDULE, (appointment_id,))
+                row = cursor.fetchone()
+                moved = None
+                if not row or (patient_id is not None and row[2] != int(patient_id)):
+                    result = (False, "Appointment not found")
+                elif (row[0], row[1]) == (int(doctor_id), new_datetime):
+                    result = (True, "Appointment modified successfully")
+                else:
+                    old_doctor_id, old_datetime, owner_id = row
+                    params = (appointment_id, old_datetime, doctor_id, new_datetime, urgent)
+                    cursor.execute("SAVEPOINT reschedule")
+                    try:
+                        queries.execute(cursor, queries.RESCHEDULE_APPOINTMENT, params)
+                    except (psycopg2.errors.UniqueViolation, psycopg2.errors.ExclusionViolation):
+                        # Hour booked by a transaction that committed meanwhile:
+                        # a second run sees it and refuses cleanly
+                        cursor.execute("ROLLBACK TO SAVEPOINT reschedule")
+                        queries.execute(cursor, queries.RESCHEDULE_APPOINTMENT, params)
+                    moved, patient_busy = cursor.fetchone()
+
+                    if moved is None:
+                        result = (False, PATIENT_BUSY if patient_busy else SLOT_TAKEN)
+                    else:
+                        queries.execute(cursor, queries.RELEASE_SLOT,
+                                        (old_doctor_id, old_datetime.date(), old_datetime.hour))
+                        WaitlistDAO.reallocate(cursor, old_doctor_id, old_datetime, owner_id)
+                        result = (True, "Appointment modified successfully")
+
+                if idempotency_key and patient_id is not None:
+                    idempotency.save(cursor, patient_id, idempotency_key, *result)
+
+                conn.commit()
                 cursor.close()
-                conn.close()
-                return False, "Appointment not found"
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return True, "Appointment modified successfully"
-        except Exception as e:
-            conn.close()
-            return False, str(e)
-        
+                if moved is not None:
+                    availability_index.invalidate(old_doctor_id, old_datetime)
+                    availability_index.invalidate(doctor_id, new_datetime)
+                return result
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
 
     @staticmethod
     def get_upcoming_appointments(user_id, role, hours=24):
         """
         Returns appointments happening within the next X hours for a doctor OR a patient
         """
-        conn = get_connection()
-        if not conn:
-            return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
 
-        try:
             cursor = conn.cursor()
-            
-            now = datetime.now()
-            limit_time = now + timedelta(hours=hours)
-
-            if role == 'doctor':
-                query = """
-                    SELECT a.appointment_date, u.name
-                    FROM appointments a
-                    JOIN users u ON a.patient_id = u.id
-                    WHERE a.doctor_id = %s
-                    AND a.status = 'scheduled'
-                    AND a.appointment_date BETWEEN %s AND %s
-                    ORDER BY a.appointment_date
-                """
-            else:
-                query = """
-                    SELECT a.appointment_date, u.name
-                    FROM appointments a
-                    JOIN users u ON a.doctor_id = u.id
-                    WHERE a.patient_id = %s
-                    AND a.status = 'scheduled'
-                    AND a.appointment_date BETWEEN %s AND %s
-                    ORDER BY a.appointment_date
-                """
-
-            cursor.execute(query, (user_id, now, limit_time))
-            results = cursor.fetchall()
-
-            return [{
-                "date": r[0].strftime("%d/%m/%Y"), 
-                "time": r[0].strftime("%H:%M"),
-                "contact_name": r[1]
-            } for r in results]
-
-        except Exception as e:
-            print(f"Erreur get_upcoming_appointments: {e}")
-            return []
-        finally:
-            if conn:
+            try:
+                now = datetime.now()
+                limit_time = now + timedelta(hours=hours)
+
+                if role == 'doctor':
+                    query = queries.UPCOMING_DOCTOR_APPOINTMENTS
+                else:
+                    query = queries.UPCOMING_PATIENT_APPOINTMENTS
+
+                queries.execute(cursor, query, (user_id, now, limit_time))
+                results = cursor.fetchall()
+
+                return [{
+                    "date": r[0].strftime("%d/%m/%Y"), 
+                    "time": r[0].strftime("%H:%M"),
+                    "contact_name": r[1]
+                } for r in results]
+
+            except Exception as e:
+                print(f"Erreur get_upcoming_appointments: {e}")
+                return []
+            finally:
                 cursor.close()
-                conn.close()
 
     @staticmethod
-    def get_available_slots_for_doctor(doctor_id, date):
-        """
-        Return available slots from doctor time_slots
-        AND not already booked
-        """
-        conn = get_connection()
-        if not conn:
-            return []
+    def get_appointment_by_doctor_date_hour(doctor_id, date, hour):
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return None
 
-        try:
-            cursor = conn.cursor()
+            try:
+                cursor = conn.cursor()
 
-            cursor.execute("""
-                SELECT ts.slot_hour
-                FROM time_slots ts
-                WHERE ts.doctor_id = %s
-                AND ts.slot_date = %s
-                AND ts.status = 'available'
-                AND NOT EXISTS (
-                    SELECT 1 FROM appointments a
-                    WHERE a.doctor_id = ts.doctor_id
-                    AND DATE(a.appointment_date) = ts.slot_date
-                    AND EXTRACT(HOUR FROM a.appointment_date) = ts.slot_hour
-                    AND a.status = 'scheduled'
-                )
-                ORDER BY ts.slot_hour
-            """, (doctor_id, date))
-
-            rows = cursor.fetchall()
-            cursor.close()
-            conn.close()
-
-            return [f"{r[0]:02d}:00" for r in rows]
-
-        except Exception as e:
-            conn.close()
-            return []
+                queries.execute(cursor, queries.APPOINTMENT_BY_DOCTOR_DATE_HOUR, (doctor_id, date, hour))
 
-    @staticmethod
-    def get_appointment_by_doctor_date_hour(doctor_id, date, hour):
-        conn = get_connection()
-        if not conn:
-            return None
-
-        try:
-            cursor = conn.cursor()
+                row = cursor.fetchone()
+                cursor.close()
 
-            cursor.execute("""
-                SELECT a.id, u.name, a.appointment_date, a.status
-                FROM appointments a
-                JOIN users u ON a.patient_id = u.id
-                WHERE a.doctor_id = %s
-                AND DATE(a.appointment_date) = %s
-                AND EXTRACT(HOUR FROM a.appointment_date) = %s
-                AND a.status = 'scheduled'
-            """, (doctor_id, date, hour))
-
-            row = cursor.fetchone()
-            cursor.close()
-            conn.close()
-
-            if not row:
-                return None
+                if not row:
+                    return None
 
-            return {
-                "id": row[0],
-                "patient_name": row[1],
-                "datetime": row[2],
-                "status": row[3]
-            }
+                return {
+                    "id": row[0],
+                    "patient_name": row[1],
+                    "datetime": row[2],
+                    "status": row[3]
+                }
 
-        except Exception as e:
-            conn.close()
-            return None
+            except Exception as e:
+                return None
 
     @staticmethod
     def cancel_appointment_by_doctor(appointment_id):
-        conn = get_connection()
-        if not conn:
-            return False, "Database connection failed"
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
 
-        try:
-            cursor = conn.cursor()
+            try:
+                cursor = conn.cursor()
 
-            cursor.execute("""
-                SELECT doctor_id, appointment_date
-                FROM appointments
-                WHERE id = %s
-            """, (appointment_id,))
+                queries.execute(cursor, queries.CANCEL_APPOINTMENT_BY_DOCTOR, (appointment_id,))
 
-            row = cursor.fetchone()
-            if not row:
+                row = cursor.fetchone()
+                if not row:
+                    conn.rollback()
+                    cursor.close()
+                    return False, "Appointment not found"
+
+                doctor_id = row[0]
+                appointment_datetime = row[1]
+                patient_id = row[2]
+
+                slot_date = appointment_datetime.date()
+                slot_hour = appointment_datetime.hour
+
+                queries.execute(cursor, queries.RELEASE_SLOT, (doctor_id, slot_date, slot_hour))
+                WaitlistDAO.reallocate(cursor, doctor_id, appointment_datetime, patient_id)
+
+                conn.commit()
                 cursor.close()
-                conn.close()
-                return False, "Appointment not found"
-
-            doctor_id = row[0]
-            appointment_datetime = row[1]
-
-            slot_date = appointment_datetime.date()
-            slot_hour = appointment_datetime.hour
-
-            cursor.execute("""
-                UPDATE appointments
-                SET status = 'canceled_by_doctor'
-                WHERE id = %s
-            """, (appointment_id,))
-
-            cursor.execute("""
-                UPDATE time_slots
-                SET status = 'available'
-                WHERE doctor_id = %s
-                AND slot_date = %s
-                AND slot_hour = %s
-            """, (doctor_id, slot_date, slot_hour))
-
-            conn.commit()
-            cursor.close()
-            conn.close()
-
-            return True, "Appointment canceled successfully"
-
-        except Exception as e:
-            conn.rollback()
-            conn.close()
-            return False, str(e)
+                availability_index.invalidate(doctor_id, slot_date)
+
+                return True, "Appointment canceled successfully"
+
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
         
     @staticmethod
-    def get_doctor_appointments(doctor_id):
-        conn = get_connection()
-        if not conn:
-            return []
+    def cancel_doctor_range(cursor, doctor_id, start, end, kind):
+        """
+        Annule, dans la transaction du curseur, tous les rendez-vous à venir
+        du docteur entre start et end (exclu, None : sans fin), ferme leurs
+        créneaux et prévient chaque patient (notification `kind`). Retourne
+        le nombre de rendez-vous annulés et les jours touchés, à invalider
+        dans l'index une fois la transaction validée.
+        """
+        queries.execute(cursor, queries.CANCEL_DOCTOR_APPOINTMENTS, (doctor_id, start, end, kind))
+        count, days = cursor.fetchone()
+        return count, days
 
-        try:
-            cursor = conn.cursor()
+    @staticmethod
+    def cancel_doctor_appointments(doctor_id, date_from, date_to=None):
+        """
+        Absence imprévue : annule en une seule instruction les rendez-vous
+        du docteur du date_from au date_to inclus (sans date_to : tous les
+        rendez-vous à venir). Retourne (True, nombre annulé) ou (False, message).
+        """
+        start = datetime.strptime(str(date_from), "%Y-%m-%d")
+        end = datetime.strptime(str(date_to), "%Y-%m-%d") + timedelta(days=1) if date_to else None
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
+            try:
+                cursor = conn.cursor()
+                count, days = AppointmentDAO.cancel_doctor_range(cursor, doctor_id, start, end, "doctor_absence")
+                conn.commit()
+                cursor.close()
+                for day in days:
+                    availability_index.invalidate(doctor_id, day)
+                return True, count
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
 
-            cursor.execute("""
-                SELECT a.id,
-                       a.appointment_date,
-                       a.status,
-                       a.urgent,
-                       u.name,
-                       u.username
-                FROM appointments a
-                JOIN users u ON a.patient_id = u.id
-                WHERE a.doctor_id = %s
-                ORDER BY a.appointment_date ASC
-            """, (doctor_id,))
-
-            rows = cursor.fetchall()
-            
-            return [
-                {
-                    "id": r[0],
-                    "appointment_date": r[1],
-                    "status": r[2],
-                    "urgent": r[3],         
-                    "patient_name": r[4],    
-                    "patient_email": r[5],   
-                    "patient_phone": "Non disponible"
-                }
-                for r in rows
-            ]
+    @staticmethod
+    def get_doctor_appointments(doctor_id):
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
 
-        except Exception as e:
-            print(f"Erreur SQL dans get_doctor_appointments : {e}")
-            return []
-        finally:
-            if conn:
+            cursor = conn.cursor()
+            try:
+                queries.execute(cursor, queries.DOCTOR_APPOINTMENTS, (doctor_id,))
+
+                rows = cursor.fetchall()
+                
+                return [
+                    {
+                        "id": r[0],
+                        "appointment_date": r[1],
+                        "status": r[2],
+                        "urgent": r[3],         
+                        "patient_name": r[4],    
+                        "patient_email": r[5],   
+                        "patient_phone": "Non disponible"
+                    }
+                    for r in rows
+                ]
+
+            except Exception as e:
+                print(f"Erreur SQL dans get_doctor_appointments : {e}")
+                return []
+            finally:
                 cursor.close()
-                conn.close()
@@ -1,175 +1,456 @@
-from database.db import get_connection
+from database.db import pooled_connection
+from database import availability_index, queries
+from database.day_masks import hours_to_mask, mask_to_hours
 from psycopg2.extras import RealDictCursor
+from dao.appointment_dao import AppointmentDAO
+from datetime import date, datetime, timedelta
+from config import settings
 
 
 class DoctorDAO:
 
     @staticmethod
     def create_time_slot(doctor_id, start_time, end_time):
-        conn = get_connection()
-        if not conn:
-            return False, "DB error"
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "DB error"
 
-        try:
-            cursor = conn.cursor()
+            try:
+                cursor = conn.cursor()
 
-            cursor.execute("""
-                INSERT INTO time_slots (doctor_id, start_time, end_time)
-                VALUES (%s, %s, %s)
-            """, (doctor_id, start_time, end_time))
+                cursor.execute("""
+                    INSERT INTO time_slots (doctor_id, start_time, end_time)
+                    VALUES (%s, %s, %s)
+                """, (doctor_id, start_time, end_time))
 
-            conn.commit()
-            cursor.close()
-            conn.close()
+                conn.commit()
+                cursor.close()
+                availability_index.invalidate_doctor(doctor_id)
 
-            return True, "Time slot created"
+                return True, "Time slot created"
 
-        except Exception as e:
-            conn.rollback()
-            conn.close()
-            return False, str(e)
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
         
     @staticmethod
-    def get_doctor_slots(doctor_id):
-        conn = get_connection()
-        cursor = conn.cursor()
+    def get_doctor_slots(doctor_id, date_from=None, date_to=None):
+        """
+        Créneaux du docteur, heures des règles hebdomadaires comprises
+        ('available'). Sans date_from : tous les créneaux enregistrés, et les
+        règles à partir d'aujourd'hui ; date_to vaut par défaut aujourd'hui
+        + AVAILABILITY_HORIZON_DAYS.
+        """
+        if date_to is None:
+            date_to = date.today() + timedelta(days=settings.AVAILABILITY_HORIZON_DAYS)
+
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
 
-        cursor.execute("""
-            SELECT slot_date, slot_hour, status
-            FROM time_slots
-            WHERE doctor_id=%s
-        """, (doctor_id,))
+            cursor = conn.cursor()
+
+            queries.execute(cursor, queries.DOCTOR_SLOTS, (doctor_id, date_from, date_to))
 
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
+            rows = cursor.fetchall()
+            cursor.close()
 
-        return [
-            {"slot_date": r[0], "slot_hour": r[1], "status": r[2]}
-            for r in rows
-        ]
+            return [
+                {"slot_date": r[0], "slot_hour": r[1], "status": r[2]}
+                for r in rows
+            ]
         
 
     @staticmethod
     def book_slot(slot_id):
-        conn = get_connection()
-        if not conn:
-            return False
+        with pooled_connection() as conn:
+            if not conn:
+                return False
 
-        try:
-            cursor = conn.cursor()
+            try:
+                cursor = conn.cursor()
 
-            cursor.execute("""
-                UPDATE time_slots
-                SET status = 'booked'
-                WHERE id = %s
-            """, (slot_id,))
+                cursor.execute("""
+                    UPDATE time_slots
+                    SET status = 'booked'
+                    WHERE id = %s
+                    RETURNING doctor_id, slot_date
+                """, (slot_id,))
+                row = cursor.fetchone()
 
-            conn.commit()
-            cursor.close()
-            conn.close()
+                conn.commit()
+                cursor.close()
+                if row:
+                    availability_index.invalidate(*row)
 
-            return True
+                return True
 
-        except Exception:
-            conn.rollback()
-            conn.close()
-            return False
+            except Exception:
+                conn.rollback()
+                return False
 
     @staticmethod
     def create_time_slot_day_hour(doctor_id, slot_date, slot_hour):
-        conn = get_connection()
-        if not conn:
-            return False, "DB connection error"
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "DB connection error"
 
-        try:
             cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status)
+                    VALUES (%s, %s, %s, 'available')
+                """, (doctor_id, slot_date, slot_hour))
 
-            cursor.execute("""
-                INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status)
-                VALUES (%s, %s, %s, 'available')
-            """, (doctor_id, slot_date, slot_hour))
+                conn.commit()
 
-            conn.commit()
+                if cursor.rowcount == 0:
+                    return False, "Slot already exists"
 
-            if cursor.rowcount == 0:
-                return False, "Slot already exists"
+                availability_index.invalidate(doctor_id, slot_date)
 
-            return True, "Slot created"
+                return True, "Slot created"
 
-        except Exception as e:
-            conn.rollback()
-            return False, str(e)
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
 
-        finally:
-            cursor.close()
-            conn.close()
+            finally:
+                cursor.close()
 
     @staticmethod
-    def get_appointment_by_doctor_date_hour(doctor_id, date, hour):
-        conn = get_connection()
-        if not conn:
-            return None
+    def create_time_slots(doctor_id, slots):
+        """
+        Ouvre en une seule instruction tous les créneaux (date, heure) donnés ;
+        ceux qui existent déjà sont ignorés. Retourne (créés, ignorés), ou
+        None si la base est injoignable ou refuse l'insertion.
+        """
+        slots = sorted(set(
+            (date.fromisoformat(slot_date) if isinstance(slot_date, str) else slot_date, int(slot_hour))
+            for slot_date, slot_hour in slots
+        ))
+        if not slots:
+            return 0, 0
+
+        with pooled_connection() as conn:
+            if not conn:
+                return None
 
-        try:
             cursor = conn.cursor()
+            try:
+                queries.execute(cursor, queries.CREATE_TIME_SLOTS, (
+                    doctor_id,
+                    [slot_date for slot_date, _ in slots],
+                    [slot_hour for _, slot_hour in slots],
+                ))
+                created = cursor.rowcount
+                conn.commit()
+                for slot_date in {slot_date for slot_date, _ in slots}:
+                    availability_index.invalidate(doctor_id, slot_date)
+                return created, len(slots) - created
 
-            cursor.execute("""
-                SELECT a.id, u.name, a.appointment_date, a.status
-                FROM appointments a
-                JOIN users u ON a.patient_id = u.id
-                WHERE a.doctor_id = %s
-                AND DATE(a.appointment_date) = %s
-                AND EXTRACT(HOUR FROM a.appointment_date) = %s
-                AND a.status = 'scheduled'
-            """, (doctor_id, date, hour))
-
-            row = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                print(f"Erreur create_time_slots: {e}")
+                return None
+
+            finally:
+                cursor.close()
 
-            if not row:
+    @staticmethod
+    def get_appointment_by_doctor_date_hour(doctor_id, date, hour):
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
                 return None
 
-            return {
-                "id": row[0],
-                "patient_name": row[1],
-                "datetime": row[2],
-                "status": row[3]
-            }
+            try:
+                cursor = conn.cursor()
+
+                queries.execute(cursor, queries.APPOINTMENT_BY_DOCTOR_DATE_HOUR, (doctor_id, date, hour))
+
+                row = cursor.fetchone()
+                cursor.close()
+
+                if not row:
+                    return None
+
+                return {
+                    "id": row[0],
+                    "patient_name": row[1],
+                    "datetime": row[2],
+                    "status": row[3]
+                }
 
-        except:
-            conn.close()
-            return None
+            except:
+                return None
 
 
     @staticmethod
     def toggle_doctor_slot(doctor_id, slot_date, slot_hour):
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT id, status FROM time_slots 
-            WHERE doctor_id = %s AND slot_date = %s AND slot_hour = %s
-        """, (doctor_id, slot_date, slot_hour))
-        
-        slot = cursor.fetchone()
-        
-        if slot:
-            if slot[1] == 'available':
-                cursor.execute("DELETE FROM time_slots WHERE id = %s", (slot[0],))
+        """
+        Ouvre ou ferme une heure du semainier (voir set_available_hours et
+        clear_available_hours). Retourne "added", "removed", "booked" (heure
+        réservée) ou None.
+        """
+        bit = 1 << int(slot_hour)
+        with pooled_connection() as conn:
+            if not conn:
+                return None
+
+            cursor = conn.cursor()
+            try:
+                queries.execute(cursor, queries.DAY_MASKS, (doctor_id, slot_date, slot_date))
+                _, open_mask, booked_mask = cursor.fetchone()
+
+                if booked_mask & bit:
+                    action = "booked"
+                elif open_mask & bit:
+                    # The hour may have been booked since it was read
+                    queries.execute(cursor, queries.CLOSE_HOURS, (doctor_id, slot_date, bit))
+                    action = "removed" if cursor.fetchone()[0] else "booked"
+                else:
+                    queries.execute(cursor, queries.OPEN_HOURS, (doctor_id, slot_date, bit))
+                    action = "added" if cursor.fetchone()[0] else "booked"
+
                 conn.commit()
-                action = "removed"
-            else:
-                action = "booked" 
-        else:
-            cursor.execute("""
-                INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status, is_booked) 
-                VALUES (%s, %s, %s, 'available', False)
-            """, (doctor_id, slot_date, slot_hour))
-            conn.commit()
-            action = "added"
-            
-        cursor.close()
-        conn.close()
-        return action
+                if action != "booked":
+                    availability_index.invalidate(doctor_id, slot_date)
+                return action
+
+            except Exception as e:
+                conn.rollback()
+                print(f"Erreur toggle_doctor_slot: {e}")
+                return None
+
+            finally:
+                cursor.close()
+
+    # =====================================================================
+    # Masques de disponibilité (migration 009)
+    # =====================================================================
+
+    @staticmethod
+    def get_day_masks(doctor_id, date_from, date_to=None):
+        """
+        Un dict par jour de date_from à date_to (inclus) : open_mask (heures
+        réservables, règles comprises) et booked_mask, bit h = heure h.
+        """
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+
+            cursor = conn.cursor()
+            try:
+                queries.execute(cursor, queries.DAY_MASKS, (doctor_id, date_from, date_to or date_from))
+                return [
+                    {"day": r[0], "open_mask": r[1], "booked_mask": r[2]}
+                    for r in cursor.fetchall()
+                ]
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def get_open_hours(doctor_id, day):
+        """Heures réservables du docteur ce jour-là."""
+        masks = DoctorDAO.get_day_masks(doctor_id, day)
+        return mask_to_hours(masks[0]["open_mask"]) if masks else []
+
+    @staticmethod
+    def _change_hours(query, doctor_id, day, hours):
+        with pooled_connection() as conn:
+            if not conn:
+                return None
+
+            cursor = conn.cursor()
+            try:
+                queries.execute(cursor, query, (doctor_id, day, hours_to_mask(hours)))
+                changed = cursor.fetchone()[0]
+                conn.commit()
+                if changed:
+                    availability_index.invalidate(doctor_id, day)
+                return changed
+
+            except Exception as e:
+                conn.rollback()
+                print(f"Erreur {query.name}: {e}")
+                return None
+
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def set_available_hours(doctor_id, day, hours):
+        """
+        Ouvre les heures `hours` du jour : une heure d'une règle fermée à la
+        main est rouverte, toute autre heure reçoit un créneau 'available'.
+        Les heures réservées ne changent pas. Retourne le nombre d'heures
+        ouvertes, ou None en cas d'erreur.
+        """
+        return DoctorDAO._change_hours(queries.OPEN_HOURS, doctor_id, day, hours)
+
+    @staticmethod
+    def clear_available_hours(doctor_id, day, hours):
+        """
+        Ferme les heures `hours` du jour ; les heures réservées ne changent
+        pas. Retourne le nombre d'heures fermées, ou None en cas d'erreur.
+        """
+        return DoctorDAO._change_hours(queries.CLOSE_HOURS, doctor_id, day, hours)
+
+    # =====================================================================
+    # Disponibilités récurrentes (migration 008)
+    # =====================================================================
+
+    @staticmethod
+    def add_availability_rule(doctor_id, weekday, start_hour, end_hour, valid_from=None, valid_until=None):
+        """
+        Ouvre chaque semaine les heures [start_hour, end_hour) du jour weekday
+        (ISO : 1 = lundi), de valid_from (aujourd'hui par défaut) à
+        valid_until (sans fin par défaut).
+        """
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "DB connection error"
+
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    INSERT INTO availability_rules (doctor_id, weekday, start_hour, end_hour, valid_from, valid_until)
+                    VALUES (%s, %s, %s, %s, COALESCE(%s, CURRENT_DATE), %s)
+                """, (doctor_id, weekday, start_hour, end_hour, valid_from, valid_until))
+                conn.commit()
+                availability_index.invalidate_doctor(doctor_id)
+                return True, "Rule created"
+
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
+
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def get_availability_rules(doctor_id):
+        """Règles encore valides aujourd'hui ou à venir, par jour puis heure."""
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    SELECT id, weekday, start_hour, end_hour, valid_from, valid_until
+                    FROM availability_rules
+                    WHERE doctor_id = %s
+                    AND (valid_until IS NULL OR valid_until >= CURRENT_DATE)
+                    ORDER BY weekday, start_hour
+                """, (doctor_id,))
+                return [
+                    {"id": r[0], "weekday": r[1], "start_hour": r[2], "end_hour": r[3],
+                     "valid_from": r[4], "valid_until": r[5]}
+                    for r in cursor.fetchall()
+                ]
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def delete_availability_rule(doctor_id, rule_id):
+        """
+        Supprime une règle ; les rendez-vous déjà pris sur ses heures restent.
+        Retourne True si la règle appartenait au docteur.
+        """
+        with pooled_connection() as conn:
+            if not conn:
+                return False
+
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "DELETE FROM availability_rules WHERE id = %s AND doctor_id = %s", (rule_id, doctor_id)
+                )
+                conn.commit()
+                availability_index.invalidate_doctor(doctor_id)
+                return cursor.rowcount == 1
+
+            except Exception:
+                conn.rollback()
+                return False
+
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def add_availability_exception(doctor_id, start_date, end_date, reason=None, cancel_appointments=False):
+        """
+        Ferme toutes les règles du docteur du start_date au end_date inclus (congés).
+        Avec cancel_appointments, les rendez-vous de la période sont annulés
+        dans la même transaction et les patients prévenus.
+        """
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "DB connection error"
+
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    INSERT INTO availability_exceptions (doctor_id, start_date, end_date, reason)
+                    VALUES (%s, %s, %s, %s)
+                """, (doctor_id, start_date, end_date, reason or None))
+                if cancel_appointments:
+                    start = datetime.strptime(str(start_date), "%Y-%m-%d")
+                    end = datetime.strptime(str(end_date), "%Y-%m-%d") + timedelta(days=1)
+                    AppointmentDAO.cancel_doctor_range(cursor, doctor_id, start, end, "doctor_absence")
+                conn.commit()
+                availability_index.invalidate_doctor(doctor_id)
+                return True, "Exception created"
+
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
+
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def get_availability_exceptions(doctor_id):
+        """Exceptions en cours ou à venir, par date de début."""
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    SELECT id, start_date, end_date, reason
+                    FROM availability_exceptions
+                    WHERE doctor_id = %s
+                    AND end_date >= CURRENT_DATE
+                    ORDER BY start_date
+                """, (doctor_id,))
+                return [
+                    {"id": r[0], "start_date": r[1], "end_date": r[2], "reason": r[3]}
+                    for r in cursor.fetchall()
+                ]
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def delete_availability_exception(doctor_id, exception_id):
+        with pooled_connection() as conn:
+            if not conn:
+                return False
+
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "DELETE FROM availability_exceptions WHERE id = %s AND doctor_id = %s", (exception_id, doctor_id)
+                )
+                conn.commit()
+                availability_index.invalidate_doctor(doctor_id)
+                return cursor.rowcount == 1
+
+            except Exception:
+                conn.rollback()
+                return False
+
+            finally:
+                cursor.close()
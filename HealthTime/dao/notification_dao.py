@@ -0,0 +1,52 @@
+from database.db import pooled_connection
+from database import queries
+
+
+def notification_entry(row):
+    """Dict of an UNREAD_NOTIFICATIONS row."""
+    return {"id": row[0], "kind": row[1], "appointment_date": row[2], "doctor_name": row[3], "created_at": row[4]}
+
+
+class NotificationDAO:
+
+    @staticmethod
+    def get_unread_notifications(user_id):
+        """Notifications non lues, les plus récentes d'abord."""
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+
+            cursor = conn.cursor()
+            try:
+                queries.execute(cursor, queries.UNREAD_NOTIFICATIONS, (user_id,))
+                return [notification_entry(r) for r in cursor.fetchall()]
+
+            except Exception as e:
+                print(f"Erreur get_unread_notifications: {e}")
+                return []
+
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def mark_notifications_read(user_id):
+        """Marque toutes les notifications de l'utilisateur comme lues ; retourne leur nombre."""
+        with pooled_connection() as conn:
+            if not conn:
+                return 0
+
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    UPDATE notifications SET read_at = NOW()
+                    WHERE user_id = %s AND read_at IS NULL
+                """, (user_id,))
+                conn.commit()
+                return cursor.rowcount
+
+            except Exception:
+                conn.rollback()
+                return 0
+
+            finally:
+                cursor.close()
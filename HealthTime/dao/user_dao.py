@@ -1,14 +1,12 @@
-from database.db import get_connection
+from database.db import pooled_connection
+from database import queries
 
 class UserDAO:
 
     @staticmethod
     def test_connection():
-        conn = get_connection()
-        if conn:
-            conn.close()
-            return True
-        return False
+        with pooled_connection() as conn:
+            return conn is not None
     
     @staticmethod
     def register_user(name, username, password, role):
@@ -18,23 +16,22 @@ class UserDAO:
 
         status = 'active'
 
-        conn = get_connection()
-        if not conn:
-            return False, "Database connection failed"
-
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO users (name, username, password, role, status) VALUES (%s, %s, %s, %s, %s)",
-                (name, username, password, role, status)
-            )
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return True, f"{role.capitalize()} registration successful"
-        except Exception as e:
-            conn.close()
-            return False, f"Error: {e}"
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
+
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT INTO users (name, username, password, role, status) VALUES (%s, %s, %s, %s, %s)",
+                    (name, username, password, role, status)
+                )
+                conn.commit()
+                cursor.close()
+                return True, f"{role.capitalize()} registration successful"
+            except Exception as e:
+                conn.rollback()
+                return False, f"Error: {e}"
 
 
     @staticmethod
@@ -42,112 +39,105 @@ class UserDAO:
         """
         Returns user dict if successful login, None if failed or doctor pending.
         """
-        conn = get_connection()
-        if not conn:
-            return None
-
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id, name, role, status FROM users WHERE username=%s AND password=%s",
-                (username, password)
-            )
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-
-            if result:
-                user_id, name, role, status = result
-                if role == "doctor" and status == "pending":
-                    return {"error": "Doctor account pending approval"}
-                return {"id": user_id, "name": name, "role": role}
-            else:
+        with pooled_connection() as conn:
+            if not conn:
                 return None
-        except Exception as e:
-            conn.close()
-            return {"error": str(e)}
+
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.AUTHENTICATE, (username, password))
+                result = cursor.fetchone()
+                cursor.close()
+
+                if result:
+                    user_id, name, role, status = result
+                    if role == "doctor" and status == "pending":
+                        return {"error": "Doctor account pending approval"}
+                    return {"id": user_id, "name": name, "role": role}
+                else:
+                    return None
+            except Exception as e:
+                return {"error": str(e)}
         
 
     @staticmethod
     def get_all_specialties():
-        conn = get_connection()
-        if not conn:
-            return []
-
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, name FROM specialties ORDER BY name ASC")
-            rows = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            
-            return [{"id": r[0], "name": r[1]} for r in rows]
-
-        except Exception as e:
-            if conn:
-                conn.close()
-            return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.SPECIALTIES)
+                rows = cursor.fetchall()
+                cursor.close()
+                
+                return [{"id": r[0], "name": r[1]} for r in rows]
+
+            except Exception as e:
+                return []
 
     @staticmethod
     def search_doctors_by_specialty(specialty_id):
-        conn = get_connection()
-        if not conn:
-            return []
-
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT u.id, u.name, u.username, s.name as specialty
-                FROM users u
-                JOIN doctor_specialties ds ON u.id = ds.doctor_id
-                JOIN specialties s ON ds.specialty_id = s.id
-                WHERE u.role = 'doctor' 
-                AND u.status = 'active'
-                AND s.id = %s
-            """, (specialty_id,))
-
-            rows = cursor.fetchall()
-            cursor.close()
-            conn.close()
-
-            return [
-                {"id": r[0], "name": r[1], "username": r[2], "specialty": r[3]}
-                for r in rows
-            ]
-
-        except Exception as e:
-            if conn:
-                conn.close()
-            return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.SEARCH_DOCTORS_BY_SPECIALTY, (specialty_id,))
+
+                rows = cursor.fetchall()
+                cursor.close()
+
+                return [
+                    {"id": r[0], "name": r[1], "username": r[2], "specialty": r[3]}
+                    for r in rows
+                ]
+
+            except Exception as e:
+                return []
 
     @staticmethod
     def search_doctors_by_name(name):
-        conn = get_connection()
-        if not conn:
-            return []
-
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT u.id, u.name, u.username, s.name as specialty
-                FROM users u
-                LEFT JOIN doctor_specialties ds ON u.id = ds.doctor_id
-                LEFT JOIN specialties s ON ds.specialty_id = s.id
-                WHERE u.role = 'doctor' 
-                AND u.status = 'active'
-                AND LOWER(u.name) LIKE LOWER(%s)
-            """, (f"%{name}%",))
-
-            rows = cursor.fetchall()
-            cursor.close()
-            conn.close()
-
-            return [
-                {"id": r[0], "name": r[1], "username": r[2], "specialty": r[3]}
-                for r in rows
-            ]
-
-        except Exception as e:
-            if conn:
-                conn.close()
-            return []
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.SEARCH_DOCTORS_BY_NAME, (name, queries.SEARCH_LIMIT))
+
+                rows = cursor.fetchall()
+                cursor.close()
+
+                return [
+                    {"id": r[0], "name": r[1], "username": r[2], "specialty": r[3]}
+                    for r in rows
+                ]
+
+            except Exception as e:
+                return []
+
+    @staticmethod
+    def autocomplete(term, limit=8):
+        """
+        Suggestions pour la barre de recherche : praticiens et spécialités
+        dont un mot commence par `term` (accents et majuscules ignorés).
+        """
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return {"doctors": [], "specialties": []}
+
+            try:
+                cursor = conn.cursor()
+                queries.execute(cursor, queries.AUTOCOMPLETE, (term, limit))
+                rows = cursor.fetchall()
+                cursor.close()
+                return {
+                    "doctors": [{"id": r[1], "name": r[2]} for r in rows if r[0] == "doctor"],
+                    "specialties": [{"id": r[1], "name": r[2]} for r in rows if r[0] == "specialty"],
+                }
+            except Exception as e:
+                print("AUTOCOMPLETE ERROR:", e)
+                return {"doctors": [], "specialties": []}
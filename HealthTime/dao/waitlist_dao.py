@@ -0,0 +1,106 @@
+from database.db import pooled_connection
+from database import queries
+from datetime import date
+
+
+def waitlist_entry(row):
+    """Dict of a PATIENT_WAITLIST row."""
+    return {"id": row[0], "date_from": row[1], "date_to": row[2], "urgent": row[3], "status": row[4],
+            "doctor_name": row[5], "specialty_name": row[6], "appointment_date": row[7]}
+
+
+def _hour_of(appointment_datetime):
+    """Start of the hour of the appointment (migration 013: it may start later)."""
+    return appointment_datetime.replace(minute=0, second=0, microsecond=0)
+
+
+class WaitlistDAO:
+
+    @staticmethod
+    def join_waitlist(patient_id, date_from, date_to, doctor_id=None, specialty_id=None, urgent=False):
+        """
+        Inscrit le patient pour un docteur ou pour une spécialité, du
+        date_from au date_to inclus. La première heure libérée par une
+        annulation sur cette période lui est attribuée.
+        """
+        if (doctor_id is None) == (specialty_id is None):
+            return False, "Choose a doctor or a specialty"
+        if date.fromisoformat(str(date_from)) > date.fromisoformat(str(date_to)):
+            return False, "Invalid date range"
+        if date.fromisoformat(str(date_to)) < date.today():
+            return False, "The waiting period is over"
+
+        with pooled_connection() as conn:
+            if not conn:
+                return False, "Database connection failed"
+
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    INSERT INTO waitlist (patient_id, doctor_id, specialty_id, date_from, date_to, urgent)
+                    VALUES (%s, %s, %s, GREATEST(%s::date, CURRENT_DATE), %s, %s)
+                """, (patient_id, doctor_id, specialty_id, date_from, date_to, urgent))
+                conn.commit()
+                return True, "Added to the waitlist"
+
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
+
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def get_patient_waitlist(patient_id):
+        """Inscriptions en attente ou attribuées dont la période n'est pas finie."""
+        with pooled_connection(readonly=True) as conn:
+            if not conn:
+                return []
+
+            cursor = conn.cursor()
+            try:
+                queries.execute(cursor, queries.PATIENT_WAITLIST, (patient_id,))
+                return [waitlist_entry(r) for r in cursor.fetchall()]
+
+            except Exception as e:
+                print(f"Erreur get_patient_waitlist: {e}")
+                return []
+
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def leave_waitlist(entry_id, patient_id):
+        """Retire une inscription encore en attente ; True si elle existait."""
+        with pooled_connection() as conn:
+            if not conn:
+                return False
+
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    UPDATE waitlist SET status = 'canceled'
+                    WHERE id = %s AND patient_id = %s AND status = 'waiting'
+                """, (entry_id, patient_id))
+                conn.commit()
+                return cursor.rowcount == 1
+
+            except Exception:
+                conn.rollback()
+                return False
+
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def reallocate(cursor, doctor_id, appointment_datetime, canceled_patient_id):
+        """
+        Attribue l'heure libérée au premier inscrit compatible (hors patient
+        dont le rendez-vous vient d'être annulé), dans la transaction de
+        l'annulation, après RELEASE_SLOT. Un rendez-vous de moins d'une heure
+        libère l'heure qui le contient. Retourne l'id du patient servi, ou None.
+        """
+        queries.execute(cursor, queries.REALLOCATE_SLOT,
+                        (doctor_id, _hour_of(appointment_datetime), canceled_patient_id))
+        row = cursor.fetchone()
+        return row[1] if row else None
@@ -0,0 +1,227 @@
+"""
+In-process index of the bookable hours per specialty and date.
+
+The booking tab asks for the same (specialty, date) lists on every page view
+and combobox change. They are kept here once read, and served without a
+query until a write touches one of the specialty's doctors on that date:
+the DAOs that book, cancel or open and close hours call invalidate(doctor,
+day) once committed, weekly rule changes call invalidate_doctor(), and
+admin changes to doctors or specialties call clear().
+
+The index lives in one process. Writes made by another process (another web
+worker, a desktop app) are only seen once an entry is older than
+AVAILABILITY_INDEX_TTL seconds; a booking still checks the slot in the
+database, so a stale list at worst offers an hour that is then refused.
+
+A list is only stored if it was read from the primary, and if no
+invalidation of its specialty and date happened since the read started, so
+a read racing a write never brings the old hours back. Lists read from a
+replica are returned but not stored: a replica may not show a write yet
+even after its invalidation, and the index would then serve the old hours
+to the session that wrote them.
+
+Month heatmaps (free slots per day of a month) are kept the same way, under
+the first day of the month: "month" entries per specialty and
+"doctor_month" entries per doctor. Any invalidation of a day drops the
+heatmaps of its month.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+from config import settings
+from database.db import current_unit_of_work, served_by_replica
+
+_lock = threading.Lock()
+# (kind, specialty_id, day) -> (stored_at, value), least recently used first;
+# (kind, specialty_id or doctor_id, first day) for the MONTH_KINDS
+_entries = OrderedDict()
+_keys_by_day = {}          # day -> keys of _entries
+# specialty_id -> frozenset of its doctors (any status)
+_specialty_doctors = {}
+# Times of the invalidations, kept as long as they can refuse a store
+_invalidated_days = {}     # (doctor_id, day) -> time
+_invalidated_months = {}   # (doctor_id, first day of the month) -> time
+_invalidated_doctors = {}  # doctor_id -> time
+_cleared_at = float("-inf")
+_pruned_at = float("-inf")
+
+# Invalidations are pruned at most this often (seconds)
+PRUNE_INTERVAL = 1.0
+
+# Entries of a whole month; "doctor_month" ones are keyed by doctor
+MONTH_KINDS = ("month", "doctor_month")
+
+
+def enabled():
+    return settings.AVAILABILITY_INDEX_TTL > 0
+
+
+def _day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value), "%Y-%m-%d").date()
+
+
+def _month(day):
+    return day.replace(day=1)
+
+
+def read_started():
+    """
+    Time to pass to store(): now, or when the snapshot of the current
+    UnitOfWork may have been taken.
+    """
+    now = time.monotonic()
+    unit_of_work = current_unit_of_work()
+    if unit_of_work is not None and unit_of_work.snapshot and unit_of_work.started_at is not None:
+        return min(now, unit_of_work.started_at)
+    return now
+
+
+def _key(kind, target, day):
+    day = _day(day)
+    return kind, int(target), _month(day) if kind in MONTH_KINDS else day
+
+
+def get(kind, specialty_id, day):
+    """
+    Stored list, or None when it must be read from the database. For the
+    MONTH_KINDS, `day` is any day of the month.
+    """
+    if not enabled():
+        return None
+    key = _key(kind, specialty_id, day)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at >= settings.AVAILABILITY_INDEX_TTL:
+            _drop(key)
+            return None
+        _entries.move_to_end(key)
+    return [dict(item) for item in value]
+
+
+def knows_specialty(specialty_id):
+    with _lock:
+        return int(specialty_id) in _specialty_doctors
+
+
+def set_specialty_doctors(specialty_id, doctor_ids, started, conn):
+    """Doctors of the specialty, read on `conn` since `started`."""
+    if served_by_replica(conn):
+        return
+    with _lock:
+        if _cleared_at < started:
+            _specialty_doctors[int(specialty_id)] = frozenset(doctor_ids)
+
+
+def _drop(key):
+    # Called with the lock held
+    del _entries[key]
+    keys = _keys_by_day[key[2]]
+    keys.discard(key)
+    if not keys:
+        del _keys_by_day[key[2]]
+
+
+def _doctors_of(key):
+    # Called with the lock held; None while the specialty is unknown
+    if key[0] == "doctor_month":
+        return frozenset((key[1],))
+    return _specialty_doctors.get(key[1])
+
+
+def _is_fresh(key, started):
+    # Called with the lock held
+    if _cleared_at >= started:
+        return False
+    doctors = _doctors_of(key)
+    if doctors is None:
+        return False
+    invalidated = _invalidated_months if key[0] in MONTH_KINDS else _invalidated_days
+    for doctor_id in doctors:
+        if _invalidated_doctors.get(doctor_id, started - 1) >= started:
+            return False
+        if invalidated.get((doctor_id, key[2]), started - 1) >= started:
+            return False
+    return True
+
+
+def store(kind, specialty_id, day, value, started, conn):
+    """
+    Keeps `value`, read on `conn` since `started` (read_started()), unless
+    conn is a replica connection.
+    """
+    if not enabled() or served_by_replica(conn):
+        return
+    key = _key(kind, specialty_id, day)
+    now = time.monotonic()
+    if now - started >= settings.AVAILABILITY_INDEX_TTL:
+        return
+    with _lock:
+        if not _is_fresh(key, started):
+            return
+        _entries[key] = (now, [dict(item) for item in value])
+        _entries.move_to_end(key)
+        _keys_by_day.setdefault(key[2], set()).add(key)
+        while len(_entries) > settings.AVAILABILITY_INDEX_MAX_ENTRIES:
+            _drop(next(iter(_entries)))
+
+
+def _prune(now):
+    # Older invalidations cannot refuse a store any more (see store())
+    global _pruned_at
+    if now - _pruned_at < PRUNE_INTERVAL:
+        return
+    _pruned_at = now
+    limit = now - settings.AVAILABILITY_INDEX_TTL
+    for invalidated in (_invalidated_days, _invalidated_months, _invalidated_doctors):
+        for key in [key for key, at in invalidated.items() if at < limit]:
+            del invalidated[key]
+
+
+def _touches(key, doctor_id):
+    # Called with the lock held
+    return doctor_id in (_doctors_of(key) or ())
+
+
+def invalidate(doctor_id, day):
+    """Drops the lists of `day`, and the heatmaps of its month, of the doctor."""
+    doctor_id, day = int(doctor_id), _day(day)
+    month = _month(day)
+    now = time.monotonic()
+    with _lock:
+        _invalidated_days[(doctor_id, day)] = now
+        _invalidated_months[(doctor_id, month)] = now
+        keys = set(_keys_by_day.get(day, ()))
+        keys.update(key for key in _keys_by_day.get(month, ()) if key[0] in MONTH_KINDS)
+        for key in [key for key in keys if _touches(key, doctor_id)]:
+            _drop(key)
+        _prune(now)
+
+
+def invalidate_doctor(doctor_id):
+    """Drops every list of the doctor's specialties (weekly rules, absences)."""
+    doctor_id = int(doctor_id)
+    now = time.monotonic()
+    with _lock:
+        _invalidated_doctors[doctor_id] = now
+        for key in [key for key in _entries if _touches(key, doctor_id)]:
+            _drop(key)
+        _prune(now)
+
+
+def clear():
+    """Drops everything, specialty doctors included (admin changes)."""
+    global _cleared_at
+    with _lock:
+        _cleared_at = time.monotonic()
+        _entries.clear()
+        _keys_by_day.clear()
+        _specialty_doctors.clear()
@@ -0,0 +1,75 @@
+"""
+Per-day availability masks of the doctors (migration 009).
+
+doctor_day_masks holds one row per doctor and day with 24-bit masks, bit h
+standing for hour h: hours opened by hand, rows closing a rule hour, and
+scheduled appointments. Triggers on time_slots and appointments keep it up
+to date; healthtime_day_mask() combines it with the weekly rules into the
+bookable hours of a day.
+
+The triggers do not see TRUNCATE or bulk loads run with triggers disabled:
+rebuild the masks afterwards with
+
+    python -m database.day_masks --rebuild
+"""
+import argparse
+import sys
+
+from database.db import connect_from_env
+
+HOURS_PER_DAY = 24
+
+
+def hours_to_mask(hours):
+    """Mask with the bits of `hours` (0-23) set."""
+    mask = 0
+    for hour in hours:
+        hour = int(hour)
+        if not 0 <= hour < HOURS_PER_DAY:
+            raise ValueError(f"Invalid hour: {hour}")
+        mask |= 1 << hour
+    return mask
+
+
+def mask_to_hours(mask):
+    """Hours whose bit is set in `mask`, in order."""
+    return [hour for hour in range(HOURS_PER_DAY) if mask & (1 << hour)]
+
+
+def rebuild(conn):
+    """Recomputes every mask from time_slots and appointments; returns the number of rows."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT healthtime_rebuild_day_masks()")
+        cursor.execute("SELECT COUNT(*) FROM doctor_day_masks")
+        rows = cursor.fetchone()[0]
+        conn.commit()
+        return rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Masques de disponibilité par docteur et par jour.")
+    parser.add_argument("--rebuild", action="store_true", help="recalcule tous les masques")
+    args = parser.parse_args(argv)
+    if not args.rebuild:
+        parser.print_help()
+        return 0
+
+    conn = connect_from_env()
+    try:
+        print(f"{rebuild(conn)} ligne(s) de masques recalculée(s)")
+        return 0
+    except Exception as e:
+        print(f"Erreur : {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
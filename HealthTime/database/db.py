@@ -1,17 +1,531 @@
+import contextvars
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
 from config import settings
 
+
+def connection_kwargs():
+    return {
+        "dbname": settings.DB_NAME,
+        "user": settings.DB_USER,
+        "password": settings.DB_PASSWORD,
+        "host": settings.DB_HOST,
+        "port": settings.DB_PORT,
+    }
+
+
+def connect_from_env():
+    """
+    Connection for the maintenance scripts (migrations, partitions): uses
+    DATABASE_URL when it is set, as on the hosting platform, else the DB_*
+    settings. Raises on failure.
+    """
+    url = os.environ.get("DATABASE_URL")
+    if url:
+        return psycopg2.connect(url)
+    return psycopg2.connect(**connection_kwargs())
+
+
 def get_connection():
+    """
+    Opens a standalone (non pooled) connection. The caller owns it and must close it.
+    DAOs should use pooled_connection() instead.
+    """
     try:
-        conn = psycopg2.connect(
-            dbname=settings.DB_NAME,
-            user=settings.DB_USER,
-            password=settings.DB_PASSWORD,
-            host=settings.DB_HOST,
-            port=settings.DB_PORT
-        )
-        print("Connection to DB successful")
-        return conn
+        return psycopg2.connect(**connection_kwargs())
     except Exception as e:
         print("Connection to DB failed:", e)
         return None
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    At most `maxconn` connections are checked out at once; getconn() waits up to
+    `timeout` seconds for one to be returned before raising PoolError. Idle
+    connections that have not been used for `health_check_after` seconds are
+    pinged before being handed out again, and dropped if the ping fails.
+    """
+
+    def __init__(self, minconn, maxconn, timeout=10, health_check_after=30, **conn_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("invalid pool size: minconn=%s maxconn=%s" % (minconn, maxconn))
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self._conn_kwargs = conn_kwargs
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._closed = False
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        return psycopg2.connect(**self._conn_kwargs)
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError("connection pool exhausted")
+
+        try:
+            while True:
+                with self._lock:
+                    if self._closed:
+                        raise PoolError("connection pool is closed")
+                    item = self._idle.pop() if self._idle else None
+
+                if item is None:
+                    return self._connect()
+
+                conn, last_used = item
+                if self._is_healthy(conn, last_used):
+                    return conn
+                conn.close()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            if not conn.closed:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    conn.close()
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        conn.close()
+
+            with self._lock:
+                if self._closed or conn.closed:
+                    conn.close()
+                else:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    settings.DB_POOL_MIN,
+                    settings.DB_POOL_MAX,
+                    timeout=settings.DB_POOL_TIMEOUT,
+                    health_check_after=settings.DB_POOL_HEALTH_CHECK_AFTER,
+                    **connection_kwargs()
+                )
+    return _pool
+
+
+def close_pool():
+    global _pool, _router
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+        if _router is not None:
+            _router.close()
+            _router = None
+
+
+# =========================================================================
+# Read replicas
+# =========================================================================
+
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class ReplicaConnection(extensions.connection):
+    """psycopg2 connection of a replica pool (see served_by_replica())."""
+    replica = True
+
+
+def served_by_replica(conn):
+    """
+    True when conn, a psycopg2 connection (pooled, or shared by a unit of
+    work), reads from a replica: its results may lag behind the
+    primary by more than the last measured lag.
+    """
+    return getattr(conn, "replica", False)
+
+
+class ReplicaRouter:
+    """
+    Chooses the replica that serves the next read-only query.
+
+    A monitor thread measures the replication lag of every replica each
+    `check_interval` seconds. pick() round-robins over the replicas that
+    answered with a lag below `max_lag`, without ever blocking on the network,
+    and returns None (read from the primary) when none qualifies.
+    """
+
+    def __init__(self, dsns, max_lag=5, check_interval=2):
+        self.dsns = list(dsns)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.pools = [
+            ConnectionPool(0, settings.DB_POOL_MAX, timeout=settings.DB_POOL_TIMEOUT,
+                           health_check_after=settings.DB_POOL_HEALTH_CHECK_AFTER, dsn=dsn,
+                           connection_factory=ReplicaConnection)
+            for dsn in self.dsns
+        ]
+        self.lags = [None] * len(self.dsns)
+        self._counter = itertools.count()
+        self._stop = threading.Event()
+
+        self.check_all()
+        self._monitor = threading.Thread(target=self._run, name="healthtime-replica-monitor", daemon=True)
+        self._monitor.start()
+
+    def check(self, index):
+        """Measures the lag of one replica; None if it cannot be reached."""
+        pool = self.pools[index]
+        try:
+            conn = pool.getconn()
+        except Exception:
+            self.lags[index] = None
+            return None
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute(REPLICA_LAG_SQL)
+            lag = float(cursor.fetchone()[0])
+            cursor.close()
+        except Exception:
+            lag = None
+        finally:
+            pool.putconn(conn)
+
+        self.lags[index] = lag
+        return lag
+
+    def check_all(self):
+        for index in range(len(self.dsns)):
+            self.check(index)
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.check_all()
+
+    def is_fit(self, index):
+        lag = self.lags[index]
+        return lag is not None and lag <= self.max_lag
+
+    def pick(self):
+        fit = [index for index in range(len(self.dsns)) if self.is_fit(index)]
+        if not fit:
+            return None
+        return fit[next(self._counter) % len(fit)]
+
+    def close(self):
+        self._stop.set()
+        for pool in self.pools:
+            pool.closeall()
+
+
+_router = None
+
+
+def get_replica_router():
+    """Returns the process-wide replica router, or None when no replica is configured."""
+    global _router
+    if _router is None and settings.DB_REPLICA_URLS:
+        with _pool_lock:
+            if _router is None:
+                _router = ReplicaRouter(
+                    settings.DB_REPLICA_URLS,
+                    max_lag=settings.DB_REPLICA_MAX_LAG,
+                    check_interval=settings.DB_REPLICA_CHECK_INTERVAL,
+                )
+    return _router
+
+
+class DbSession:
+    """
+    Remembers when a user session last wrote to the primary, so that its reads
+    stay on the primary until the replicas have caught up (read-your-writes).
+    """
+
+    def __init__(self, last_write=None):
+        self.last_write = last_write
+
+    def mark_write(self):
+        self.last_write = time.time()
+
+    def recently_wrote(self):
+        return (self.last_write is not None
+                and time.time() - self.last_write < settings.DB_READ_YOUR_WRITES_SECONDS)
+
+
+# Sessions not bound explicitly (desktop app, scripts) share the process session
+_process_db_session = DbSession()
+_current_db_session = contextvars.ContextVar("current_db_session", default=None)
+
+
+def current_db_session():
+    return _current_db_session.get() or _process_db_session
+
+
+def bind_db_session(db_session):
+    """Makes db_session the current session; returns a token for unbind_db_session()."""
+    return _current_db_session.set(db_session)
+
+
+def unbind_db_session(token):
+    try:
+        _current_db_session.reset(token)
+    except ValueError:
+        _current_db_session.set(None)
+
+
+def choose_replica():
+    """
+    Index of the replica that should serve a read-only query of the current
+    session, or None when it must go to the primary.
+    """
+    router = get_replica_router()
+    if router is None or current_db_session().recently_wrote():
+        return None
+    return router.pick()
+
+
+def _borrow(readonly):
+    """Borrows a connection, from a replica when allowed; returns (pool, conn)."""
+    if readonly:
+        index = choose_replica()
+        if index is not None:
+            pool = get_replica_router().pools[index]
+            try:
+                return pool, pool.getconn()
+            except Exception as e:
+                print("Replica connection failed, reading from primary:", e)
+
+    pool = get_pool()
+    return pool, pool.getconn()
+
+
+_current_unit_of_work = contextvars.ContextVar("current_unit_of_work", default=None)
+
+
+class _SharedConnection:
+    """
+    Connection handed to DAOs while a UnitOfWork is active. Behaves like the
+    underlying psycopg2 connection, except that close() is a no-op and, in a
+    transactional unit of work, commit() is deferred to the end of the unit.
+    """
+
+    def __init__(self, unit_of_work, conn):
+        self._unit_of_work = unit_of_work
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def commit(self):
+        if not self._unit_of_work.transactional:
+            self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+        if self._unit_of_work.transactional:
+            self._unit_of_work.rollback_only = True
+
+    def close(self):
+        pass
+
+
+class UnitOfWork:
+    """
+    Shares one pooled connection between every DAO call made while it is active.
+
+    The connection is only borrowed on the first DAO call, so work that never
+    touches the database costs nothing.
+    - snapshot: reads run in one REPEATABLE READ transaction, so they all see
+      the same state of the database.
+    - transactional: DAO commits are deferred, and everything is committed (or
+      rolled back, if any DAO call failed) once, when the unit ends.
+
+    - readonly: the connection may come from a replica. DAO methods that write
+      then get a primary connection of their own.
+
+    Usable as a context manager, or through begin()/end() when the start and
+    the end happen in different callbacks (Flask before/teardown request).
+    """
+
+    def __init__(self, snapshot=False, transactional=False, readonly=False):
+        self.snapshot = snapshot
+        self.transactional = transactional
+        self.readonly = readonly
+        self.rollback_only = False
+        self.checkouts = 0
+        # time.monotonic() when the connection was borrowed: a snapshot is no
+        # older than this
+        self.started_at = None
+        self._pool = None
+        self._conn = None
+        self._shared = None
+        self._token = None
+
+    def begin(self):
+        self._token = _current_unit_of_work.set(self)
+        return self
+
+    def end(self, commit=True):
+        try:
+            self._release(commit)
+        finally:
+            if self._token is not None:
+                try:
+                    _current_unit_of_work.reset(self._token)
+                except ValueError:
+                    # ended from another context than the one it began in
+                    _current_unit_of_work.set(None)
+                self._token = None
+
+    def __enter__(self):
+        return self.begin()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(commit=exc_type is None)
+
+    def connection(self):
+        if self._conn is None:
+            try:
+                self._pool, self._conn = _borrow(self.readonly)
+            except Exception as e:
+                print("Connection to DB failed:", e)
+                return None
+
+            self.checkouts += 1
+            self.started_at = time.monotonic()
+            if self.snapshot or self.transactional:
+                isolation = "REPEATABLE READ" if self.snapshot else "DEFAULT"
+                self._conn.set_session(isolation_level=isolation)
+            self._shared = _SharedConnection(self, self._conn)
+        return self._shared
+
+    def after_use(self, failed=False):
+        """Called once a DAO is done with the connection."""
+        if self._conn is None:
+            return
+        if self._conn.info.transaction_status == extensions.TRANSACTION_STATUS_INERROR:
+            self._conn.rollback()
+            failed = True
+        if failed and self.transactional:
+            self.rollback_only = True
+
+    def _release(self, commit):
+        pool, conn = self._pool, self._conn
+        self._pool, self._conn, self._shared = None, None, None
+        if conn is None:
+            return
+
+        try:
+            if not conn.closed:
+                if self.transactional and commit and not self.rollback_only:
+                    conn.commit()
+                else:
+                    conn.rollback()
+                conn.set_session(isolation_level="DEFAULT")
+        except Exception as e:
+            print("Unit of work release failed:", e)
+            conn.close()
+        finally:
+            pool.putconn(conn)
+
+
+def current_unit_of_work():
+    return _current_unit_of_work.get()
+
+
+@contextmanager
+def pooled_connection(readonly=False):
+    """
+    Borrows a connection from the pool for the duration of the with block.
+    Yields None if no connection could be obtained, like get_connection().
+    Uncommitted work is rolled back when the connection is returned.
+
+    readonly=True lets the query run on a replica (see choose_replica()).
+    Any other use counts as a write of the current DbSession.
+
+    Inside an active UnitOfWork, yields the unit's shared connection instead,
+    unless the unit reads from a replica and this block may write, or reads
+    after a write.
+    """
+    if not readonly:
+        current_db_session().mark_write()
+
+    unit_of_work = _current_unit_of_work.get()
+    use_unit_of_work = unit_of_work is not None and (
+        not unit_of_work.readonly
+        or (readonly and not current_db_session().recently_wrote())
+    )
+    if use_unit_of_work:
+        conn = unit_of_work.connection()
+        failed = False
+        try:
+            yield conn
+        except Exception:
+            failed = True
+            raise
+        finally:
+            unit_of_work.after_use(failed)
+    else:
+        try:
+            pool, conn = _borrow(readonly)
+        except Exception as e:
+            print("Connection to DB failed:", e)
+            conn = None
+
+        try:
+            yield conn
+        finally:
+            if conn is not None:
+                pool.putconn(conn)
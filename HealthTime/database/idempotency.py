@@ -0,0 +1,100 @@
+"""
+Idempotency keys of the booking and cancellation requests (migration 007).
+
+Each form carries a fresh key (new_key()). A DAO write given a key claims it
+first, in the write's own transaction: a new key lets the write go on, and
+the write stores its (success, message) with save() before committing. A
+replayed request (double submit, browser or load balancer retry) gets the
+stored result back from one primary key lookup and writes nothing. A write
+that rolls back releases its key, so the request can simply be retried; a
+duplicate sent while the first is still running waits for it to commit.
+
+Keys are kept DB_IDEMPOTENCY_KEY_TTL seconds. Purge the expired ones daily:
+
+    python -m database.idempotency
+"""
+import sys
+import uuid
+
+from config import settings
+from database import queries
+from database.db import connect_from_env
+
+MAX_KEY_LENGTH = 64
+
+KEY_REUSED = "This request key was already used for another action"
+IN_PROGRESS = "This request is already being processed, please retry"
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def _check_key(key):
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency key longer than {MAX_KEY_LENGTH} characters")
+    return key
+
+
+def _stored_result(row, action):
+    if row is None:
+        return False, IN_PROGRESS
+    claimed, stored_action, success, message = row
+    if claimed:
+        return None
+    if stored_action != action:
+        return False, KEY_REUSED
+    if success is None:
+        return False, IN_PROGRESS
+    return success, message
+
+
+def claim(cursor, user_id, key, action):
+    """
+    Claims `key` for `action` in the cursor's transaction. Returns None when
+    the request must run (then call save()), or the stored (success, message).
+    """
+    params = (user_id, _check_key(key), action, float(settings.DB_IDEMPOTENCY_KEY_TTL))
+    queries.execute(cursor, queries.CLAIM_IDEMPOTENCY_KEY, params)
+    row = cursor.fetchone()
+    if row is None:
+        # Used by a request that committed while this one waited on the key:
+        # its row was not in the statement's snapshot yet
+        queries.execute(cursor, queries.IDEMPOTENT_RESULT, (user_id, key))
+        row = cursor.fetchone()
+    return _stored_result(row, action)
+
+
+def save(cursor, user_id, key, success, message):
+    queries.execute(cursor, queries.SAVE_IDEMPOTENT_RESULT, (user_id, key, success, message))
+
+
+def purge_expired(conn):
+    """Deletes the expired keys; returns how many."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM idempotency_keys WHERE expires_at < NOW()")
+        deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def main():
+    conn = connect_from_env()
+    try:
+        print(f"{purge_expired(conn)} clé(s) d'idempotence expirée(s) supprimée(s)")
+        return 0
+    except Exception as e:
+        print(f"Erreur : {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+"""
+Versioned schema migrations.
+
+Applies the files of database/migrations/ (NNN_description.sql) in version
+order and records each one in the schema_migrations table, so a database only
+ever runs the migrations it has not seen yet. A file containing CREATE/DROP
+INDEX CONCURRENTLY runs outside any transaction, one statement at a time, so
+indexes are built online without blocking writes; every other file runs in a
+single transaction together with its bookkeeping row.
+
+An empty database is created from schema.sql, which already contains the
+effect of every migration, and all migrations are marked as applied.
+
+    python -m database.migrate              # applies the pending migrations
+    python -m database.migrate --dry-run    # shows what would run
+    python -m database.migrate --status
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+
+from config import settings
+from database import partitions
+from database.db import connect_from_env
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+
+# pg_advisory_lock key, so two deployments never migrate at the same time
+ADVISORY_LOCK_KEY = 48151623
+
+MIGRATION_FILE = re.compile(r"^(\d+)_[\w-]+\.sql$")
+DOLLAR_QUOTE = re.compile(r"\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$")
+CONCURRENTLY = re.compile(r"\bINDEX\s+CONCURRENTLY\b", re.IGNORECASE)
+CREATE_INDEX_CONCURRENTLY = re.compile(
+    r"\bCREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE
+)
+
+
+def split_statements(sql):
+    """
+    Splits a SQL script on the semicolons that end statements. Comments are
+    dropped; quoted strings, identifiers and $$ bodies are kept intact.
+    """
+    statements, current = [], []
+    i, n = 0, len(sql)
+
+    while i < n:
+        char = sql[i]
+
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = n if end == -1 else end
+            continue
+
+        if sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            continue
+
+        if char in ("'", '"'):
+            end = i + 1
+            while True:
+                end = sql.find(char, end)
+                if end == -1:
+                    end = n
+                    break
+                if sql.startswith(char * 2, end):
+                    end += 2
+                    continue
+                end += 1
+                break
+            current.append(sql[i:end])
+            i = end
+            continue
+
+        if char == "$":
+            match = DOLLAR_QUOTE.match(sql, i)
+            if match:
+                tag = match.group(0)
+                end = sql.find(tag, match.end())
+                end = n if end == -1 else end + len(tag)
+                current.append(sql[i:end])
+                i = end
+                continue
+
+        if char == ";":
+            statement = "".join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+            i += 1
+            continue
+
+        current.append(char)
+        i += 1
+
+    statement = "".join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+class Migration:
+
+    def __init__(self, path):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.version = MIGRATION_FILE.match(self.filename).group(1)
+        with open(path, "r", encoding="utf-8") as file:
+            self.sql = file.read()
+        self.checksum = hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+        self.statements = split_statements(self.sql)
+        # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+        self.transactional = not any(CONCURRENTLY.search(s) for s in self.statements)
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = [
+        Migration(os.path.join(directory, filename))
+        for filename in sorted(os.listdir(directory))
+        if MIGRATION_FILE.match(filename)
+    ]
+    migrations.sort(key=lambda m: int(m.version))
+
+    versions = [m.version for m in migrations]
+    duplicates = sorted({v for v in versions if versions.count(v) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate migration versions: {', '.join(duplicates)}")
+    return migrations
+
+
+def ensure_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(20) PRIMARY KEY,
+            filename VARCHAR(200) NOT NULL,
+            checksum CHAR(64) NOT NULL,
+            duration_ms INT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+
+
+def applied_migrations(cursor):
+    """{version: checksum} of the migrations recorded in schema_migrations."""
+    cursor.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cursor.fetchall())
+
+
+def is_fresh_database(cursor):
+    cursor.execute("SELECT to_regclass('users') IS NULL")
+    return cursor.fetchone()[0]
+
+
+def _record(cursor, migration, duration_ms):
+    cursor.execute(
+        "INSERT INTO schema_migrations (version, filename, checksum, duration_ms) VALUES (%s, %s, %s, %s)",
+        (migration.version, migration.filename, migration.checksum, duration_ms)
+    )
+
+
+def _drop_invalid_index(cursor, statement, out):
+    # A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind, which
+    # IF NOT EXISTS would then silently accept: drop it and build it again
+    match = CREATE_INDEX_CONCURRENTLY.search(statement)
+    if not match:
+        return
+    cursor.execute("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    """, (match.group(1),))
+    if cursor.fetchone():
+        out(f"    index invalide {match.group(1)} supprimé avant reconstruction")
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+
+def _summary(statement):
+    return " ".join(statement.split())[:90]
+
+
+def apply(conn, migration, out=print):
+    """Runs one migration and records it; returns its duration in milliseconds."""
+    started = time.perf_counter()
+
+    if migration.transactional:
+        conn.autocommit = False
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SET LOCAL lock_timeout = %s", (settings.DB_MIGRATION_LOCK_TIMEOUT,))
+            for statement in migration.statements:
+                statement_started = time.perf_counter()
+                cursor.execute(statement)
+                out(f"    {(time.perf_counter() - statement_started) * 1000:8.1f} ms  {_summary(statement)}")
+            duration_ms = int((time.perf_counter() - started) * 1000)
+            _record(cursor, migration, duration_ms)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        return duration_ms
+
+    # Online migration: autocommit, one statement at a time. Its statements
+    # must be idempotent (IF NOT EXISTS / IF EXISTS) so that a failed run can
+    # simply be started again.
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        for statement in migration.statements:
+            concurrent = bool(CONCURRENTLY.search(statement))
+            # Concurrent builds wait for running transactions: no lock timeout
+            cursor.execute("SET lock_timeout = %s", ("0" if concurrent else settings.DB_MIGRATION_LOCK_TIMEOUT,))
+            if concurrent:
+                _drop_invalid_index(cursor, statement, out)
+            statement_started = time.perf_counter()
+            cursor.execute(statement)
+            out(f"    {(time.perf_counter() - statement_started) * 1000:8.1f} ms  {_summary(statement)}")
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        _record(cursor, migration, duration_ms)
+        cursor.execute("RESET lock_timeout")
+    finally:
+        cursor.close()
+    return duration_ms
+
+
+def bootstrap(conn, migrations, out=print):
+    """Creates an empty database from schema.sql and marks every migration as applied."""
+    with open(SCHEMA_FILE, "r", encoding="utf-8") as file:
+        schema = file.read()
+
+    conn.autocommit = False
+    cursor = conn.cursor()
+    try:
+        started = time.perf_counter()
+        cursor.execute(schema)
+        ensure_table(cursor)
+        for migration in migrations:
+            _record(cursor, migration, 0)
+        conn.commit()
+        out(f"Base vide : schema.sql appliqué en {(time.perf_counter() - started) * 1000:.1f} ms, "
+            f"{len(migrations)} migration(s) marquée(s) comme appliquée(s)")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def pending_migrations(conn, migrations, out=print):
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        ensure_table(cursor)
+        applied = applied_migrations(cursor)
+    finally:
+        cursor.close()
+
+    for migration in migrations:
+        if migration.version in applied and applied[migration.version] != migration.checksum:
+            out(f"Attention : {migration.filename} a été modifié depuis son application")
+    return [m for m in migrations if m.version not in applied]
+
+
+def migrate(conn, migrations=None, dry_run=False, out=print):
+    """
+    Applies the pending migrations in order, stopping at the first failure.
+    Returns the list of applied (or, with dry_run, pending) migrations.
+    """
+    if migrations is None:
+        migrations = load_migrations()
+
+    pending = pending_migrations(conn, migrations, out)
+    if not pending:
+        out("Aucune migration en attente.")
+        return []
+
+    for migration in pending:
+        mode = "transaction" if migration.transactional else "autocommit, en ligne"
+        out(f"{migration.filename} ({len(migration.statements)} instruction(s), {mode})")
+        if dry_run:
+            for statement in migration.statements:
+                out(f"    {_summary(statement)}")
+            continue
+        duration_ms = apply(conn, migration, out)
+        out(f"  -> appliquée en {duration_ms} ms")
+    return pending
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Applique les migrations de database/migrations/.")
+    parser.add_argument("--dry-run", action="store_true", help="affiche les migrations en attente sans les exécuter")
+    parser.add_argument("--status", action="store_true", help="liste les migrations appliquées et en attente")
+    args = parser.parse_args(argv)
+
+    migrations = load_migrations()
+    conn = connect_from_env()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK_KEY,))
+    if not cursor.fetchone()[0]:
+        print("Erreur : une autre migration est déjà en cours.")
+        conn.close()
+        return 1
+
+    try:
+        if args.status:
+            ensure_table(cursor)
+            applied = applied_migrations(cursor)
+            for migration in migrations:
+                state = "appliquée" if migration.version in applied else "en attente"
+                print(f"{migration.filename:45} {state}")
+            return 0
+
+        if is_fresh_database(cursor):
+            if args.dry_run:
+                print(f"Base vide : schema.sql serait appliqué, puis {len(migrations)} migration(s) marquée(s).")
+            else:
+                bootstrap(conn, migrations)
+            return 0
+
+        migrate(conn, migrations, dry_run=args.dry_run)
+        # A transactional migration leaves the connection out of autocommit
+        conn.autocommit = True
+        if not args.dry_run and partitions.is_partitioned(cursor):
+            conn.autocommit = False
+            created = partitions.ensure_partitions(conn)
+            print(f"{created} partition(s) de appointments créée(s)")
+        return 0
+
+    except Exception as e:
+        print(f"Erreur lors de la migration : {e}")
+        return 1
+
+    finally:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_KEY,))
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
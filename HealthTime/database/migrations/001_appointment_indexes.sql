@@ -0,0 +1,33 @@
+-- =========================================================================
+-- 001 : Index des chemins d'accès de appointments / time_slots
+-- =========================================================================
+-- CONCURRENTLY : pas de verrou en écriture sur la table pendant la création.
+-- À exécuter hors transaction, une instruction à la fois (psql -f le fait).
+
+-- get_patient_appointments / get_doctor_appointments (filtre + ORDER BY date)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_patient_date
+    ON appointments (patient_id, appointment_date);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_doctor_date
+    ON appointments (doctor_id, appointment_date);
+
+-- get_upcoming_appointments : uniquement les rendez-vous planifiés
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_doctor_date_scheduled
+    ON appointments (doctor_id, appointment_date) WHERE status = 'scheduled';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_patient_date_scheduled
+    ON appointments (patient_id, appointment_date) WHERE status = 'scheduled';
+
+-- Anti-jointure NOT EXISTS des requêtes de disponibilité et
+-- get_appointment_by_doctor_date_hour (mêmes expressions que les requêtes)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_doctor_day_hour_scheduled
+    ON appointments (doctor_id, DATE(appointment_date), EXTRACT(HOUR FROM appointment_date))
+    WHERE status = 'scheduled';
+
+-- Créneaux libres d'un jour, tous docteurs confondus (option "Peu importe")
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_time_slots_date_doctor_available
+    ON time_slots (slot_date, doctor_id, slot_hour) WHERE status = 'available';
+
+-- Docteurs d'une spécialité (la clé primaire commence par doctor_id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_doctor_specialties_specialty
+    ON doctor_specialties (specialty_id, doctor_id);
@@ -0,0 +1,21 @@
+-- =========================================================================
+-- 002 : Clé de créneau (slot_date, slot_hour) sur appointments
+-- =========================================================================
+-- Les requêtes filtraient avec DATE(appointment_date) et
+-- EXTRACT(HOUR FROM appointment_date) ; les colonnes générées permettent des
+-- prédicats simples, indexables et directement joignables à time_slots.
+-- Attention : ajouter une colonne générée STORED réécrit la table ; à lancer
+-- en heure creuse sur une grosse table.
+
+ALTER TABLE appointments
+    ADD COLUMN IF NOT EXISTS slot_date DATE
+        GENERATED ALWAYS AS (CAST(appointment_date AS DATE)) STORED,
+    ADD COLUMN IF NOT EXISTS slot_hour INT
+        GENERATED ALWAYS AS (CAST(EXTRACT(HOUR FROM appointment_date) AS INT)) STORED;
+
+-- Anti-jointure des disponibilités et recherche docteur / jour / heure
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_appointments_doctor_slot_scheduled
+    ON appointments (doctor_id, slot_date, slot_hour) WHERE status = 'scheduled';
+
+-- Remplacé par l'index ci-dessus
+DROP INDEX CONCURRENTLY IF EXISTS idx_appointments_doctor_day_hour_scheduled;
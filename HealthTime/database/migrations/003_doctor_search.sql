@@ -0,0 +1,20 @@
+-- =========================================================================
+-- 003 : Recherche de praticiens insensible aux accents (pg_trgm + unaccent)
+-- =========================================================================
+-- LOWER(name) LIKE '%...%' parcourait toute la table et ne trouvait pas
+-- « Hélène » en tapant « helene ». La recherche compare désormais des clés
+-- sans accents ni majuscules, indexées en trigrammes (GIN).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() n'est que STABLE : cette enveloppe IMMUTABLE permet de l'indexer
+CREATE OR REPLACE FUNCTION healthtime_search_key(value TEXT) RETURNS TEXT
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT lower(public.unaccent('public.unaccent'::regdictionary, value)) $$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_doctor_name_trgm
+    ON users USING gin (healthtime_search_key(name) gin_trgm_ops) WHERE role = 'doctor';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_specialties_name_trgm
+    ON specialties USING gin (healthtime_search_key(name) gin_trgm_ops);
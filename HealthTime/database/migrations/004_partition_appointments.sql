@@ -0,0 +1,76 @@
+-- =========================================================================
+-- 004 : Partitionnement mensuel de appointments (RANGE sur appointment_date)
+-- =========================================================================
+-- Les requêtes bornées en date ne lisent plus que les mois concernés et
+-- l'historique ancien se détache mois par mois (database/partitions.py).
+-- Attention : la table est recopiée sous verrou exclusif ; à lancer en
+-- heure creuse. Ensuite, CREATE INDEX CONCURRENTLY n'est plus possible sur
+-- appointments : créer l'index sur ONLY appointments, puis en CONCURRENTLY
+-- sur chaque partition et l'attacher (ALTER INDEX ... ATTACH PARTITION).
+
+-- Crée les partitions mensuelles manquantes entre deux mois (inclus)
+CREATE OR REPLACE FUNCTION healthtime_create_appointment_partitions(from_month DATE, to_month DATE)
+RETURNS INT LANGUAGE plpgsql AS $$
+DECLARE
+    month DATE := date_trunc('month', from_month)::DATE;
+    partition_name TEXT;
+    created INT := 0;
+BEGIN
+    WHILE month <= to_month LOOP
+        partition_name := 'appointments_' || to_char(month, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF appointments FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month, (month + INTERVAL '1 month')::DATE
+            );
+            created := created + 1;
+        END IF;
+        month := (month + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN created;
+END $$;
+
+ALTER TABLE appointments RENAME TO appointments_unpartitioned;
+
+-- La clé primaire d'une table partitionnée doit contenir la clé de partition
+CREATE TABLE appointments (
+    id INT NOT NULL DEFAULT nextval('appointments_id_seq'),
+    patient_id INT NOT NULL,
+    doctor_id INT NOT NULL,
+    appointment_date TIMESTAMP NOT NULL,
+    status VARCHAR(30) DEFAULT 'scheduled' CHECK (status IN ('scheduled', 'confirmé', 'completed', 'canceled', 'canceled_by_doctor', 'annulé')),
+    urgent BOOLEAN DEFAULT FALSE,
+    slot_date DATE GENERATED ALWAYS AS (CAST(appointment_date AS DATE)) STORED,
+    slot_hour INT GENERATED ALWAYS AS (CAST(EXTRACT(HOUR FROM appointment_date) AS INT)) STORED,
+    PRIMARY KEY (id, appointment_date),
+    FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (doctor_id) REFERENCES users(id) ON DELETE CASCADE
+) PARTITION BY RANGE (appointment_date);
+
+-- Tout l'historique, plus 12 mois à venir
+SELECT healthtime_create_appointment_partitions(
+    LEAST(COALESCE((SELECT MIN(appointment_date) FROM appointments_unpartitioned)::DATE, CURRENT_DATE), CURRENT_DATE),
+    GREATEST(COALESCE((SELECT MAX(appointment_date) FROM appointments_unpartitioned)::DATE, CURRENT_DATE),
+             (CURRENT_DATE + INTERVAL '12 months')::DATE)
+);
+
+INSERT INTO appointments (id, patient_id, doctor_id, appointment_date, status, urgent)
+SELECT id, patient_id, doctor_id, appointment_date, status, urgent
+FROM appointments_unpartitioned;
+
+ALTER SEQUENCE appointments_id_seq OWNED BY appointments.id;
+DROP TABLE appointments_unpartitioned;
+
+-- Index de 001 et 002, recréés sur chaque partition
+CREATE INDEX idx_appointments_patient_date
+    ON appointments (patient_id, appointment_date);
+CREATE INDEX idx_appointments_doctor_date
+    ON appointments (doctor_id, appointment_date);
+CREATE INDEX idx_appointments_doctor_date_scheduled
+    ON appointments (doctor_id, appointment_date) WHERE status = 'scheduled';
+CREATE INDEX idx_appointments_patient_date_scheduled
+    ON appointments (patient_id, appointment_date) WHERE status = 'scheduled';
+CREATE INDEX idx_appointments_doctor_slot_scheduled
+    ON appointments (doctor_id, slot_date, slot_hour) WHERE status = 'scheduled';
+
+ANALYZE appointments;
@@ -0,0 +1,88 @@
+-- =========================================================================
+-- 005 : Statistiques d'administration maintenues par triggers
+-- =========================================================================
+-- Le tableau de bord admin chargeait tous les utilisateurs pour les compter
+-- en Python. admin_stats tient les compteurs à jour à chaque écriture ; la
+-- lecture ne dépend plus de la taille des tables.
+--   users             : clé « rôle/statut »
+--   appointments      : clé statut du rendez-vous
+--   specialty_doctors : clé id de la spécialité (docteurs rattachés)
+-- Chaque compteur est réparti sur 16 lignes (shard) pour que les
+-- réservations concurrentes ne se bloquent pas sur la même ligne.
+
+CREATE TABLE IF NOT EXISTS admin_stats (
+    metric VARCHAR(30) NOT NULL,
+    key VARCHAR(60) NOT NULL,
+    shard SMALLINT NOT NULL,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (metric, key, shard)
+);
+
+-- Triggers par instruction : TG_ARGV[0] est la métrique, TG_ARGV[1]
+-- l'expression de la clé sur les lignes de new_rows / old_rows
+CREATE OR REPLACE FUNCTION healthtime_count_stats() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    deltas TEXT;
+BEGIN
+    deltas := CASE TG_OP
+        WHEN 'INSERT' THEN format('SELECT %s AS key, 1 AS delta FROM new_rows', TG_ARGV[1])
+        WHEN 'DELETE' THEN format('SELECT %s AS key, -1 AS delta FROM old_rows', TG_ARGV[1])
+        ELSE format('SELECT %1$s AS key, -1 AS delta FROM old_rows UNION ALL SELECT %1$s, 1 FROM new_rows', TG_ARGV[1])
+    END;
+
+    EXECUTE format($sql$
+        INSERT INTO admin_stats (metric, key, shard, count)
+        SELECT %L, key, pg_backend_pid() %% 16, SUM(delta)
+        FROM (%s) deltas
+        GROUP BY key
+        HAVING SUM(delta) <> 0
+        ON CONFLICT (metric, key, shard) DO UPDATE SET count = admin_stats.count + EXCLUDED.count
+    $sql$, TG_ARGV[0], deltas);
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE TRIGGER trg_users_stats_insert AFTER INSERT ON users
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('users', 'concat_ws(''/'', role, status)');
+CREATE OR REPLACE TRIGGER trg_users_stats_update AFTER UPDATE ON users
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('users', 'concat_ws(''/'', role, status)');
+CREATE OR REPLACE TRIGGER trg_users_stats_delete AFTER DELETE ON users
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('users', 'concat_ws(''/'', role, status)');
+
+CREATE OR REPLACE TRIGGER trg_appointments_stats_insert AFTER INSERT ON appointments
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('appointments', 'COALESCE(status, '''')');
+CREATE OR REPLACE TRIGGER trg_appointments_stats_update AFTER UPDATE ON appointments
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('appointments', 'COALESCE(status, '''')');
+CREATE OR REPLACE TRIGGER trg_appointments_stats_delete AFTER DELETE ON appointments
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('appointments', 'COALESCE(status, '''')');
+
+CREATE OR REPLACE TRIGGER trg_doctor_specialties_stats_insert AFTER INSERT ON doctor_specialties
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('specialty_doctors', 'specialty_id::text');
+CREATE OR REPLACE TRIGGER trg_doctor_specialties_stats_update AFTER UPDATE ON doctor_specialties
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('specialty_doctors', 'specialty_id::text');
+CREATE OR REPLACE TRIGGER trg_doctor_specialties_stats_delete AFTER DELETE ON doctor_specialties
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('specialty_doctors', 'specialty_id::text');
+
+-- Recalcul complet (remplissage initial, ou après un TRUNCATE)
+CREATE OR REPLACE FUNCTION healthtime_rebuild_admin_stats() RETURNS VOID
+LANGUAGE sql AS $$
+    DELETE FROM admin_stats;
+    INSERT INTO admin_stats (metric, key, shard, count)
+    SELECT 'users', concat_ws('/', role, status), 0, COUNT(*) FROM users GROUP BY 2
+    UNION ALL
+    SELECT 'appointments', COALESCE(status, ''), 0, COUNT(*) FROM appointments GROUP BY 2
+    UNION ALL
+    SELECT 'specialty_doctors', specialty_id::text, 0, COUNT(*) FROM doctor_specialties GROUP BY 2;
+$$;
+
+-- Les triggers bloquent déjà les écritures jusqu'à la fin de la migration
+SELECT healthtime_rebuild_admin_stats();
@@ -0,0 +1,57 @@
+-- =========================================================================
+-- 006 : Un seul rendez-vous planifié par docteur et par heure, et par
+--       patient et par heure, garanti par la base
+-- =========================================================================
+-- Les créneaux sont horaires : appointment_date est toujours à l'heure pile,
+-- l'unicité sur (doctor_id, appointment_date) vaut donc unicité par heure
+-- (et contient la clé de partition, comme l'exige un index unique sur une
+-- table partitionnée).
+-- Les doublons déjà présents ne sont pas annulés d'office : leurs patients
+-- perdraient un rendez-vous sans être prévenus. La migration échoue en
+-- listant les rendez-vous en conflit ; un opérateur les règle (déplacement,
+-- ou annulation après avoir prévenu le patient) puis relance
+-- `python -m database.migrate`. Pas de CONCURRENTLY sur une table
+-- partitionnée : les index sont construits sous verrou d'écriture, en heure
+-- creuse.
+
+ALTER TABLE appointments
+    ADD CONSTRAINT appointments_on_the_hour CHECK (appointment_date = date_trunc('hour', appointment_date));
+
+DO $$
+DECLARE
+    conflicts INT;
+    listed TEXT;
+BEGIN
+    CREATE TEMPORARY TABLE conflicting_appointments ON COMMIT DROP AS
+    SELECT id, doctor_id, patient_id, appointment_date
+    FROM (
+        SELECT id, doctor_id, patient_id, appointment_date,
+               count(*) OVER (PARTITION BY doctor_id, appointment_date) AS doctor_count,
+               count(*) OVER (PARTITION BY patient_id, appointment_date) AS patient_count
+        FROM appointments
+        WHERE status = 'scheduled'
+    ) counted
+    WHERE doctor_count > 1 OR patient_count > 1;
+
+    SELECT count(*) INTO conflicts FROM conflicting_appointments;
+    IF conflicts > 0 THEN
+        SELECT string_agg(format('id %s (docteur %s, patient %s, %s)',
+                                 id, doctor_id, patient_id, appointment_date), E'\n')
+        INTO listed
+        FROM (SELECT * FROM conflicting_appointments ORDER BY appointment_date, doctor_id, id LIMIT 200) shown;
+
+        RAISE EXCEPTION '% rendez-vous planifiés en conflit (même docteur ou même patient à la même heure)', conflicts
+            USING DETAIL = listed,
+                  HINT = 'Déplacez ou annulez (en prévenant le patient) tous ces rendez-vous sauf un par heure, '
+                         'puis relancez python -m database.migrate. Seuls les 200 premiers sont listés.';
+    END IF;
+END $$;
+
+CREATE UNIQUE INDEX uq_appointments_doctor_hour_scheduled
+    ON appointments (doctor_id, appointment_date) WHERE status = 'scheduled';
+CREATE UNIQUE INDEX uq_appointments_patient_hour_scheduled
+    ON appointments (patient_id, appointment_date) WHERE status = 'scheduled';
+
+-- Mêmes colonnes que les index uniques ci-dessus
+DROP INDEX IF EXISTS idx_appointments_doctor_date_scheduled;
+DROP INDEX IF EXISTS idx_appointments_patient_date_scheduled;
@@ -0,0 +1,22 @@
+-- =========================================================================
+-- 007 : Clés d'idempotence des réservations et annulations
+-- =========================================================================
+-- Chaque formulaire envoie une clé unique ; la clé est réservée dans la même
+-- transaction que l'écriture et reçoit son résultat. Une requête rejouée
+-- (double clic, nouvel essai du navigateur ou du répartiteur de charge)
+-- retrouve ce résultat par la clé primaire au lieu de réserver à nouveau.
+-- Les clés expirées peuvent être réutilisées, et sont purgées par
+-- python -m database.idempotency.
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    key VARCHAR(64) NOT NULL,
+    action VARCHAR(20) NOT NULL,
+    success BOOLEAN,
+    message TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at);
@@ -0,0 +1,102 @@
+-- =========================================================================
+-- 008 : Disponibilités récurrentes (règles hebdomadaires)
+-- =========================================================================
+-- Une règle ouvre chaque semaine les heures [start_hour, end_hour) d'un jour
+-- (ISO : 1 = lundi) pendant sa période de validité ; une exception ferme
+-- toutes les règles d'un docteur sur une plage de dates (congés).
+-- Les règles sont développées à la demande par les requêtes de
+-- disponibilité : time_slots ne contient plus que les créneaux réservés
+-- ('booked') et les dérogations du docteur ('available' hors règle,
+-- 'unavailable' pour fermer une heure ouverte par une règle).
+
+CREATE TABLE IF NOT EXISTS availability_rules (
+    id SERIAL PRIMARY KEY,
+    doctor_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    weekday SMALLINT NOT NULL CHECK (weekday BETWEEN 1 AND 7),
+    start_hour SMALLINT NOT NULL CHECK (start_hour BETWEEN 0 AND 23),
+    end_hour SMALLINT NOT NULL CHECK (end_hour BETWEEN 1 AND 24),
+    valid_from DATE NOT NULL DEFAULT CURRENT_DATE,
+    valid_until DATE,
+    CHECK (start_hour < end_hour),
+    CHECK (valid_until IS NULL OR valid_until >= valid_from)
+);
+
+CREATE TABLE IF NOT EXISTS availability_exceptions (
+    id SERIAL PRIMARY KEY,
+    doctor_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    reason VARCHAR(100),
+    CHECK (end_date >= start_date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_availability_rules_doctor_weekday
+    ON availability_rules (doctor_id, weekday);
+CREATE INDEX IF NOT EXISTS idx_availability_exceptions_doctor_dates
+    ON availability_exceptions (doctor_id, start_date, end_date);
+
+-- Heures ouvertes par les règles d'un docteur un jour donné, hors exceptions.
+-- Fonctions SQL STABLE non STRICT : PostgreSQL les développe dans la requête
+-- appelante, qui garde ainsi l'usage des index.
+CREATE OR REPLACE FUNCTION healthtime_rule_hours(p_doctor_id INT, p_day DATE)
+RETURNS TABLE (slot_hour INT)
+LANGUAGE sql STABLE AS $$
+    SELECT DISTINCT h.hour
+    FROM availability_rules r
+    CROSS JOIN LATERAL generate_series(r.start_hour::int, r.end_hour::int - 1) AS h(hour)
+    WHERE r.doctor_id = p_doctor_id
+    AND r.weekday = EXTRACT(ISODOW FROM p_day)::int
+    AND r.valid_from <= p_day
+    AND (r.valid_until IS NULL OR r.valid_until >= p_day)
+    AND NOT EXISTS (
+        SELECT 1 FROM availability_exceptions e
+        WHERE e.doctor_id = p_doctor_id
+        AND p_day BETWEEN e.start_date AND e.end_date
+    )
+$$;
+
+-- Heures réservables d'un docteur un jour donné : créneaux ouverts
+-- explicitement, et heures des règles sans ligne time_slots (une ligne
+-- 'booked' ou 'unavailable' ferme l'heure)
+CREATE OR REPLACE FUNCTION healthtime_open_hours(p_doctor_id INT, p_day DATE)
+RETURNS TABLE (slot_hour INT)
+LANGUAGE sql STABLE AS $$
+    SELECT ts.slot_hour
+    FROM time_slots ts
+    WHERE ts.doctor_id = p_doctor_id
+    AND ts.slot_date = p_day
+    AND ts.status = 'available'
+    UNION
+    SELECT r.slot_hour
+    FROM healthtime_rule_hours(p_doctor_id, p_day) r
+    WHERE NOT EXISTS (
+        SELECT 1 FROM time_slots ts
+        WHERE ts.doctor_id = p_doctor_id
+        AND ts.slot_date = p_day
+        AND ts.slot_hour = r.slot_hour
+    )
+$$;
+
+-- Créneaux d'un docteur entre deux dates, règles développées en 'available'.
+-- Sans p_from : toutes les lignes time_slots jusqu'à p_to, règles à partir
+-- d'aujourd'hui.
+CREATE OR REPLACE FUNCTION healthtime_doctor_slots(p_doctor_id INT, p_from DATE, p_to DATE)
+RETURNS TABLE (slot_date DATE, slot_hour INT, status VARCHAR)
+LANGUAGE sql STABLE AS $$
+    SELECT ts.slot_date, ts.slot_hour, ts.status
+    FROM time_slots ts
+    WHERE ts.doctor_id = p_doctor_id
+    AND (p_from IS NULL OR ts.slot_date >= p_from)
+    AND ts.slot_date <= p_to
+    UNION ALL
+    SELECT d.day, r.slot_hour, 'available'::varchar
+    FROM generate_series(COALESCE(p_from, CURRENT_DATE), p_to, interval '1 day') AS g(day_start)
+    CROSS JOIN LATERAL (SELECT g.day_start::date AS day) d
+    CROSS JOIN LATERAL healthtime_rule_hours(p_doctor_id, d.day) r
+    WHERE NOT EXISTS (
+        SELECT 1 FROM time_slots ts
+        WHERE ts.doctor_id = p_doctor_id
+        AND ts.slot_date = d.day
+        AND ts.slot_hour = r.slot_hour
+    )
+$$;
@@ -0,0 +1,170 @@
+-- =========================================================================
+-- 009 : Masques de disponibilité par docteur et par jour
+-- =========================================================================
+-- Une ligne par docteur et par jour, trois masques de 24 bits (bit h =
+-- heure h) tenus à jour par triggers :
+--   available_mask : lignes time_slots 'available' (heures ouvertes à la main)
+--   closed_mask    : autres lignes time_slots ('booked', 'unavailable'), qui
+--                    ferment une heure ouverte par une règle
+--   booked_mask    : rendez-vous 'scheduled' (table appointments)
+-- Les heures réservables d'un jour se calculent alors en quelques
+-- opérations binaires sur une ligne, au lieu de parcourir les créneaux et
+-- les rendez-vous heure par heure ; la recherche « Peu importe » ne lit
+-- qu'une ligne par docteur de la spécialité.
+
+CREATE TABLE IF NOT EXISTS doctor_day_masks (
+    doctor_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    available_mask INT NOT NULL DEFAULT 0,
+    closed_mask INT NOT NULL DEFAULT 0,
+    booked_mask INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (doctor_id, day)
+);
+
+-- Triggers par instruction, comme ceux de admin_stats (migration 005) :
+-- TG_ARGV est une liste de paires (colonne de masque, condition sur la
+-- ligne). Les bits des anciennes lignes sont effacés, puis ceux des
+-- nouvelles posés ; les opérations binaires s'appliquent à la dernière
+-- version de la ligne, les transactions concurrentes ne perdent donc
+-- aucune mise à jour. Les lignes revenues à zéro sont supprimées.
+CREATE OR REPLACE FUNCTION healthtime_update_day_masks() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    columns TEXT[] := '{}';
+    bits TEXT[] := '{}';
+    cleared TEXT[] := '{}';
+    added TEXT[] := '{}';
+    touched TEXT;
+    changed BOOLEAN;
+BEGIN
+    -- Un trigger par instruction se déclenche aussi quand aucune ligne n'a
+    -- changé (réservation refusée, ON CONFLICT DO NOTHING) : rien à faire
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s)',
+                   CASE TG_OP WHEN 'INSERT' THEN 'new_rows' ELSE 'old_rows' END) INTO changed;
+    IF NOT changed THEN
+        RETURN NULL;
+    END IF;
+
+    FOR i IN 0 .. array_length(TG_ARGV, 1) / 2 - 1 LOOP
+        columns := columns || quote_ident(TG_ARGV[2 * i]);
+        bits := bits || format('COALESCE(bit_or(1 << slot_hour) FILTER (WHERE %s), 0)', TG_ARGV[2 * i + 1]);
+        cleared := cleared || format('%1$I = m.%1$I & ~d.%1$I', TG_ARGV[2 * i]);
+        added := added || format('%1$I = m.%1$I | EXCLUDED.%1$I', TG_ARGV[2 * i]);
+    END LOOP;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        EXECUTE format($sql$
+            UPDATE doctor_day_masks m SET %s
+            FROM (SELECT doctor_id, slot_date, %s FROM old_rows GROUP BY 1, 2) d (doctor_id, slot_date, %s)
+            WHERE m.doctor_id = d.doctor_id AND m.day = d.slot_date
+        $sql$, array_to_string(cleared, ', '), array_to_string(bits, ', '), array_to_string(columns, ', '));
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        EXECUTE format($sql$
+            INSERT INTO doctor_day_masks AS m (doctor_id, day, %s)
+            SELECT doctor_id, slot_date, %s FROM new_rows GROUP BY 1, 2
+            ON CONFLICT (doctor_id, day) DO UPDATE SET %s
+        $sql$, array_to_string(columns, ', '), array_to_string(bits, ', '), array_to_string(added, ', '));
+    END IF;
+
+    touched := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT doctor_id, slot_date FROM new_rows'
+        WHEN 'DELETE' THEN 'SELECT doctor_id, slot_date FROM old_rows'
+        ELSE 'SELECT doctor_id, slot_date FROM old_rows UNION SELECT doctor_id, slot_date FROM new_rows'
+    END;
+    EXECUTE format($sql$
+        DELETE FROM doctor_day_masks m
+        WHERE m.available_mask = 0 AND m.closed_mask = 0 AND m.booked_mask = 0
+        AND (m.doctor_id, m.day) IN (%s)
+    $sql$, touched);
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE TRIGGER trg_time_slots_masks_insert AFTER INSERT ON time_slots
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks(
+        'available_mask', 'status = ''available''', 'closed_mask', 'status <> ''available''');
+CREATE OR REPLACE TRIGGER trg_time_slots_masks_update AFTER UPDATE ON time_slots
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks(
+        'available_mask', 'status = ''available''', 'closed_mask', 'status <> ''available''');
+CREATE OR REPLACE TRIGGER trg_time_slots_masks_delete AFTER DELETE ON time_slots
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks(
+        'available_mask', 'status = ''available''', 'closed_mask', 'status <> ''available''');
+
+CREATE OR REPLACE TRIGGER trg_appointments_masks_insert AFTER INSERT ON appointments
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks('booked_mask', 'status = ''scheduled''');
+CREATE OR REPLACE TRIGGER trg_appointments_masks_update AFTER UPDATE ON appointments
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks('booked_mask', 'status = ''scheduled''');
+CREATE OR REPLACE TRIGGER trg_appointments_masks_delete AFTER DELETE ON appointments
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks('booked_mask', 'status = ''scheduled''');
+
+-- Heures ouvertes par les règles d'un docteur un jour donné, en masque
+CREATE OR REPLACE FUNCTION healthtime_rule_mask(p_doctor_id INT, p_day DATE)
+RETURNS TABLE (rule_mask INT)
+LANGUAGE sql STABLE AS $$
+    SELECT COALESCE(bit_or((1 << r.end_hour) - (1 << r.start_hour)), 0)
+    FROM availability_rules r
+    WHERE r.doctor_id = p_doctor_id
+    AND r.weekday = EXTRACT(ISODOW FROM p_day)::int
+    AND r.valid_from <= p_day
+    AND (r.valid_until IS NULL OR r.valid_until >= p_day)
+    AND NOT EXISTS (
+        SELECT 1 FROM availability_exceptions e
+        WHERE e.doctor_id = p_doctor_id
+        AND p_day BETWEEN e.start_date AND e.end_date
+    )
+$$;
+
+-- Masques d'un docteur un jour donné : heures réservables (heures des
+-- règles non fermées et heures ouvertes à la main, moins les rendez-vous)
+-- et heures réservées. Toujours une ligne, à zéro pour un jour vide.
+CREATE OR REPLACE FUNCTION healthtime_day_mask(p_doctor_id INT, p_day DATE)
+RETURNS TABLE (open_mask INT, booked_mask INT)
+LANGUAGE sql STABLE AS $$
+    SELECT ((r.rule_mask & ~COALESCE(m.closed_mask, 0)) | COALESCE(m.available_mask, 0))
+               & ~COALESCE(m.booked_mask, 0),
+           COALESCE(m.booked_mask, 0)
+    FROM healthtime_rule_mask(p_doctor_id, p_day) r
+    LEFT JOIN doctor_day_masks m ON m.doctor_id = p_doctor_id AND m.day = p_day
+$$;
+
+-- Même contrat qu'en 008, mais lu dans les masques : les heures déjà
+-- prises par un rendez-vous 'scheduled' sont maintenant exclues
+CREATE OR REPLACE FUNCTION healthtime_open_hours(p_doctor_id INT, p_day DATE)
+RETURNS TABLE (slot_hour INT)
+LANGUAGE sql STABLE AS $$
+    SELECT h.hour
+    FROM healthtime_day_mask(p_doctor_id, p_day) m
+    CROSS JOIN generate_series(0, 23) AS h(hour)
+    WHERE m.open_mask & (1 << h.hour) <> 0
+$$;
+
+-- Recalcul complet (remplissage initial, ou après un TRUNCATE)
+CREATE OR REPLACE FUNCTION healthtime_rebuild_day_masks() RETURNS VOID
+LANGUAGE sql AS $$
+    DELETE FROM doctor_day_masks;
+    INSERT INTO doctor_day_masks (doctor_id, day, available_mask, closed_mask, booked_mask)
+    SELECT doctor_id, slot_date,
+           COALESCE(bit_or(1 << slot_hour) FILTER (WHERE kind = 'available'), 0),
+           COALESCE(bit_or(1 << slot_hour) FILTER (WHERE kind = 'closed'), 0),
+           COALESCE(bit_or(1 << slot_hour) FILTER (WHERE kind = 'booked'), 0)
+    FROM (
+        SELECT doctor_id, slot_date, slot_hour,
+               CASE WHEN status = 'available' THEN 'available' ELSE 'closed' END AS kind
+        FROM time_slots
+        UNION ALL
+        SELECT doctor_id, slot_date, slot_hour, 'booked'
+        FROM appointments
+        WHERE status = 'scheduled'
+    ) slots
+    GROUP BY doctor_id, slot_date;
+$$;
+
+-- Les triggers bloquent déjà les écritures jusqu'à la fin de la migration
+SELECT healthtime_rebuild_day_masks();
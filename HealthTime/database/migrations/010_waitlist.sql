@@ -0,0 +1,35 @@
+-- =========================================================================
+-- 010 : Liste d'attente
+-- =========================================================================
+-- Un patient sans créneau s'inscrit pour un docteur ou pour une spécialité,
+-- sur une période. Quand un rendez-vous est annulé, l'heure libérée est
+-- attribuée au premier inscrit compatible (urgents d'abord, puis par ordre
+-- d'inscription) dans la transaction de l'annulation : le patient n'a plus
+-- à recharger la page de réservation pour guetter les désistements.
+
+CREATE TABLE IF NOT EXISTS waitlist (
+    id SERIAL PRIMARY KEY,
+    patient_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    doctor_id INT REFERENCES users(id) ON DELETE CASCADE,
+    specialty_id INT REFERENCES specialties(id) ON DELETE CASCADE,
+    date_from DATE NOT NULL,
+    date_to DATE NOT NULL,
+    urgent BOOLEAN NOT NULL DEFAULT FALSE,
+    status VARCHAR(20) NOT NULL DEFAULT 'waiting'
+        CHECK (status IN ('waiting', 'assigned', 'canceled')),
+    -- Rendez-vous attribué (pas de clé étrangère : appointments est partitionnée)
+    appointment_id INT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    assigned_at TIMESTAMP,
+    -- Un docteur ou une spécialité, pas les deux
+    CHECK ((doctor_id IS NULL) <> (specialty_id IS NULL)),
+    CHECK (date_from <= date_to)
+);
+
+-- Inscrits encore en attente, cherchés à chaque annulation
+CREATE INDEX IF NOT EXISTS idx_waitlist_doctor_waiting
+    ON waitlist (doctor_id, date_from) WHERE status = 'waiting';
+CREATE INDEX IF NOT EXISTS idx_waitlist_specialty_waiting
+    ON waitlist (specialty_id, date_from) WHERE status = 'waiting';
+CREATE INDEX IF NOT EXISTS idx_waitlist_patient
+    ON waitlist (patient_id);
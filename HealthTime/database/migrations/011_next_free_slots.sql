@@ -0,0 +1,41 @@
+-- =========================================================================
+-- 011 : Recherche des prochains créneaux libres
+-- =========================================================================
+-- « Prochains créneaux » cherche les premières heures libres sur plusieurs
+-- semaines au lieu d'un jour choisi. Pour un docteur, une requête sur les
+-- masques de 009 suffit ; pour une spécialité, cette fonction évite de
+-- calculer les masques de tous ses docteurs sur tout l'horizon.
+
+-- Les p_limit premières heures après p_after (jusqu'au jour p_until) où au
+-- moins un docteur actif de la spécialité est libre, avec le nombre de
+-- docteurs libres. Les jours sont lus un par un et la recherche s'arrête
+-- dès que p_limit heures sont trouvées : les jours lointains ne sont lus
+-- que si les premiers sont pleins.
+CREATE OR REPLACE FUNCTION healthtime_next_free_hours(p_specialty_id INT, p_after TIMESTAMP,
+                                                      p_until DATE, p_limit INT)
+RETURNS TABLE (day DATE, slot_hour INT, doctor_count BIGINT)
+LANGUAGE plpgsql STABLE AS $$
+DECLARE
+    current_day DATE := p_after::date;
+    found_hours INT := 0;
+    rows_found INT;
+BEGIN
+    WHILE current_day <= p_until AND found_hours < p_limit LOOP
+        RETURN QUERY
+            SELECT current_day, h.hour, COUNT(*)
+            FROM doctor_specialties ds
+            JOIN users u ON u.id = ds.doctor_id
+            CROSS JOIN LATERAL healthtime_day_mask(u.id, current_day) m
+            JOIN generate_series(0, 23) AS h(hour) ON m.open_mask & (1 << h.hour) <> 0
+            WHERE ds.specialty_id = p_specialty_id
+            AND u.status = 'active'
+            AND m.open_mask <> 0
+            AND current_day + make_interval(hours => h.hour) > p_after
+            GROUP BY h.hour
+            ORDER BY h.hour
+            LIMIT p_limit - found_hours;
+        GET DIAGNOSTICS rows_found = ROW_COUNT;
+        found_hours := found_hours + rows_found;
+        current_day := current_day + 1;
+    END LOOP;
+END $$;
@@ -0,0 +1,25 @@
+-- =========================================================================
+-- 012 : Notifications des patients
+-- =========================================================================
+-- Quand un docteur déclare une absence ou que son compte est désactivé, ses
+-- rendez-vous à venir de la période sont annulés en une seule instruction
+-- (CANCEL_DOCTOR_APPOINTMENTS), qui inscrit aussi ici une notification par
+-- rendez-vous annulé. Le patient la voit à sa prochaine connexion, jusqu'à
+-- ce qu'il la marque comme lue.
+
+CREATE TABLE IF NOT EXISTS notifications (
+    id SERIAL PRIMARY KEY,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    kind VARCHAR(30) NOT NULL
+        CHECK (kind IN ('doctor_absence', 'doctor_deactivated')),
+    -- Rendez-vous annulé (pas de clé étrangère : appointments est partitionnée)
+    appointment_id INT,
+    doctor_id INT REFERENCES users(id) ON DELETE CASCADE,
+    appointment_date TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    read_at TIMESTAMP
+);
+
+-- Notifications non lues d'un utilisateur, lues à chaque page du tableau de bord
+CREATE INDEX IF NOT EXISTS idx_notifications_user_unread
+    ON notifications (user_id, created_at) WHERE read_at IS NULL;
@@ -0,0 +1,163 @@
+-- =========================================================================
+-- 013 : Rendez-vous à la minute : durée, période tsrange et contraintes
+--       d'exclusion GiST
+-- =========================================================================
+-- Un rendez-vous a maintenant une durée (60 minutes par défaut) et une
+-- période [début, fin) calculée. Il reste contenu dans une heure de la
+-- grille : il commence sur un multiple de 5 minutes et finit au plus tard à
+-- l'heure suivante. Les masques horaires (009), la liste d'attente et les
+-- écrans restent donc valables : une heure entamée par une consultation
+-- courte a sa ligne time_slots 'booked', comme une heure réservée, et ses
+-- minutes libres se calculent par soustraction de périodes
+-- (healthtime_free_periods).
+--
+-- Deux rendez-vous planifiés d'un même docteur, ou d'un même patient, ne
+-- peuvent plus se chevaucher : contraintes d'exclusion GiST sur (docteur,
+-- période). PostgreSQL 16 ne les accepte pas sur une table partitionnée ;
+-- elles sont posées sur chaque partition, ce qui suffit puisqu'une période
+-- ne sort jamais de son heure, donc de son mois. Sans l'extension
+-- btree_gist, l'égalité sur le docteur passe par int4range(id, id, '[]'),
+-- que l'opérateur = de range_ops sait indexer.
+--
+-- Les index uniques de la migration 006 restent : les réservations à
+-- l'heure pile s'en servent toujours. La table est réécrite (colonne
+-- générée) sous verrou d'écriture : à passer en heure creuse.
+
+ALTER TABLE appointments
+    ADD COLUMN IF NOT EXISTS duration_minutes SMALLINT NOT NULL DEFAULT 60,
+    ADD COLUMN IF NOT EXISTS period TSRANGE GENERATED ALWAYS AS (
+        tsrange(appointment_date, appointment_date + duration_minutes * INTERVAL '1 minute')
+    ) STORED;
+
+ALTER TABLE appointments DROP CONSTRAINT IF EXISTS appointments_on_the_hour;
+ALTER TABLE appointments
+    ADD CONSTRAINT appointments_within_the_hour CHECK (
+        duration_minutes BETWEEN 5 AND 60
+        AND duration_minutes % 5 = 0
+        AND appointment_date = date_trunc('minute', appointment_date)
+        AND EXTRACT(MINUTE FROM appointment_date)::int % 5 = 0
+        AND EXTRACT(MINUTE FROM appointment_date)::int + duration_minutes <= 60
+    );
+
+-- Contraintes d'exclusion d'une partition de appointments
+CREATE OR REPLACE FUNCTION healthtime_add_appointment_exclusions(partition_name TEXT) RETURNS VOID
+LANGUAGE plpgsql AS $$
+BEGIN
+    EXECUTE format(
+        'ALTER TABLE %I ADD CONSTRAINT %I EXCLUDE USING gist '
+        '(int4range(doctor_id, doctor_id, ''[]'') WITH =, period WITH &&) WHERE (status = ''scheduled'')',
+        partition_name, partition_name || '_doctor_overlap'
+    );
+    EXECUTE format(
+        'ALTER TABLE %I ADD CONSTRAINT %I EXCLUDE USING gist '
+        '(int4range(patient_id, patient_id, ''[]'') WITH =, period WITH &&) WHERE (status = ''scheduled'')',
+        partition_name, partition_name || '_patient_overlap'
+    );
+END $$;
+
+DO $$
+DECLARE
+    partition_name TEXT;
+BEGIN
+    FOR partition_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'appointments'::regclass
+    LOOP
+        PERFORM healthtime_add_appointment_exclusions(partition_name);
+    END LOOP;
+END $$;
+
+-- Même fonction qu'en 004, les nouvelles partitions reçoivent leurs
+-- contraintes d'exclusion
+CREATE OR REPLACE FUNCTION healthtime_create_appointment_partitions(from_month DATE, to_month DATE)
+RETURNS INT LANGUAGE plpgsql AS $$
+DECLARE
+    month DATE := date_trunc('month', from_month)::DATE;
+    partition_name TEXT;
+    created INT := 0;
+BEGIN
+    WHILE month <= to_month LOOP
+        partition_name := 'appointments_' || to_char(month, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF appointments FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month, (month + INTERVAL '1 month')::DATE
+            );
+            PERFORM healthtime_add_appointment_exclusions(partition_name);
+            created := created + 1;
+        END IF;
+        month := (month + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN created;
+END $$;
+
+-- booked_mask ne compte plus que les rendez-vous d'une heure entière : une
+-- heure peut porter plusieurs consultations courtes, et effacer son bit à
+-- l'annulation de l'une d'elles serait faux. Ces heures restent fermées par
+-- leur ligne time_slots 'booked' (closed_mask).
+CREATE OR REPLACE TRIGGER trg_appointments_masks_insert AFTER INSERT ON appointments
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks(
+        'booked_mask', 'status = ''scheduled'' AND duration_minutes = 60');
+CREATE OR REPLACE TRIGGER trg_appointments_masks_update AFTER UPDATE ON appointments
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks(
+        'booked_mask', 'status = ''scheduled'' AND duration_minutes = 60');
+CREATE OR REPLACE TRIGGER trg_appointments_masks_delete AFTER DELETE ON appointments
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks(
+        'booked_mask', 'status = ''scheduled'' AND duration_minutes = 60');
+
+CREATE OR REPLACE FUNCTION healthtime_rebuild_day_masks() RETURNS VOID
+LANGUAGE sql AS $$
+    DELETE FROM doctor_day_masks;
+    INSERT INTO doctor_day_masks (doctor_id, day, available_mask, closed_mask, booked_mask)
+    SELECT doctor_id, slot_date,
+           COALESCE(bit_or(1 << slot_hour) FILTER (WHERE kind = 'available'), 0),
+           COALESCE(bit_or(1 << slot_hour) FILTER (WHERE kind = 'closed'), 0),
+           COALESCE(bit_or(1 << slot_hour) FILTER (WHERE kind = 'booked'), 0)
+    FROM (
+        SELECT doctor_id, slot_date, slot_hour,
+               CASE WHEN status = 'available' THEN 'available' ELSE 'closed' END AS kind
+        FROM time_slots
+        UNION ALL
+        SELECT doctor_id, slot_date, slot_hour, 'booked'
+        FROM appointments
+        WHERE status = 'scheduled' AND duration_minutes = 60
+    ) slots
+    GROUP BY doctor_id, slot_date;
+$$;
+
+-- Débuts possibles d'une consultation de p_minutes chez un docteur un jour
+-- donné : heures libres et heures entamées par des consultations courtes,
+-- moins les périodes des rendez-vous planifiés (soustraction de
+-- tsmultirange). Les débuts sont alignés sur la durée dans chaque heure.
+CREATE OR REPLACE FUNCTION healthtime_free_periods(p_doctor_id INT, p_day DATE, p_minutes INT)
+RETURNS TABLE (start_at TIMESTAMP)
+LANGUAGE sql STABLE AS $$
+    WITH hours AS (
+        SELECT slot_hour FROM healthtime_open_hours(p_doctor_id, p_day)
+        UNION
+        SELECT slot_hour FROM time_slots
+        WHERE doctor_id = p_doctor_id AND slot_date = p_day AND status = 'booked'
+    ), free AS (
+        SELECT COALESCE(range_agg(tsrange(p_day + make_interval(hours => slot_hour),
+                                          p_day + make_interval(hours => slot_hour + 1))),
+                        '{}'::tsmultirange)
+               - COALESCE((SELECT range_agg(a.period)
+                           FROM appointments a
+                           WHERE a.doctor_id = p_doctor_id
+                           AND a.status = 'scheduled'
+                           AND a.appointment_date >= p_day AND a.appointment_date < p_day + 1),
+                          '{}'::tsmultirange) AS periods
+        FROM hours
+    )
+    SELECT s.start_at
+    FROM hours
+    CROSS JOIN free
+    CROSS JOIN generate_series(0, 60 - p_minutes, p_minutes) AS m(minute)
+    CROSS JOIN LATERAL (SELECT p_day + make_interval(hours => hours.slot_hour, mins => m.minute) AS start_at) s
+    WHERE free.periods @> tsrange(s.start_at, s.start_at + make_interval(mins => p_minutes))
+$$;
@@ -0,0 +1,47 @@
+-- =========================================================================
+-- 014 : Minutes libres et absences des docteurs
+-- =========================================================================
+-- healthtime_free_periods (013) ajoutait aux heures réservables toutes les
+-- heures entamées par une consultation courte, sans regarder les absences
+-- (availability_exceptions, 008). Une absence posée sans annuler les
+-- rendez-vous laissait donc réserver les minutes restantes de ces heures,
+-- alors que les heures libres du même jour n'étaient plus proposées. Les
+-- heures entamées ne sont plus reprises un jour d'absence.
+
+-- Débuts possibles d'une consultation de p_minutes chez un docteur un jour
+-- donné : heures libres et heures entamées par des consultations courtes
+-- (sauf un jour d'absence), moins les périodes des rendez-vous planifiés
+-- (soustraction de tsmultirange). Les débuts sont alignés sur la durée dans
+-- chaque heure.
+CREATE OR REPLACE FUNCTION healthtime_free_periods(p_doctor_id INT, p_day DATE, p_minutes INT)
+RETURNS TABLE (start_at TIMESTAMP)
+LANGUAGE sql STABLE AS $$
+    WITH hours AS (
+        SELECT slot_hour FROM healthtime_open_hours(p_doctor_id, p_day)
+        UNION
+        SELECT slot_hour FROM time_slots
+        WHERE doctor_id = p_doctor_id AND slot_date = p_day AND status = 'booked'
+        AND NOT EXISTS (
+            SELECT 1 FROM availability_exceptions e
+            WHERE e.doctor_id = p_doctor_id
+            AND p_day BETWEEN e.start_date AND e.end_date
+        )
+    ), free AS (
+        SELECT COALESCE(range_agg(tsrange(p_day + make_interval(hours => slot_hour),
+                                          p_day + make_interval(hours => slot_hour + 1))),
+                        '{}'::tsmultirange)
+               - COALESCE((SELECT range_agg(a.period)
+                           FROM appointments a
+                           WHERE a.doctor_id = p_doctor_id
+                           AND a.status = 'scheduled'
+                           AND a.appointment_date >= p_day AND a.appointment_date < p_day + 1),
+                          '{}'::tsmultirange) AS periods
+        FROM hours
+    )
+    SELECT s.start_at
+    FROM hours
+    CROSS JOIN free
+    CROSS JOIN generate_series(0, 60 - p_minutes, p_minutes) AS m(minute)
+    CROSS JOIN LATERAL (SELECT p_day + make_interval(hours => hours.slot_hour, mins => m.minute) AS start_at) s
+    WHERE free.periods @> tsrange(s.start_at, s.start_at + make_interval(mins => p_minutes))
+$$;
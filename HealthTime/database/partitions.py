@@ -0,0 +1,155 @@
+"""
+Maintenance of the monthly appointments partitions (migration 004).
+
+Future months must exist before anything is booked in them: run
+ensure_partitions() daily (cron) and after each deployment, which
+database.migrate already does. Bookings stop at booking_horizon(), one month
+short of the last partition, so a missed run never lets a booking reach a
+month without its partition. Old months are detached with DETACH PARTITION
+CONCURRENTLY, which does not block bookings; the detached table can then be
+archived (pg_dump -t) and dropped.
+
+    python -m database.partitions                    # creates the coming months
+    python -m database.partitions --list
+    python -m database.partitions --detach-before 2024-01 [--drop]
+"""
+import argparse
+import sys
+from datetime import date, timedelta
+
+from config import settings
+from database.db import connect_from_env
+
+
+def _month(value):
+    return date(value.year, value.month, 1)
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"appointments_{month.year:04d}_{month.month:02d}"
+
+
+def booking_horizon(today=None, months_ahead=None):
+    """
+    Last day that can be booked: the end of the month before the last one
+    ensure_partitions() creates, which a run in the previous month created.
+    """
+    if months_ahead is None:
+        months_ahead = settings.DB_APPOINTMENT_PARTITIONS_AHEAD
+    return _add_months(_month(today or date.today()), months_ahead) - timedelta(days=1)
+
+
+def is_partitioned(cursor):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('appointments')")
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def ensure_partitions(conn, months_ahead=None, today=None):
+    """Creates the missing partitions from the current month to `months_ahead` months later; returns how many."""
+    if months_ahead is None:
+        months_ahead = settings.DB_APPOINTMENT_PARTITIONS_AHEAD
+    current = _month(today or date.today())
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT healthtime_create_appointment_partitions(%s, %s)",
+            (current, _add_months(current, months_ahead))
+        )
+        created = cursor.fetchone()[0]
+        conn.commit()
+        return created
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def list_partitions(conn):
+    """[(name, bounds, estimated rows)] of the attached partitions, oldest first."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'appointments'::regclass
+            ORDER BY c.relname
+        """)
+        return [(name, bounds, max(int(rows), 0)) for name, bounds, rows in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def detach_partitions(conn, before, drop=False):
+    """
+    Detaches (and with drop=True, drops) the partitions of the months before
+    `before`. The current month is never detached. Returns the detached names.
+    """
+    before = min(_month(before), _month(date.today()))
+    names = [
+        name for name, _, _ in list_partitions(conn)
+        if name.startswith("appointments_") and name < partition_name(before)
+    ]
+
+    # DETACH ... CONCURRENTLY cannot run inside a transaction block
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        for name in names:
+            cursor.execute(f"ALTER TABLE appointments DETACH PARTITION {name} CONCURRENTLY")
+            # Detached rows leave appointments without firing the admin_stats triggers
+            cursor.execute(f"""
+                INSERT INTO admin_stats (metric, key, shard, count)
+                SELECT 'appointments', COALESCE(status, ''), 0, -COUNT(*) FROM {name} GROUP BY 2
+                ON CONFLICT (metric, key, shard) DO UPDATE SET count = admin_stats.count + EXCLUDED.count
+            """)
+            if drop:
+                cursor.execute(f"DROP TABLE {name}")
+    finally:
+        cursor.close()
+        conn.autocommit = autocommit
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Partitions mensuelles de la table appointments.")
+    parser.add_argument("--ahead", type=int, default=settings.DB_APPOINTMENT_PARTITIONS_AHEAD,
+                        help="nombre de mois à créer à l'avance")
+    parser.add_argument("--list", action="store_true", help="liste les partitions attachées")
+    parser.add_argument("--detach-before", metavar="AAAA-MM", help="détache les mois antérieurs à AAAA-MM")
+    parser.add_argument("--drop", action="store_true", help="supprime les partitions détachées")
+    args = parser.parse_args(argv)
+
+    conn = connect_from_env()
+    try:
+        if args.list:
+            for name, bounds, rows in list_partitions(conn):
+                print(f"{name:24} {rows:>10} lignes  {bounds}")
+        elif args.detach_before:
+            year, month = (int(part) for part in args.detach_before.split("-"))
+            names = detach_partitions(conn, date(year, month, 1), drop=args.drop)
+            action = "supprimée(s)" if args.drop else "détachée(s)"
+            print(f"{len(names)} partition(s) {action} : {', '.join(names) or '-'}")
+        else:
+            created = ensure_partitions(conn, args.ahead)
+            print(f"{created} partition(s) créée(s)")
+        return 0
+    except Exception as e:
+        print(f"Erreur : {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,799 @@
+"""
+Catalog of the hot DAO queries.
+
+Each query is declared once here, with PostgreSQL $n placeholders, and run
+through execute(). On a given connection the first call PREPAREs it on the
+server; later calls only send EXECUTE, so PostgreSQL does not parse and plan
+the same SQL text again on every booking, search or dashboard load.
+
+Set DB_PREPARED_STATEMENTS=0 to send the SQL text each time instead (needed
+behind a transaction-pooling proxy such as PgBouncer).
+"""
+import re
+import threading
+import weakref
+from collections import Counter
+
+from config import settings
+
+
+class Query:
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.statement = f"ht_{name}"
+        self.nparams = max((int(n) for n in re.findall(r"\$(\d+)", sql)), default=0)
+        # Same SQL with psycopg2 placeholders, for the non prepared path;
+        # named so that a parameter may appear several times
+        self.plain_sql = re.sub(r"\$(\d+)", r"%(p\1)s", sql.replace("%", "%%"))
+
+    def plain_params(self, params):
+        """Parameters of plain_sql, from the positional parameters of sql."""
+        return {f"p{i}": value for i, value in enumerate(params, start=1)}
+
+    def __repr__(self):
+        return f"<Query {self.name}>"
+
+
+_prepared = weakref.WeakKeyDictionary()
+_prepare_counts = Counter()
+_execute_counts = Counter()
+_lock = threading.Lock()
+
+
+def execute(cursor, query, params=()):
+    """Runs a catalog query on the cursor; fetch results from the cursor as usual."""
+    params = tuple(params)
+    if len(params) != query.nparams:
+        raise ValueError(f"{query.name} expects {query.nparams} parameters, got {len(params)}")
+
+    count_execution(query)
+
+    if not settings.DB_PREPARED_STATEMENTS:
+        cursor.execute(query.plain_sql, query.plain_params(params))
+        return
+
+    # cursor.connection is the real psycopg2 connection, even when DAOs are
+    # handed a unit of work's shared connection
+    conn = cursor.connection
+    with _lock:
+        prepared = _prepared.setdefault(conn, set())
+        needs_prepare = query.name not in prepared
+
+    if needs_prepare:
+        cursor.execute(f"PREPARE {query.statement} AS {query.sql}")
+        with _lock:
+            prepared.add(query.name)
+            _prepare_counts[query.name] += 1
+
+    if params:
+        placeholders = ", ".join(["%s"] * len(params))
+        cursor.execute(f"EXECUTE {query.statement} ({placeholders})", params)
+    else:
+        cursor.execute(f"EXECUTE {query.statement}")
+
+
+def count_execution(query):
+    with _lock:
+        _execute_counts[query.name] += 1
+
+
+def stats():
+    """Returns {query name: {"prepares": n, "executions": n}} since start (or reset_stats())."""
+    with _lock:
+        return {
+            query.name: {
+                "prepares": _prepare_counts[query.name],
+                "executions": _execute_counts[query.name],
+            }
+            for query in ALL_QUERIES
+        }
+
+
+def reset_stats():
+    with _lock:
+        _prepare_counts.clear()
+        _execute_counts.clear()
+
+
+# =========================================================================
+# Authentication / search
+# =========================================================================
+
+AUTHENTICATE = Query("authenticate", """
+    SELECT id, name, role, status FROM users WHERE username=$1 AND password=$2
+""")
+
+SPECIALTIES = Query("specialties", """
+    SELECT id, name FROM specialties ORDER BY name ASC
+""")
+
+ACTIVE_DOCTORS = Query("active_doctors", """
+    SELECT id, name FROM users WHERE role='doctor' AND status='active'
+""")
+
+SEARCH_LIMIT = 50
+
+# Doctors whose name, or one of whose specialties, resembles $1 (accents and
+# case ignored, typos tolerated), best matches first. Both branches of
+# `matches` are served by the trigram indexes of migration 003.
+SEARCH_DOCTORS_BY_NAME = Query("search_doctors_by_name", """
+    WITH matches AS (
+        SELECT u.id
+        FROM users u
+        WHERE u.role = 'doctor'
+        AND (healthtime_search_key($1) <% healthtime_search_key(u.name)
+             OR healthtime_search_key(u.name) LIKE '%' || healthtime_search_key($1) || '%')
+        UNION
+        SELECT ds.doctor_id
+        FROM specialties s
+        JOIN doctor_specialties ds ON ds.specialty_id = s.id
+        WHERE healthtime_search_key($1) <% healthtime_search_key(s.name)
+        OR healthtime_search_key(s.name) LIKE '%' || healthtime_search_key($1) || '%'
+    )
+    SELECT u.id, u.name, u.username,
+           string_agg(s.name, ', ' ORDER BY s.name) AS specialty
+    FROM matches m
+    JOIN users u ON u.id = m.id
+    LEFT JOIN doctor_specialties ds ON ds.doctor_id = u.id
+    LEFT JOIN specialties s ON s.id = ds.specialty_id
+    WHERE u.status = 'active'
+    GROUP BY u.id, u.name, u.username
+    ORDER BY GREATEST(
+                 word_similarity(healthtime_search_key($1), healthtime_search_key(u.name)),
+                 0.8 * COALESCE(MAX(word_similarity(healthtime_search_key($1), healthtime_search_key(s.name))), 0)
+             ) DESC,
+             u.name
+    LIMIT $2
+""")
+
+# Doctor names and specialties with a word starting with $1, for the search
+# box suggestions; names starting with $1 come first.
+AUTOCOMPLETE = Query("autocomplete", """
+    (SELECT 'doctor' AS kind, u.id, u.name
+     FROM users u
+     WHERE u.role = 'doctor'
+     AND u.status = 'active'
+     AND (healthtime_search_key(u.name) LIKE healthtime_search_key($1) || '%'
+          OR healthtime_search_key(u.name) LIKE '% ' || healthtime_search_key($1) || '%')
+     ORDER BY healthtime_search_key(u.name) LIKE healthtime_search_key($1) || '%' DESC, u.name
+     LIMIT $2)
+    UNION ALL
+    (SELECT 'specialty' AS kind, s.id, s.name
+     FROM specialties s
+     WHERE healthtime_search_key(s.name) LIKE healthtime_search_key($1) || '%'
+     OR healthtime_search_key(s.name) LIKE '% ' || healthtime_search_key($1) || '%'
+     ORDER BY s.name
+     LIMIT $2)
+""")
+
+SEARCH_DOCTORS_BY_SPECIALTY = Query("search_doctors_by_specialty", """
+    SELECT u.id, u.name, u.username, s.name as specialty
+    FROM users u
+    JOIN doctor_specialties ds ON u.id = ds.doctor_id
+    JOIN specialties s ON ds.specialty_id = s.id
+    WHERE u.role = 'doctor'
+    AND u.status = 'active'
+    AND s.id = $1
+""")
+
+# =========================================================================
+# Availability
+# =========================================================================
+# appointments is partitioned by month on appointment_date: queries bounded
+# by a day repeat the bound on appointment_date so that only that day's
+# partition is read (slot_date alone does not allow pruning).
+#
+# Open hours come from healthtime_open_hours() (migration 008): the slots a
+# doctor opened explicitly plus the hours of their weekly rules, expanded on
+# the fly. Since migration 009 they are read from doctor_day_masks, one row
+# of 24-bit masks per doctor and day kept up to date by triggers, and hours
+# already booked are left out. The SQL functions are inlined into these
+# queries by PostgreSQL.
+
+# Slots of doctor $1 from $2 (NULL: every stored slot, rules from today) to
+# $3, rule hours included as 'available'
+DOCTOR_SLOTS = Query("doctor_slots", """
+    SELECT slot_date, slot_hour, status
+    FROM healthtime_doctor_slots($1, $2, $3)
+    ORDER BY slot_date, slot_hour
+""")
+
+AVAILABLE_SLOTS_FOR_DOCTOR = Query("available_slots_for_doctor", """
+    SELECT slot_hour
+    FROM healthtime_open_hours($1, $2)
+    ORDER BY slot_hour
+""")
+
+AVAILABLE_SLOTS_BY_SPECIALTY = Query("available_slots_by_specialty", """
+    SELECT o.slot_hour, u.id, u.name
+    FROM doctor_specialties ds
+    JOIN users u ON u.id = ds.doctor_id
+    CROSS JOIN LATERAL healthtime_open_hours(u.id, $2) o
+    WHERE ds.specialty_id = $1
+    AND u.status = 'active'
+    ORDER BY o.slot_hour, u.name
+""")
+
+# Every doctor of specialty $1, whatever their status: the availability
+# index drops a specialty's lists when one of them changes
+SPECIALTY_DOCTOR_IDS = Query("specialty_doctor_ids", """
+    SELECT doctor_id FROM doctor_specialties WHERE specialty_id = $1
+""")
+
+# "Peu importe" search: each hour of $2 where at least one active doctor of
+# specialty $1 is free, with the number of free doctors. One mask row per
+# doctor is read; the hours are counted bit by bit.
+FREE_HOURS_BY_SPECIALTY = Query("free_hours_by_specialty", """
+    SELECT h.hour, COUNT(*)
+    FROM doctor_specialties ds
+    JOIN users u ON u.id = ds.doctor_id
+    CROSS JOIN LATERAL healthtime_day_mask(u.id, $2) m
+    JOIN generate_series(0, 23) AS h(hour) ON m.open_mask & (1 << h.hour) <> 0
+    WHERE ds.specialty_id = $1
+    AND u.status = 'active'
+    AND m.open_mask <> 0
+    GROUP BY h.hour
+    ORDER BY h.hour
+""")
+
+# The first $4 bookable hours of doctor $1 after the time $2 (never in the
+# past), up to the day $3: one mask row per day, read in day order
+NEXT_FREE_SLOTS_FOR_DOCTOR = Query("next_free_slots_for_doctor", """
+    SELECT g.day::date, h.hour
+    FROM generate_series($2::timestamp::date, $3::date, interval '1 day') AS g(day)
+    CROSS JOIN LATERAL healthtime_day_mask($1, g.day::date) m
+    JOIN generate_series(0, 23) AS h(hour) ON m.open_mask & (1 << h.hour) <> 0
+    WHERE g.day + make_interval(hours => h.hour) > $2::timestamp
+    ORDER BY 1, 2
+    LIMIT $4
+""")
+
+# Same for specialty $1: the first $4 hours where at least one active doctor
+# of the specialty is free, with the number of free doctors. Days are read
+# one at a time until enough hours are found (migration 011).
+NEXT_FREE_HOURS_BY_SPECIALTY = Query("next_free_hours_by_specialty", """
+    SELECT day, slot_hour, doctor_count
+    FROM healthtime_next_free_hours($1, $2, $3, $4)
+    ORDER BY day, slot_hour
+""")
+
+# Month heatmap of doctor $1: the number of bookable hours of each day from
+# $2 to $3 that start after the time $4. Days without any are left out.
+MONTH_FREE_SLOTS_FOR_DOCTOR = Query("month_free_slots_for_doctor", """
+    SELECT g.day::date, COUNT(*)
+    FROM generate_series($2::date, $3::date, interval '1 day') AS g(day)
+    CROSS JOIN LATERAL healthtime_day_mask($1, g.day::date) m
+    JOIN generate_series(0, 23) AS h(hour) ON m.open_mask & (1 << h.hour) <> 0
+    WHERE g.day + make_interval(hours => h.hour) > $4::timestamp
+    GROUP BY 1
+    ORDER BY 1
+""")
+
+# Same for specialty $1: free (doctor, hour) pairs of its active doctors per
+# day, in one pass over their day masks
+MONTH_FREE_SLOTS_BY_SPECIALTY = Query("month_free_slots_by_specialty", """
+    SELECT g.day::date, COUNT(*)
+    FROM doctor_specialties ds
+    JOIN users u ON u.id = ds.doctor_id
+    CROSS JOIN generate_series($2::date, $3::date, interval '1 day') AS g(day)
+    CROSS JOIN LATERAL healthtime_day_mask(u.id, g.day::date) m
+    JOIN generate_series(0, 23) AS h(hour) ON m.open_mask & (1 << h.hour) <> 0
+    WHERE ds.specialty_id = $1
+    AND u.status = 'active'
+    AND m.open_mask <> 0
+    AND g.day + make_interval(hours => h.hour) > $4::timestamp
+    GROUP BY 1
+    ORDER BY 1
+""")
+
+# Starts of a $3-minute appointment with doctor $1 on $2 (migration 013):
+# free and partly booked hours minus the periods already scheduled, as a
+# tsmultirange difference; starts are aligned on the duration in each hour
+FREE_PERIODS_FOR_DOCTOR = Query("free_periods_for_doctor", """
+    SELECT start_at
+    FROM healthtime_free_periods($1, $2, $3)
+    ORDER BY start_at
+""")
+
+# Masks of doctor $1 for each day from $2 to $3: bookable hours and booked
+# hours (bit h = hour h)
+DAY_MASKS = Query("day_masks", """
+    SELECT g.day::date, m.open_mask, m.booked_mask
+    FROM generate_series($2::date, $3::date, interval '1 day') AS g(day)
+    CROSS JOIN LATERAL healthtime_day_mask($1, g.day::date) m
+    ORDER BY g.day
+""")
+
+# Opens the hours of mask $3 of doctor $1 on $2: an hour of a weekly rule is
+# reopened by deleting its 'unavailable' row, any other hour gets an
+# 'available' row. Booked hours are left alone. Returns how many changed.
+OPEN_HOURS = Query("open_hours", """
+    WITH wanted AS (
+        SELECT h.hour, h.hour IN (SELECT slot_hour FROM healthtime_rule_hours($1, $2)) AS ruled
+        FROM generate_series(0, 23) AS h(hour)
+        WHERE $3 & (1 << h.hour) <> 0
+    ), reopened AS (
+        DELETE FROM time_slots ts
+        USING wanted w
+        WHERE ts.doctor_id = $1 AND ts.slot_date = $2 AND ts.slot_hour = w.hour
+        AND w.ruled AND ts.status = 'unavailable'
+        RETURNING ts.slot_hour
+    ), opened AS (
+        INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status)
+        SELECT $1, $2, hour, 'available' FROM wanted WHERE NOT ruled
+        ON CONFLICT (doctor_id, slot_date, slot_hour) DO UPDATE SET status = 'available'
+        WHERE time_slots.status = 'unavailable'
+        RETURNING slot_hour
+    )
+    SELECT (SELECT COUNT(*) FROM reopened) + (SELECT COUNT(*) FROM opened)
+""")
+
+# Closes the hours of mask $3 of doctor $1 on $2, the other way round: an
+# hour of a weekly rule gets an 'unavailable' row, any other hour loses its
+# 'available' row. Booked hours are left alone. Returns how many changed.
+CLOSE_HOURS = Query("close_hours", """
+    WITH wanted AS (
+        SELECT h.hour, h.hour IN (SELECT slot_hour FROM healthtime_rule_hours($1, $2)) AS ruled
+        FROM generate_series(0, 23) AS h(hour)
+        WHERE $3 & (1 << h.hour) <> 0
+    ), removed AS (
+        DELETE FROM time_slots ts
+        USING wanted w
+        WHERE ts.doctor_id = $1 AND ts.slot_date = $2 AND ts.slot_hour = w.hour
+        AND NOT w.ruled AND ts.status = 'available'
+        RETURNING ts.slot_hour
+    ), closed AS (
+        INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status)
+        SELECT $1, $2, hour, 'unavailable' FROM wanted WHERE ruled
+        ON CONFLICT (doctor_id, slot_date, slot_hour) DO UPDATE SET status = 'unavailable'
+        WHERE time_slots.status = 'available'
+        RETURNING slot_hour
+    )
+    SELECT (SELECT COUNT(*) FROM removed) + (SELECT COUNT(*) FROM closed)
+""")
+
+# Opens the slots of doctor $1 at the dates $2 and hours $3 (same length
+# arrays, one slot per position) in one statement; existing slots are left
+# as they are. The row count is the number of slots created.
+CREATE_TIME_SLOTS = Query("create_time_slots", """
+    INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status)
+    SELECT $1, s.slot_date, s.slot_hour, 'available'
+    FROM unnest($2::date[], $3::int[]) AS s(slot_date, slot_hour)
+    ON CONFLICT (doctor_id, slot_date, slot_hour) DO NOTHING
+""")
+
+# =========================================================================
+# Booking / cancellation
+# =========================================================================
+
+# Books the slot of doctor $2 at $3 for patient $1 in one statement: the
+# appointment is inserted only if the hour is open, and the unique indexes
+# of migration 006 turn a concurrent booking of the same doctor (or patient)
+# hour into a no-op instead of a second appointment. The slot row is then
+# upserted as 'booked' (created for an hour opened by a rule), which also
+# wins over a doctor closing the hour at the same moment. Returns the new
+# id, or NULL with patient_busy telling why nothing was booked.
+BOOK_APPOINTMENT = Query("book_appointment", """
+    WITH booked AS (
+        INSERT INTO appointments (patient_id, doctor_id, appointment_date, status, urgent)
+        SELECT $1, $2, $3::timestamp, 'scheduled', $4
+        WHERE EXTRACT(HOUR FROM $3::timestamp)::int IN (
+            SELECT slot_hour FROM healthtime_open_hours($2, $3::timestamp::date)
+        )
+        ON CONFLICT DO NOTHING
+        RETURNING id, doctor_id, slot_date, slot_hour
+    ), claimed AS (
+        INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status)
+        SELECT doctor_id, slot_date, slot_hour, 'booked' FROM booked
+        ON CONFLICT (doctor_id, slot_date, slot_hour) DO UPDATE SET status = 'booked'
+        RETURNING id
+    )
+    SELECT (SELECT id FROM booked),
+           EXISTS (
+               SELECT 1 FROM appointments
+               WHERE patient_id = $1
+               AND period && tsrange($3::timestamp, $3::timestamp + INTERVAL '1 hour')
+               AND appointment_date >= $3::timestamp::date AND appointment_date < $3::timestamp::date + 1
+               AND status = 'scheduled'
+           ) AS patient_busy
+""")
+
+# Books $4 minutes (less than an hour) with doctor $2 at $3 for patient $1:
+# the period must be one of healthtime_free_periods(), and the exclusion
+# constraints of migration 013 turn a concurrent overlapping booking of the
+# doctor (or patient) into a no-op. The hour's slot row is upserted as
+# 'booked', which keeps it out of the hour-long bookings. Returns the new
+# id, or NULL with patient_busy telling why nothing was booked.
+BOOK_APPOINTMENT_PERIOD = Query("book_appointment_period", """
+    WITH booked AS (
+        INSERT INTO appointments (patient_id, doctor_id, appointment_date, duration_minutes, status, urgent)
+        SELECT $1, $2, $3::timestamp, $4::int, 'scheduled', $5
+        WHERE $3::timestamp IN (
+            SELECT start_at FROM healthtime_free_periods($2, $3::timestamp::date, $4::int)
+        )
+        ON CONFLICT DO NOTHING
+        RETURNING id, doctor_id, slot_date, slot_hour
+    ), claimed AS (
+        INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status)
+        SELECT doctor_id, slot_date, slot_hour, 'booked' FROM booked
+        ON CONFLICT (doctor_id, slot_date, slot_hour) DO UPDATE SET status = 'booked'
+        RETURNING id
+    )
+    SELECT (SELECT id FROM booked),
+           EXISTS (
+               SELECT 1 FROM appointments
+               WHERE patient_id = $1
+               AND period && tsrange($3::timestamp, $3::timestamp + make_interval(mins => $4::int))
+               AND appointment_date >= $3::timestamp::date AND appointment_date < $3::timestamp::date + 1
+               AND status = 'scheduled'
+           ) AS patient_busy
+""")
+
+# "Peu importe" booking: patient $1 takes the slot at $3 of any active
+# doctor of specialty $2. Candidates are tried in random order and each one
+# is claimed with a transaction-level advisory lock on (doctor, hour): like
+# SKIP LOCKED, but it also covers hours opened by a rule, which have no row
+# to lock. Concurrent bookers of the same hour thus each get a different
+# doctor instead of queueing on (and then losing) the same one. Returns the
+# new id and the doctor, or NULLs with patient_busy and contended: a doctor
+# was picked but booked by a transaction that committed after this
+# statement started, so running it again may still find another one.
+BOOK_FIRST_AVAILABLE = Query("book_first_available", """
+    WITH shuffled AS MATERIALIZED (
+        SELECT u.id AS doctor_id
+        FROM doctor_specialties ds
+        JOIN users u ON u.id = ds.doctor_id
+        CROSS JOIN LATERAL healthtime_open_hours(u.id, $3::timestamp::date) o
+        WHERE ds.specialty_id = $2
+        AND u.status = 'active'
+        AND o.slot_hour = EXTRACT(HOUR FROM $3::timestamp)::int
+        ORDER BY random()
+    ), candidate AS (
+        -- MATERIALIZED keeps the lock out of the scans above: it is only
+        -- tried on the shuffled doctors, one at a time, until one is taken
+        SELECT doctor_id
+        FROM shuffled
+        WHERE pg_try_advisory_xact_lock(doctor_id, (EXTRACT(EPOCH FROM $3::timestamp) / 3600)::int)
+        LIMIT 1
+    ), booked AS (
+        INSERT INTO appointments (patient_id, doctor_id, appointment_date, status, urgent)
+        SELECT $1, candidate.doctor_id, $3::timestamp, 'scheduled', $4
+        FROM candidate
+        ON CONFLICT DO NOTHING
+        RETURNING id, doctor_id, slot_date, slot_hour
+    ), claimed AS (
+        INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status)
+        SELECT doctor_id, slot_date, slot_hour, 'booked' FROM booked
+        ON CONFLICT (doctor_id, slot_date, slot_hour) DO UPDATE SET status = 'booked'
+        RETURNING id
+    )
+    SELECT booked.id, booked.doctor_id, u.name,
+           EXISTS (
+               SELECT 1 FROM appointments
+               WHERE patient_id = $1
+               AND period && tsrange($3::timestamp, $3::timestamp + INTERVAL '1 hour')
+               AND appointment_date >= $3::timestamp::date AND appointment_date < $3::timestamp::date + 1
+               AND status = 'scheduled'
+           ) AS patient_busy,
+           EXISTS (SELECT 1 FROM candidate) AS contended
+    FROM (SELECT 1) one
+    LEFT JOIN booked ON TRUE
+    LEFT JOIN users u ON u.id = booked.doctor_id
+""")
+
+# Locks scheduled appointment $1 before a reschedule; a concurrent cancel or
+# reschedule of it waits for this transaction, then finds it moved or gone
+APPOINTMENT_FOR_RESCHEDULE = Query("appointment_for_reschedule", """
+    SELECT doctor_id, appointment_date, patient_id
+    FROM appointments
+    WHERE id = $1
+    AND status = 'scheduled'
+    FOR UPDATE
+""")
+
+# Moves appointment $1 (at $2, locked by APPOINTMENT_FOR_RESCHEDULE) to
+# doctor $3 at $4, with urgent set to $5 unless NULL. Like BOOK_APPOINTMENT,
+# the hour must be open and its slot row is upserted as 'booked'; the
+# patient must not have another appointment overlapping the moved period. A
+# booking of that hour committed while this statement waits still makes it
+# fail, with a unique violation of migration 006 (or an exclusion violation
+# of migration 013). Returns the id, or NULL with patient_busy.
+RESCHEDULE_APPOINTMENT = Query("reschedule_appointment", """
+    WITH busy AS (
+        SELECT 1 FROM appointments a
+        JOIN appointments moving ON moving.id = $1 AND moving.appointment_date = $2::timestamp
+        WHERE a.patient_id = moving.patient_id
+        AND a.period && tsrange($4::timestamp, $4::timestamp + moving.duration_minutes * INTERVAL '1 minute')
+        AND a.appointment_date >= $4::timestamp::date AND a.appointment_date < $4::timestamp::date + 1
+        AND a.status = 'scheduled'
+        AND a.id <> $1
+    ), moved AS (
+        UPDATE appointments
+        SET doctor_id = $3, appointment_date = $4::timestamp, urgent = COALESCE($5, urgent)
+        WHERE id = $1
+        AND appointment_date = $2::timestamp
+        AND status = 'scheduled'
+        AND NOT EXISTS (SELECT 1 FROM busy)
+        AND EXTRACT(HOUR FROM $4::timestamp)::int IN (
+            SELECT slot_hour FROM healthtime_open_hours($3, $4::timestamp::date)
+        )
+        RETURNING id, doctor_id, slot_date, slot_hour
+    ), claimed AS (
+        INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status)
+        SELECT doctor_id, slot_date, slot_hour, 'booked' FROM moved
+        ON CONFLICT (doctor_id, slot_date, slot_hour) DO UPDATE SET status = 'booked'
+        RETURNING id
+    )
+    SELECT (SELECT id FROM moved), EXISTS (SELECT 1 FROM busy) AS patient_busy
+""")
+
+# Cancels the scheduled appointment $1 of patient $2 and returns the hour to
+# release. The UPDATE locks the row: racing a reschedule, it waits for it and
+# then cancels the appointment at its new hour, which is the one returned. An
+# appointment already canceled returns no row.
+CANCEL_PATIENT_APPOINTMENT = Query("cancel_patient_appointment", """
+    UPDATE appointments
+    SET status='canceled'
+    WHERE id=$1 AND patient_id=$2 AND status='scheduled'
+    RETURNING doctor_id, appointment_date
+""")
+
+# Same for a doctor canceling the appointment $1
+CANCEL_APPOINTMENT_BY_DOCTOR = Query("cancel_appointment_by_doctor", """
+    UPDATE appointments
+    SET status='canceled_by_doctor'
+    WHERE id=$1 AND status='scheduled'
+    RETURNING doctor_id, appointment_date, patient_id
+""")
+
+# Frees the slot of doctor $1 on $2 at hour $3 once its appointment is
+# canceled: the row is deleted when a weekly rule opens that hour anyway,
+# set back to available otherwise. Left alone while another appointment is
+# scheduled in that hour (shorter appointments of migration 013, or an
+# older appointment canceled twice).
+RELEASE_SLOT = Query("release_slot", """
+    WITH scheduled AS (
+        SELECT 1 FROM appointments
+        WHERE doctor_id = $1
+        AND appointment_date >= $2::date + make_interval(hours => $3)
+        AND appointment_date < $2::date + make_interval(hours => $3 + 1)
+        AND status = 'scheduled'
+    ), ruled AS (
+        DELETE FROM time_slots
+        WHERE doctor_id = $1
+        AND slot_date = $2
+        AND slot_hour = $3
+        AND $3 IN (SELECT slot_hour FROM healthtime_rule_hours($1, $2))
+        AND NOT EXISTS (SELECT 1 FROM scheduled)
+        RETURNING id
+    )
+    UPDATE time_slots
+    SET status = 'available'
+    WHERE doctor_id = $1
+    AND slot_date = $2
+    AND slot_hour = $3
+    AND NOT EXISTS (SELECT 1 FROM scheduled)
+    AND NOT EXISTS (SELECT 1 FROM ruled)
+""")
+
+# Cancels every appointment of doctor $1 scheduled from $2 (never in the
+# past) to before $3 (NULL: no end) in one statement, for an absence or a
+# deactivation: their slot rows are closed rather than reopened, since the
+# doctor will not be there, and one notification of kind $4 is queued per
+# patient appointment. Returns the number canceled and the days touched.
+CANCEL_DOCTOR_APPOINTMENTS = Query("cancel_doctor_appointments", """
+    WITH canceled AS (
+        UPDATE appointments
+        SET status = 'canceled_by_doctor'
+        WHERE doctor_id = $1
+        AND status = 'scheduled'
+        AND appointment_date >= GREATEST($2::timestamp, LOCALTIMESTAMP)
+        AND ($3::timestamp IS NULL OR appointment_date < $3::timestamp)
+        RETURNING id, patient_id, appointment_date, slot_date, slot_hour
+    ), closed AS (
+        UPDATE time_slots t
+        SET status = 'unavailable'
+        FROM canceled c
+        WHERE t.doctor_id = $1
+        AND t.slot_date = c.slot_date
+        AND t.slot_hour = c.slot_hour
+        RETURNING t.id
+    ), notified AS (
+        INSERT INTO notifications (user_id, kind, appointment_id, doctor_id, appointment_date)
+        SELECT patient_id, $4, id, $1, appointment_date FROM canceled
+        RETURNING id
+    )
+    SELECT (SELECT COUNT(*) FROM canceled),
+           ARRAY(SELECT DISTINCT slot_date FROM canceled ORDER BY 1)
+""")
+
+# =========================================================================
+# Waitlist (dao/waitlist_dao.py)
+# =========================================================================
+
+# Waitlist entries of patient $1 still waiting or assigned, whose period is
+# not over, with the doctor or specialty and the assigned appointment
+PATIENT_WAITLIST = Query("patient_waitlist", """
+    SELECT w.id, w.date_from, w.date_to, w.urgent, w.status,
+           d.name, s.name, a.appointment_date
+    FROM waitlist w
+    LEFT JOIN users d ON d.id = w.doctor_id
+    LEFT JOIN specialties s ON s.id = w.specialty_id
+    LEFT JOIN appointments a ON a.id = w.appointment_id
+    WHERE w.patient_id = $1
+    AND w.status <> 'canceled'
+    AND w.date_to >= CURRENT_DATE
+    ORDER BY w.date_from, w.id
+""")
+
+# Gives the hour $2 of doctor $1, just freed by a cancellation of patient
+# $3's appointment, to the first other waiter whose doctor (or one of whose
+# specialties) and dates match: urgent entries first, then the oldest.
+# Booked like BOOK_APPOINTMENT; a waiter who already has an appointment in
+# that hour is skipped, and an entry locked by a concurrent cancellation is
+# left to it. Returns the new appointment id and the patient, or no row.
+REALLOCATE_SLOT = Query("reallocate_slot", """
+    WITH waiter AS (
+        SELECT w.id, w.patient_id, w.urgent
+        FROM waitlist w
+        WHERE w.status = 'waiting'
+        AND w.patient_id <> $3
+        AND (w.doctor_id = $1
+             OR w.specialty_id IN (SELECT specialty_id FROM doctor_specialties WHERE doctor_id = $1))
+        AND $2::timestamp::date BETWEEN w.date_from AND w.date_to
+        AND $2::timestamp > NOW()
+        AND NOT EXISTS (
+            SELECT 1 FROM appointments a
+            WHERE a.patient_id = w.patient_id
+            AND a.period && tsrange($2::timestamp, $2::timestamp + INTERVAL '1 hour')
+            AND a.appointment_date >= $2::timestamp::date AND a.appointment_date < $2::timestamp::date + 1
+            AND a.status = 'scheduled'
+        )
+        ORDER BY w.urgent DESC, w.created_at, w.id
+        LIMIT 1
+        FOR UPDATE OF w SKIP LOCKED
+    ), booked AS (
+        INSERT INTO appointments (patient_id, doctor_id, appointment_date, status, urgent)
+        SELECT patient_id, $1, $2::timestamp, 'scheduled', urgent FROM waiter
+        WHERE EXTRACT(HOUR FROM $2::timestamp)::int IN (
+            SELECT slot_hour FROM healthtime_open_hours($1, $2::timestamp::date)
+        )
+        ON CONFLICT DO NOTHING
+        RETURNING id, patient_id, doctor_id, slot_date, slot_hour
+    ), claimed AS (
+        INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status)
+        SELECT doctor_id, slot_date, slot_hour, 'booked' FROM booked
+        ON CONFLICT (doctor_id, slot_date, slot_hour) DO UPDATE SET status = 'booked'
+        RETURNING id
+    ), assigned AS (
+        UPDATE waitlist w
+        SET status = 'assigned', appointment_id = b.id, assigned_at = NOW()
+        FROM waiter, booked b
+        WHERE w.id = waiter.id
+        RETURNING w.id
+    )
+    SELECT id, patient_id FROM booked
+""")
+
+# =========================================================================
+# Idempotency keys (database/idempotency.py)
+# =========================================================================
+
+# Claims key $2 of user $1 for action $3 for $4 seconds, taking over an
+# expired key. Returns (TRUE, action, NULL, NULL) when claimed, or
+# (FALSE, action, success, message) of the request that already used it.
+CLAIM_IDEMPOTENCY_KEY = Query("claim_idempotency_key", """
+    WITH claimed AS (
+        INSERT INTO idempotency_keys (user_id, key, action, expires_at)
+        VALUES ($1, $2, $3, NOW() + make_interval(secs => $4))
+        ON CONFLICT (user_id, key) DO UPDATE
+        SET action = EXCLUDED.action, success = NULL, message = NULL,
+            created_at = NOW(), expires_at = EXCLUDED.expires_at
+        WHERE idempotency_keys.expires_at < NOW()
+        RETURNING action
+    )
+    SELECT TRUE, action, NULL::boolean, NULL::text FROM claimed
+    UNION ALL
+    SELECT FALSE, action, success, message
+    FROM idempotency_keys
+    WHERE user_id = $1 AND key = $2
+    AND NOT EXISTS (SELECT 1 FROM claimed)
+""")
+
+IDEMPOTENT_RESULT = Query("idempotent_result", """
+    SELECT FALSE, action, success, message
+    FROM idempotency_keys
+    WHERE user_id = $1 AND key = $2
+""")
+
+SAVE_IDEMPOTENT_RESULT = Query("save_idempotent_result", """
+    UPDATE idempotency_keys
+    SET success = $3, message = $4
+    WHERE user_id = $1 AND key = $2
+""")
+
+# =========================================================================
+# Notifications (dao/notification_dao.py)
+# =========================================================================
+
+# Unread notifications of user $1, newest first, with the doctor's name
+UNREAD_NOTIFICATIONS = Query("unread_notifications", """
+    SELECT n.id, n.kind, n.appointment_date, d.name, n.created_at
+    FROM notifications n
+    LEFT JOIN users d ON d.id = n.doctor_id
+    WHERE n.user_id = $1
+    AND n.read_at IS NULL
+    ORDER BY n.created_at DESC, n.id DESC
+""")
+
+# =========================================================================
+# Appointment listings
+# =========================================================================
+
+APPOINTMENT_BY_DOCTOR_DATE_HOUR = Query("appointment_by_doctor_date_hour", """
+    SELECT a.id, u.name, a.appointment_date, a.status
+    FROM appointments a
+    JOIN users u ON a.patient_id = u.id
+    WHERE a.doctor_id = $1
+    AND a.slot_date = $2
+    AND a.slot_hour = $3
+    AND a.status = 'scheduled'
+    AND a.appointment_date >= $2 AND a.appointment_date < $2 + 1
+""")
+
+PATIENT_APPOINTMENTS = Query("patient_appointments", """
+    SELECT a.id, u.name, a.appointment_date, a.status, a.urgent
+    FROM appointments a
+    JOIN users u ON a.doctor_id = u.id
+    WHERE a.patient_id=$1
+    ORDER BY a.appointment_date ASC
+""")
+
+DOCTOR_APPOINTMENTS = Query("doctor_appointments", """
+    SELECT a.id,
+           a.appointment_date,
+           a.status,
+           a.urgent,
+           u.name,
+           u.username
+    FROM appointments a
+    JOIN users u ON a.patient_id = u.id
+    WHERE a.doctor_id = $1
+    ORDER BY a.appointment_date ASC
+""")
+
+UPCOMING_DOCTOR_APPOINTMENTS = Query("upcoming_doctor_appointments", """
+    SELECT a.appointment_date, u.name
+    FROM appointments a
+    JOIN users u ON a.patient_id = u.id
+    WHERE a.doctor_id = $1
+    AND a.status = 'scheduled'
+    AND a.appointment_date BETWEEN $2 AND $3
+    ORDER BY a.appointment_date
+""")
+
+UPCOMING_PATIENT_APPOINTMENTS = Query("upcoming_patient_appointments", """
+    SELECT a.appointment_date, u.name
+    FROM appointments a
+    JOIN users u ON a.doctor_id = u.id
+    WHERE a.patient_id = $1
+    AND a.status = 'scheduled'
+    AND a.appointment_date BETWEEN $2 AND $3
+    ORDER BY a.appointment_date
+""")
+
+# =========================================================================
+# Administration
+# =========================================================================
+
+# Counters maintained by the triggers of migration 005, summed over shards
+ADMIN_STATS = Query("admin_stats", """
+    SELECT st.metric, st.key, s.name, SUM(st.count)
+    FROM admin_stats st
+    LEFT JOIN specialties s ON st.metric = 'specialty_doctors' AND s.id::text = st.key
+    GROUP BY st.metric, st.key, s.name
+""")
+
+ALL_QUERIES = [value for value in list(globals().values()) if isinstance(value, Query)]
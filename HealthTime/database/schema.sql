@@ -2,6 +2,15 @@
 -- DATABASE SCHEMA : HealthTime (PostgreSQL)
 -- =========================================================================
 
+-- Extensions de la recherche de praticiens
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- Clé de recherche sans accents ni majuscules (IMMUTABLE, donc indexable)
+CREATE OR REPLACE FUNCTION healthtime_search_key(value TEXT) RETURNS TEXT
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT lower(public.unaccent('public.unaccent'::regdictionary, value)) $$;
+
 -- Création de la table des utilisateurs (Patients, Docteurs, Admins)
 CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
@@ -40,18 +49,469 @@ CREATE TABLE IF NOT EXISTS time_slots (
     CONSTRAINT unique_doctor_slot UNIQUE (doctor_id, slot_date, slot_hour)
 );
 
--- Création de la table des rendez-vous (Appointments)
-CREATE TABLE IF NOT EXISTS appointments (
+-- Disponibilités récurrentes : règles hebdomadaires et exceptions (congés),
+-- développées à la demande ; time_slots ne garde que les réservations et
+-- les dérogations
+CREATE TABLE IF NOT EXISTS availability_rules (
     id SERIAL PRIMARY KEY,
+    doctor_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    weekday SMALLINT NOT NULL CHECK (weekday BETWEEN 1 AND 7),
+    start_hour SMALLINT NOT NULL CHECK (start_hour BETWEEN 0 AND 23),
+    end_hour SMALLINT NOT NULL CHECK (end_hour BETWEEN 1 AND 24),
+    valid_from DATE NOT NULL DEFAULT CURRENT_DATE,
+    valid_until DATE,
+    CHECK (start_hour < end_hour),
+    CHECK (valid_until IS NULL OR valid_until >= valid_from)
+);
+
+CREATE TABLE IF NOT EXISTS availability_exceptions (
+    id SERIAL PRIMARY KEY,
+    doctor_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    reason VARCHAR(100),
+    CHECK (end_date >= start_date)
+);
+
+-- Masques de 24 bits par docteur et par jour (bit h = heure h), tenus à jour
+-- par les triggers de la section DISPONIBILITÉS
+CREATE TABLE IF NOT EXISTS doctor_day_masks (
+    doctor_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    available_mask INT NOT NULL DEFAULT 0,
+    closed_mask INT NOT NULL DEFAULT 0,
+    booked_mask INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (doctor_id, day)
+);
+
+-- Création de la table des rendez-vous (Appointments), partitionnée par mois
+-- sur appointment_date (voir database/partitions.py)
+CREATE TABLE IF NOT EXISTS appointments (
+    id SERIAL,
     patient_id INT NOT NULL,
     doctor_id INT NOT NULL,
     appointment_date TIMESTAMP NOT NULL,
     status VARCHAR(30) DEFAULT 'scheduled' CHECK (status IN ('scheduled', 'confirmé', 'completed', 'canceled', 'canceled_by_doctor', 'annulé')),
     urgent BOOLEAN DEFAULT FALSE,
+    -- Clé de créneau, alignée sur time_slots (slot_date, slot_hour)
+    slot_date DATE GENERATED ALWAYS AS (CAST(appointment_date AS DATE)) STORED,
+    slot_hour INT GENERATED ALWAYS AS (CAST(EXTRACT(HOUR FROM appointment_date) AS INT)) STORED,
+    -- Durée et période [début, fin) du rendez-vous (migration 013)
+    duration_minutes SMALLINT NOT NULL DEFAULT 60,
+    period TSRANGE GENERATED ALWAYS AS (
+        tsrange(appointment_date, appointment_date + duration_minutes * INTERVAL '1 minute')
+    ) STORED,
+    PRIMARY KEY (id, appointment_date),
+    -- Un rendez-vous reste dans son heure : début sur un multiple de 5
+    -- minutes, fin au plus tard à l'heure suivante
+    CONSTRAINT appointments_within_the_hour CHECK (
+        duration_minutes BETWEEN 5 AND 60
+        AND duration_minutes % 5 = 0
+        AND appointment_date = date_trunc('minute', appointment_date)
+        AND EXTRACT(MINUTE FROM appointment_date)::int % 5 = 0
+        AND EXTRACT(MINUTE FROM appointment_date)::int + duration_minutes <= 60
+    ),
     FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (doctor_id) REFERENCES users(id) ON DELETE CASCADE
+) PARTITION BY RANGE (appointment_date);
+
+-- Pas de chevauchement de deux rendez-vous planifiés d'un même docteur ou
+-- patient. PostgreSQL 16 n'accepte pas de contrainte d'exclusion sur une
+-- table partitionnée : elles sont posées sur chaque partition (une période
+-- ne sort jamais de son heure, donc de son mois). Sans btree_gist,
+-- l'égalité passe par int4range(id, id, '[]').
+CREATE OR REPLACE FUNCTION healthtime_add_appointment_exclusions(partition_name TEXT) RETURNS VOID
+LANGUAGE plpgsql AS $$
+BEGIN
+    EXECUTE format(
+        'ALTER TABLE %I ADD CONSTRAINT %I EXCLUDE USING gist '
+        '(int4range(doctor_id, doctor_id, ''[]'') WITH =, period WITH &&) WHERE (status = ''scheduled'')',
+        partition_name, partition_name || '_doctor_overlap'
+    );
+    EXECUTE format(
+        'ALTER TABLE %I ADD CONSTRAINT %I EXCLUDE USING gist '
+        '(int4range(patient_id, patient_id, ''[]'') WITH =, period WITH &&) WHERE (status = ''scheduled'')',
+        partition_name, partition_name || '_patient_overlap'
+    );
+END $$;
+
+-- Crée les partitions mensuelles manquantes entre deux mois (inclus)
+CREATE OR REPLACE FUNCTION healthtime_create_appointment_partitions(from_month DATE, to_month DATE)
+RETURNS INT LANGUAGE plpgsql AS $$
+DECLARE
+    month DATE := date_trunc('month', from_month)::DATE;
+    partition_name TEXT;
+    created INT := 0;
+BEGIN
+    WHILE month <= to_month LOOP
+        partition_name := 'appointments_' || to_char(month, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF appointments FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month, (month + INTERVAL '1 month')::DATE
+            );
+            PERFORM healthtime_add_appointment_exclusions(partition_name);
+            created := created + 1;
+        END IF;
+        month := (month + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN created;
+END $$;
+
+SELECT healthtime_create_appointment_partitions(CURRENT_DATE, (CURRENT_DATE + INTERVAL '12 months')::DATE);
+
+-- Clés d'idempotence des réservations et annulations (voir database/idempotency.py)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    key VARCHAR(64) NOT NULL,
+    action VARCHAR(20) NOT NULL,
+    success BOOLEAN,
+    message TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, key)
+);
+
+-- Liste d'attente : une heure libérée par une annulation est attribuée au
+-- premier inscrit compatible (voir dao/waitlist_dao.py)
+CREATE TABLE IF NOT EXISTS waitlist (
+    id SERIAL PRIMARY KEY,
+    patient_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    doctor_id INT REFERENCES users(id) ON DELETE CASCADE,
+    specialty_id INT REFERENCES specialties(id) ON DELETE CASCADE,
+    date_from DATE NOT NULL,
+    date_to DATE NOT NULL,
+    urgent BOOLEAN NOT NULL DEFAULT FALSE,
+    status VARCHAR(20) NOT NULL DEFAULT 'waiting'
+        CHECK (status IN ('waiting', 'assigned', 'canceled')),
+    appointment_id INT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    assigned_at TIMESTAMP,
+    CHECK ((doctor_id IS NULL) <> (specialty_id IS NULL)),
+    CHECK (date_from <= date_to)
+);
+
+-- Notifications des patients : rendez-vous annulés en masse par une absence
+-- ou une désactivation du docteur (voir database/migrations/012_notifications.sql)
+CREATE TABLE IF NOT EXISTS notifications (
+    id SERIAL PRIMARY KEY,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    kind VARCHAR(30) NOT NULL
+        CHECK (kind IN ('doctor_absence', 'doctor_deactivated')),
+    appointment_id INT,
+    doctor_id INT REFERENCES users(id) ON DELETE CASCADE,
+    appointment_date TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    read_at TIMESTAMP
 );
 
+-- =========================================================================
+-- INDEX (voir database/migrations/)
+-- =========================================================================
+
+CREATE INDEX IF NOT EXISTS idx_appointments_patient_date
+    ON appointments (patient_id, appointment_date);
+CREATE INDEX IF NOT EXISTS idx_appointments_doctor_date
+    ON appointments (doctor_id, appointment_date);
+-- Un seul rendez-vous planifié par docteur et par heure, et par patient et par heure
+CREATE UNIQUE INDEX IF NOT EXISTS uq_appointments_doctor_hour_scheduled
+    ON appointments (doctor_id, appointment_date) WHERE status = 'scheduled';
+CREATE UNIQUE INDEX IF NOT EXISTS uq_appointments_patient_hour_scheduled
+    ON appointments (patient_id, appointment_date) WHERE status = 'scheduled';
+CREATE INDEX IF NOT EXISTS idx_appointments_doctor_slot_scheduled
+    ON appointments (doctor_id, slot_date, slot_hour) WHERE status = 'scheduled';
+CREATE INDEX IF NOT EXISTS idx_time_slots_date_doctor_available
+    ON time_slots (slot_date, doctor_id, slot_hour) WHERE status = 'available';
+CREATE INDEX IF NOT EXISTS idx_doctor_specialties_specialty
+    ON doctor_specialties (specialty_id, doctor_id);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at
+    ON idempotency_keys (expires_at);
+CREATE INDEX IF NOT EXISTS idx_availability_rules_doctor_weekday
+    ON availability_rules (doctor_id, weekday);
+CREATE INDEX IF NOT EXISTS idx_availability_exceptions_doctor_dates
+    ON availability_exceptions (doctor_id, start_date, end_date);
+CREATE INDEX IF NOT EXISTS idx_waitlist_doctor_waiting
+    ON waitlist (doctor_id, date_from) WHERE status = 'waiting';
+CREATE INDEX IF NOT EXISTS idx_waitlist_specialty_waiting
+    ON waitlist (specialty_id, date_from) WHERE status = 'waiting';
+CREATE INDEX IF NOT EXISTS idx_waitlist_patient
+    ON waitlist (patient_id);
+CREATE INDEX IF NOT EXISTS idx_notifications_user_unread
+    ON notifications (user_id, created_at) WHERE read_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_users_doctor_name_trgm
+    ON users USING gin (healthtime_search_key(name) gin_trgm_ops) WHERE role = 'doctor';
+CREATE INDEX IF NOT EXISTS idx_specialties_name_trgm
+    ON specialties USING gin (healthtime_search_key(name) gin_trgm_ops);
+
+-- =========================================================================
+-- DISPONIBILITÉS (voir database/migrations/008_availability_rules.sql, 009_day_masks.sql et 011_next_free_slots.sql)
+-- =========================================================================
+
+-- Heures ouvertes par les règles d'un docteur un jour donné, hors exceptions.
+-- Fonctions SQL STABLE non STRICT : PostgreSQL les développe dans la requête
+-- appelante, qui garde ainsi l'usage des index.
+CREATE OR REPLACE FUNCTION healthtime_rule_hours(p_doctor_id INT, p_day DATE)
+RETURNS TABLE (slot_hour INT)
+LANGUAGE sql STABLE AS $$
+    SELECT DISTINCT h.hour
+    FROM availability_rules r
+    CROSS JOIN LATERAL generate_series(r.start_hour::int, r.end_hour::int - 1) AS h(hour)
+    WHERE r.doctor_id = p_doctor_id
+    AND r.weekday = EXTRACT(ISODOW FROM p_day)::int
+    AND r.valid_from <= p_day
+    AND (r.valid_until IS NULL OR r.valid_until >= p_day)
+    AND NOT EXISTS (
+        SELECT 1 FROM availability_exceptions e
+        WHERE e.doctor_id = p_doctor_id
+        AND p_day BETWEEN e.start_date AND e.end_date
+    )
+$$;
+
+-- Heures ouvertes par les règles d'un docteur un jour donné, en masque
+CREATE OR REPLACE FUNCTION healthtime_rule_mask(p_doctor_id INT, p_day DATE)
+RETURNS TABLE (rule_mask INT)
+LANGUAGE sql STABLE AS $$
+    SELECT COALESCE(bit_or((1 << r.end_hour) - (1 << r.start_hour)), 0)
+    FROM availability_rules r
+    WHERE r.doctor_id = p_doctor_id
+    AND r.weekday = EXTRACT(ISODOW FROM p_day)::int
+    AND r.valid_from <= p_day
+    AND (r.valid_until IS NULL OR r.valid_until >= p_day)
+    AND NOT EXISTS (
+        SELECT 1 FROM availability_exceptions e
+        WHERE e.doctor_id = p_doctor_id
+        AND p_day BETWEEN e.start_date AND e.end_date
+    )
+$$;
+
+-- Masques d'un docteur un jour donné : heures réservables (heures des
+-- règles non fermées et heures ouvertes à la main, moins les rendez-vous)
+-- et heures réservées. Toujours une ligne, à zéro pour un jour vide.
+CREATE OR REPLACE FUNCTION healthtime_day_mask(p_doctor_id INT, p_day DATE)
+RETURNS TABLE (open_mask INT, booked_mask INT)
+LANGUAGE sql STABLE AS $$
+    SELECT ((r.rule_mask & ~COALESCE(m.closed_mask, 0)) | COALESCE(m.available_mask, 0))
+               & ~COALESCE(m.booked_mask, 0),
+           COALESCE(m.booked_mask, 0)
+    FROM healthtime_rule_mask(p_doctor_id, p_day) r
+    LEFT JOIN doctor_day_masks m ON m.doctor_id = p_doctor_id AND m.day = p_day
+$$;
+
+-- Heures réservables d'un docteur un jour donné, lues dans les masques
+CREATE OR REPLACE FUNCTION healthtime_open_hours(p_doctor_id INT, p_day DATE)
+RETURNS TABLE (slot_hour INT)
+LANGUAGE sql STABLE AS $$
+    SELECT h.hour
+    FROM healthtime_day_mask(p_doctor_id, p_day) m
+    CROSS JOIN generate_series(0, 23) AS h(hour)
+    WHERE m.open_mask & (1 << h.hour) <> 0
+$$;
+
+-- Débuts possibles d'une consultation de p_minutes chez un docteur un jour
+-- donné : heures libres et heures entamées par des consultations courtes
+-- (sauf un jour d'absence), moins les périodes des rendez-vous planifiés
+-- (soustraction de tsmultirange). Les débuts sont alignés sur la durée dans
+-- chaque heure.
+CREATE OR REPLACE FUNCTION healthtime_free_periods(p_doctor_id INT, p_day DATE, p_minutes INT)
+RETURNS TABLE (start_at TIMESTAMP)
+LANGUAGE sql STABLE AS $$
+    WITH hours AS (
+        SELECT slot_hour FROM healthtime_open_hours(p_doctor_id, p_day)
+        UNION
+        SELECT slot_hour FROM time_slots
+        WHERE doctor_id = p_doctor_id AND slot_date = p_day AND status = 'booked'
+        AND NOT EXISTS (
+            SELECT 1 FROM availability_exceptions e
+            WHERE e.doctor_id = p_doctor_id
+            AND p_day BETWEEN e.start_date AND e.end_date
+        )
+    ), free AS (
+        SELECT COALESCE(range_agg(tsrange(p_day + make_interval(hours => slot_hour),
+                                          p_day + make_interval(hours => slot_hour + 1))),
+                        '{}'::tsmultirange)
+               - COALESCE((SELECT range_agg(a.period)
+                           FROM appointments a
+                           WHERE a.doctor_id = p_doctor_id
+                           AND a.status = 'scheduled'
+                           AND a.appointment_date >= p_day AND a.appointment_date < p_day + 1),
+                          '{}'::tsmultirange) AS periods
+        FROM hours
+    )
+    SELECT s.start_at
+    FROM hours
+    CROSS JOIN free
+    CROSS JOIN generate_series(0, 60 - p_minutes, p_minutes) AS m(minute)
+    CROSS JOIN LATERAL (SELECT p_day + make_interval(hours => hours.slot_hour, mins => m.minute) AS start_at) s
+    WHERE free.periods @> tsrange(s.start_at, s.start_at + make_interval(mins => p_minutes))
+$$;
+
+-- Les p_limit premières heures après p_after (jusqu'au jour p_until) où au
+-- moins un docteur actif de la spécialité est libre, avec le nombre de
+-- docteurs libres. Les jours sont lus un par un et la recherche s'arrête
+-- dès que p_limit heures sont trouvées : les jours lointains ne sont lus
+-- que si les premiers sont pleins.
+CREATE OR REPLACE FUNCTION healthtime_next_free_hours(p_specialty_id INT, p_after TIMESTAMP,
+                                                      p_until DATE, p_limit INT)
+RETURNS TABLE (day DATE, slot_hour INT, doctor_count BIGINT)
+LANGUAGE plpgsql STABLE AS $$
+DECLARE
+    current_day DATE := p_after::date;
+    found_hours INT := 0;
+    rows_found INT;
+BEGIN
+    WHILE current_day <= p_until AND found_hours < p_limit LOOP
+        RETURN QUERY
+            SELECT current_day, h.hour, COUNT(*)
+            FROM doctor_specialties ds
+            JOIN users u ON u.id = ds.doctor_id
+            CROSS JOIN LATERAL healthtime_day_mask(u.id, current_day) m
+            JOIN generate_series(0, 23) AS h(hour) ON m.open_mask & (1 << h.hour) <> 0
+            WHERE ds.specialty_id = p_specialty_id
+            AND u.status = 'active'
+            AND m.open_mask <> 0
+            AND current_day + make_interval(hours => h.hour) > p_after
+            GROUP BY h.hour
+            ORDER BY h.hour
+            LIMIT p_limit - found_hours;
+        GET DIAGNOSTICS rows_found = ROW_COUNT;
+        found_hours := found_hours + rows_found;
+        current_day := current_day + 1;
+    END LOOP;
+END $$;
+
+-- Créneaux d'un docteur entre deux dates, règles développées en 'available'.
+-- Sans p_from : toutes les lignes time_slots jusqu'à p_to, règles à partir
+-- d'aujourd'hui.
+CREATE OR REPLACE FUNCTION healthtime_doctor_slots(p_doctor_id INT, p_from DATE, p_to DATE)
+RETURNS TABLE (slot_date DATE, slot_hour INT, status VARCHAR)
+LANGUAGE sql STABLE AS $$
+    SELECT ts.slot_date, ts.slot_hour, ts.status
+    FROM time_slots ts
+    WHERE ts.doctor_id = p_doctor_id
+    AND (p_from IS NULL OR ts.slot_date >= p_from)
+    AND ts.slot_date <= p_to
+    UNION ALL
+    SELECT d.day, r.slot_hour, 'available'::varchar
+    FROM generate_series(COALESCE(p_from, CURRENT_DATE), p_to, interval '1 day') AS g(day_start)
+    CROSS JOIN LATERAL (SELECT g.day_start::date AS day) d
+    CROSS JOIN LATERAL healthtime_rule_hours(p_doctor_id, d.day) r
+    WHERE NOT EXISTS (
+        SELECT 1 FROM time_slots ts
+        WHERE ts.doctor_id = p_doctor_id
+        AND ts.slot_date = d.day
+        AND ts.slot_hour = r.slot_hour
+    )
+$$;
+
+-- Triggers par instruction, comme ceux de admin_stats (migration 005) :
+-- TG_ARGV est une liste de paires (colonne de masque, condition sur la
+-- ligne). Les bits des anciennes lignes sont effacés, puis ceux des
+-- nouvelles posés ; les opérations binaires s'appliquent à la dernière
+-- version de la ligne, les transactions concurrentes ne perdent donc
+-- aucune mise à jour. Les lignes revenues à zéro sont supprimées.
+CREATE OR REPLACE FUNCTION healthtime_update_day_masks() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    columns TEXT[] := '{}';
+    bits TEXT[] := '{}';
+    cleared TEXT[] := '{}';
+    added TEXT[] := '{}';
+    touched TEXT;
+    changed BOOLEAN;
+BEGIN
+    -- Un trigger par instruction se déclenche aussi quand aucune ligne n'a
+    -- changé (réservation refusée, ON CONFLICT DO NOTHING) : rien à faire
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s)',
+                   CASE TG_OP WHEN 'INSERT' THEN 'new_rows' ELSE 'old_rows' END) INTO changed;
+    IF NOT changed THEN
+        RETURN NULL;
+    END IF;
+
+    FOR i IN 0 .. array_length(TG_ARGV, 1) / 2 - 1 LOOP
+        columns := columns || quote_ident(TG_ARGV[2 * i]);
+        bits := bits || format('COALESCE(bit_or(1 << slot_hour) FILTER (WHERE %s), 0)', TG_ARGV[2 * i + 1]);
+        cleared := cleared || format('%1$I = m.%1$I & ~d.%1$I', TG_ARGV[2 * i]);
+        added := added || format('%1$I = m.%1$I | EXCLUDED.%1$I', TG_ARGV[2 * i]);
+    END LOOP;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        EXECUTE format($sql$
+            UPDATE doctor_day_masks m SET %s
+            FROM (SELECT doctor_id, slot_date, %s FROM old_rows GROUP BY 1, 2) d (doctor_id, slot_date, %s)
+            WHERE m.doctor_id = d.doctor_id AND m.day = d.slot_date
+        $sql$, array_to_string(cleared, ', '), array_to_string(bits, ', '), array_to_string(columns, ', '));
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        EXECUTE format($sql$
+            INSERT INTO doctor_day_masks AS m (doctor_id, day, %s)
+            SELECT doctor_id, slot_date, %s FROM new_rows GROUP BY 1, 2
+            ON CONFLICT (doctor_id, day) DO UPDATE SET %s
+        $sql$, array_to_string(columns, ', '), array_to_string(bits, ', '), array_to_string(added, ', '));
+    END IF;
+
+    touched := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT doctor_id, slot_date FROM new_rows'
+        WHEN 'DELETE' THEN 'SELECT doctor_id, slot_date FROM old_rows'
+        ELSE 'SELECT doctor_id, slot_date FROM old_rows UNION SELECT doctor_id, slot_date FROM new_rows'
+    END;
+    EXECUTE format($sql$
+        DELETE FROM doctor_day_masks m
+        WHERE m.available_mask = 0 AND m.closed_mask = 0 AND m.booked_mask = 0
+        AND (m.doctor_id, m.day) IN (%s)
+    $sql$, touched);
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE TRIGGER trg_time_slots_masks_insert AFTER INSERT ON time_slots
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks(
+        'available_mask', 'status = ''available''', 'closed_mask', 'status <> ''available''');
+CREATE OR REPLACE TRIGGER trg_time_slots_masks_update AFTER UPDATE ON time_slots
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks(
+        'available_mask', 'status = ''available''', 'closed_mask', 'status <> ''available''');
+CREATE OR REPLACE TRIGGER trg_time_slots_masks_delete AFTER DELETE ON time_slots
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks(
+        'available_mask', 'status = ''available''', 'closed_mask', 'status <> ''available''');
+
+-- booked_mask : rendez-vous d'une heure entière ; une heure de consultations
+-- courtes est fermée par sa ligne time_slots 'booked'
+CREATE OR REPLACE TRIGGER trg_appointments_masks_insert AFTER INSERT ON appointments
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks(
+        'booked_mask', 'status = ''scheduled'' AND duration_minutes = 60');
+CREATE OR REPLACE TRIGGER trg_appointments_masks_update AFTER UPDATE ON appointments
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks(
+        'booked_mask', 'status = ''scheduled'' AND duration_minutes = 60');
+CREATE OR REPLACE TRIGGER trg_appointments_masks_delete AFTER DELETE ON appointments
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_update_day_masks(
+        'booked_mask', 'status = ''scheduled'' AND duration_minutes = 60');
+
+-- Recalcul complet (remplissage initial, ou après un TRUNCATE)
+CREATE OR REPLACE FUNCTION healthtime_rebuild_day_masks() RETURNS VOID
+LANGUAGE sql AS $$
+    DELETE FROM doctor_day_masks;
+    INSERT INTO doctor_day_masks (doctor_id, day, available_mask, closed_mask, booked_mask)
+    SELECT doctor_id, slot_date,
+           COALESCE(bit_or(1 << slot_hour) FILTER (WHERE kind = 'available'), 0),
+           COALESCE(bit_or(1 << slot_hour) FILTER (WHERE kind = 'closed'), 0),
+           COALESCE(bit_or(1 << slot_hour) FILTER (WHERE kind = 'booked'), 0)
+    FROM (
+        SELECT doctor_id, slot_date, slot_hour,
+               CASE WHEN status = 'available' THEN 'available' ELSE 'closed' END AS kind
+        FROM time_slots
+        UNION ALL
+        SELECT doctor_id, slot_date, slot_hour, 'booked'
+        FROM appointments
+        WHERE status = 'scheduled' AND duration_minutes = 60
+    ) slots
+    GROUP BY doctor_id, slot_date;
+$$;
+
 -- =========================================================================
 -- INSERTION DES DONNÉES DE BASE
 -- =========================================================================
@@ -88,3 +548,86 @@ INSERT INTO specialties (name) VALUES
 ('Médecine interne'),
 ('Médecine sportive')
 ON CONFLICT (name) DO NOTHING;
+
+-- =========================================================================
+-- STATISTIQUES D'ADMINISTRATION (voir database/migrations/005_admin_stats.sql)
+-- =========================================================================
+
+CREATE TABLE IF NOT EXISTS admin_stats (
+    metric VARCHAR(30) NOT NULL,
+    key VARCHAR(60) NOT NULL,
+    shard SMALLINT NOT NULL,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (metric, key, shard)
+);
+
+-- Triggers par instruction : TG_ARGV[0] est la métrique, TG_ARGV[1]
+-- l'expression de la clé sur les lignes de new_rows / old_rows
+CREATE OR REPLACE FUNCTION healthtime_count_stats() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    deltas TEXT;
+BEGIN
+    deltas := CASE TG_OP
+        WHEN 'INSERT' THEN format('SELECT %s AS key, 1 AS delta FROM new_rows', TG_ARGV[1])
+        WHEN 'DELETE' THEN format('SELECT %s AS key, -1 AS delta FROM old_rows', TG_ARGV[1])
+        ELSE format('SELECT %1$s AS key, -1 AS delta FROM old_rows UNION ALL SELECT %1$s, 1 FROM new_rows', TG_ARGV[1])
+    END;
+
+    EXECUTE format($sql$
+        INSERT INTO admin_stats (metric, key, shard, count)
+        SELECT %L, key, pg_backend_pid() %% 16, SUM(delta)
+        FROM (%s) deltas
+        GROUP BY key
+        HAVING SUM(delta) <> 0
+        ON CONFLICT (metric, key, shard) DO UPDATE SET count = admin_stats.count + EXCLUDED.count
+    $sql$, TG_ARGV[0], deltas);
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE TRIGGER trg_users_stats_insert AFTER INSERT ON users
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('users', 'concat_ws(''/'', role, status)');
+CREATE OR REPLACE TRIGGER trg_users_stats_update AFTER UPDATE ON users
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('users', 'concat_ws(''/'', role, status)');
+CREATE OR REPLACE TRIGGER trg_users_stats_delete AFTER DELETE ON users
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('users', 'concat_ws(''/'', role, status)');
+
+CREATE OR REPLACE TRIGGER trg_appointments_stats_insert AFTER INSERT ON appointments
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('appointments', 'COALESCE(status, '''')');
+CREATE OR REPLACE TRIGGER trg_appointments_stats_update AFTER UPDATE ON appointments
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('appointments', 'COALESCE(status, '''')');
+CREATE OR REPLACE TRIGGER trg_appointments_stats_delete AFTER DELETE ON appointments
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('appointments', 'COALESCE(status, '''')');
+
+CREATE OR REPLACE TRIGGER trg_doctor_specialties_stats_insert AFTER INSERT ON doctor_specialties
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('specialty_doctors', 'specialty_id::text');
+CREATE OR REPLACE TRIGGER trg_doctor_specialties_stats_update AFTER UPDATE ON doctor_specialties
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('specialty_doctors', 'specialty_id::text');
+CREATE OR REPLACE TRIGGER trg_doctor_specialties_stats_delete AFTER DELETE ON doctor_specialties
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION healthtime_count_stats('specialty_doctors', 'specialty_id::text');
+
+-- Recalcul complet (remplissage initial, ou après un TRUNCATE)
+CREATE OR REPLACE FUNCTION healthtime_rebuild_admin_stats() RETURNS VOID
+LANGUAGE sql AS $$
+    DELETE FROM admin_stats;
+    INSERT INTO admin_stats (metric, key, shard, count)
+    SELECT 'users', concat_ws('/', role, status), 0, COUNT(*) FROM users GROUP BY 2
+    UNION ALL
+    SELECT 'appointments', COALESCE(status, ''), 0, COUNT(*) FROM appointments GROUP BY 2
+    UNION ALL
+    SELECT 'specialty_doctors', specialty_id::text, 0, COUNT(*) FROM doctor_specialties GROUP BY 2;
+$$;
+
+-- Le compte administrateur par défaut est inséré plus haut, avant les
+-- triggers : premier remplissage, une base neuve part des mêmes compteurs
+-- qu'une base migrée
+SELECT healthtime_rebuild_admin_stats();
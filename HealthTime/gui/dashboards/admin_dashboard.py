@@ -107,10 +107,7 @@ class AdminDashboard:
     def show_dashboard(self):
         self.clear_main()
         
-        users = AdminDAO.get_all_users()
-        total_users = len(users)
-        total_docs = len([u for u in users if u['role'] == 'doctor'])
-        total_pats = len([u for u in users if u['role'] == 'patient'])
+        stats = AdminDAO.get_statistics()
 
         tk.Label(
             self.main,
@@ -129,9 +126,34 @@ class AdminDashboard:
             tk.Label(card, text=value, font=("Helvetica", 24, "bold"), bg=self.colors["card"], fg=self.colors["accent"]).pack()
             tk.Label(card, text=label, font=("Helvetica", 10), bg=self.colors["card"], fg="gray").pack()
 
-        create_stat_card(stats_frame, "Total Registered", total_users)
-        create_stat_card(stats_frame, "Active Doctors", total_docs)
-        create_stat_card(stats_frame, "Active Patients", total_pats)
+        create_stat_card(stats_frame, "Total Registered", stats["total_users"])
+        create_stat_card(stats_frame, "Active Doctors", stats["total_doctors"])
+        create_stat_card(stats_frame, "Active Patients", stats["total_patients"])
+
+        appt_frame = tk.Frame(self.main, bg=self.colors["bg"])
+        appt_frame.pack(pady=10)
+
+        create_stat_card(appt_frame, "Appointments", stats["total_appointments"])
+        for status, count in sorted(stats["appointments_by_status"].items()):
+            create_stat_card(appt_frame, status.capitalize(), count)
+
+        if stats["doctors_by_specialty"]:
+            tk.Label(
+                self.main,
+                text="Doctors by specialty",
+                font=("Helvetica", 14, "bold"),
+                bg=self.colors["bg"],
+                fg=self.colors["text"]
+            ).pack(pady=(20, 5))
+
+            for spec in stats["doctors_by_specialty"]:
+                tk.Label(
+                    self.main,
+                    text=f"{spec['name']} : {spec['count']}",
+                    font=("Helvetica", 11),
+                    bg=self.colors["bg"],
+                    fg=self.colors["text"]
+                ).pack()
 
     def show_users(self):
         self.clear_main()
@@ -377,7 +399,7 @@ class AdminDashboard:
         render_list()
 
     def deactivate_doctor(self, doctor_id):
-        if messagebox.askyesno("Confirm", "Deactivate this doctor?"):
+        if messagebox.askyesno("Confirm", "Deactivate this doctor?\nTheir upcoming appointments will be canceled and the patients notified."):
             success, msg = AdminDAO.deactivate_doctor(doctor_id)
             if success:
                 self.show_doctors()
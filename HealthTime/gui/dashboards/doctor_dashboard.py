@@ -83,6 +83,7 @@ class DoctorDashboard:
         nav_btn("Dashboard", self.show_dashboard).pack(fill="x", pady=5)
         nav_btn("Weekly Planner", self.show_weekly_planner).pack(fill="x", pady=5)
         nav_btn("Ajout de créneaux", self.show_calendar_planner).pack(fill="x", pady=5)
+        nav_btn("Disponibilités récurrentes", self.show_availability_rules).pack(fill="x", pady=5)
         nav_btn("My Schedule", self.show_schedule).pack(fill="x", pady=5)
         nav_btn("Appointments", self.show_appointments).pack(fill="x", pady=5)
 
@@ -268,25 +269,23 @@ class DoctorDashboard:
                 messagebox.showwarning("Attention", "Sélectionnez au moins un jour et une heure.")
                 return
 
-            errors = []
-
-            for d in selected_days:
-                for h in selected_hours:
-                    year = int(year_combo.get())
-                    month = int(month_combo.get())
-
-                    date_str = f"{year}-{month:02d}-{d:02d}"
-                    success, msg = DoctorDAO.create_time_slot_day_hour(
-                        self.user["id"], date_str, h
-                    )
-
-                    if not success:
-                        errors.append(f"{date_str} {h}h → {msg}")
+            year = int(year_combo.get())
+            month = int(month_combo.get())
+            slots = [
+                (f"{year}-{month:02d}-{d:02d}", h)
+                for d in selected_days
+                for h in selected_hours
+            ]
+            result = DoctorDAO.create_time_slots(self.user["id"], slots)
 
-            if errors:
-                messagebox.showerror("Erreur", "\n".join(errors))
+            if result is None:
+                messagebox.showerror("Erreur", "Impossible d'enregistrer les disponibilités.")
             else:
-                messagebox.showinfo("Succès", "Disponibilités enregistrées !")
+                created, skipped = result
+                messagebox.showinfo(
+                    "Succès",
+                    f"Disponibilités enregistrées : {created} créneau(x) ouvert(s), {skipped} déjà existant(s)."
+                )
 
             self.show_weekly_planner()
 
@@ -299,8 +298,131 @@ class DoctorDashboard:
             command=save
         ).pack(pady=20)
 
-   
+    def show_availability_rules(self):
+        """Horaires hebdomadaires récurrents et absences (congés) qui les suspendent"""
+        self.clear_main()
+        container = tk.Frame(self.main, bg=self.colors["bg"])
+        container.pack(fill="both", expand=True, padx=40, pady=20)
+
+        tk.Label(container, text="Disponibilités récurrentes", font=("Helvetica", 18, "bold"), bg=self.colors["bg"]).pack(pady=10)
+
+        weekday_names = ["", "Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
 
+        rules_frame = tk.Frame(container, bg=self.colors["bg"])
+        rules_frame.pack(fill="x", pady=5)
+        rules = DoctorDAO.get_availability_rules(self.user["id"])
+        if not rules:
+            tk.Label(rules_frame, text="Aucune règle", bg=self.colors["bg"], fg="gray").pack()
+
+        def delete_rule(rule_id):
+            if DoctorDAO.delete_availability_rule(self.user["id"], rule_id):
+                self.show_availability_rules()
+            else:
+                messagebox.showerror("Erreur", "Impossible de supprimer la règle.")
+
+        for r in rules:
+            row = tk.Frame(rules_frame, bg=self.colors["card"], pady=5)
+            row.pack(fill="x", pady=2)
+            period = f"depuis le {r['valid_from']}" + (f" jusqu'au {r['valid_until']}" if r["valid_until"] else "")
+            tk.Label(
+                row,
+                text=f"{weekday_names[r['weekday']]}  {r['start_hour']}h - {r['end_hour']}h  ({period})",
+                bg=self.colors["card"], fg=self.colors["text"]
+            ).pack(side="left", padx=10)
+            tk.Button(row, text="Supprimer", bg="#e74c3c", fg="white", relief="flat",
+                      command=lambda rid=r["id"]: delete_rule(rid)).pack(side="right", padx=10)
+
+        form = tk.Frame(container, bg=self.colors["bg"])
+        form.pack(pady=10)
+
+        weekday_vars = {}
+        for wd in range(1, 8):
+            var = tk.BooleanVar()
+            weekday_vars[wd] = var
+            tk.Checkbutton(form, text=weekday_names[wd][:3], variable=var, bg=self.colors["bg"]).grid(row=0, column=wd - 1)
+
+        start_var = tk.StringVar(value="9")
+        end_var = tk.StringVar(value="17")
+        tk.Label(form, text="De", bg=self.colors["bg"]).grid(row=1, column=0)
+        ttk.Combobox(form, textvariable=start_var, values=list(range(7, 23)), width=4, state="readonly").grid(row=1, column=1)
+        tk.Label(form, text="à", bg=self.colors["bg"]).grid(row=1, column=2)
+        ttk.Combobox(form, textvariable=end_var, values=list(range(8, 24)), width=4, state="readonly").grid(row=1, column=3)
+
+        def add_rule():
+            weekdays = [wd for wd, var in weekday_vars.items() if var.get()]
+            start_hour, end_hour = int(start_var.get()), int(end_var.get())
+            if not weekdays or end_hour <= start_hour:
+                messagebox.showwarning("Attention", "Choisissez au moins un jour et une heure de fin après l'heure de début.")
+                return
+            for wd in weekdays:
+                success, msg = DoctorDAO.add_availability_rule(self.user["id"], wd, start_hour, end_hour)
+                if not success:
+                    messagebox.showerror("Erreur", msg)
+                    break
+            self.show_availability_rules()
+
+        tk.Button(form, text="Ajouter la règle", bg="#2196F3", fg="white",
+                  command=add_rule).grid(row=1, column=4, columnspan=3, padx=10)
+
+        tk.Label(container, text="Absences", font=("Helvetica", 14, "bold"), bg=self.colors["bg"]).pack(pady=(20, 5))
+
+        exceptions_frame = tk.Frame(container, bg=self.colors["bg"])
+        exceptions_frame.pack(fill="x", pady=5)
+
+        def delete_exception(exception_id):
+            if DoctorDAO.delete_availability_exception(self.user["id"], exception_id):
+                self.show_availability_rules()
+            else:
+                messagebox.showerror("Erreur", "Impossible de supprimer l'absence.")
+
+        for e in DoctorDAO.get_availability_exceptions(self.user["id"]):
+            row = tk.Frame(exceptions_frame, bg=self.colors["card"], pady=5)
+            row.pack(fill="x", pady=2)
+            tk.Label(
+                row,
+                text=f"Du {e['start_date']} au {e['end_date']}  {e['reason'] or ''}",
+                bg=self.colors["card"], fg=self.colors["text"]
+            ).pack(side="left", padx=10)
+            tk.Button(row, text="Supprimer", bg="#e74c3c", fg="white", relief="flat",
+                      command=lambda eid=e["id"]: delete_exception(eid)).pack(side="right", padx=10)
+
+        exception_form = tk.Frame(container, bg=self.colors["bg"])
+        exception_form.pack(pady=10)
+        tk.Label(exception_form, text="Du (YYYY-MM-DD)", bg=self.colors["bg"]).grid(row=0, column=0)
+        start_entry = tk.Entry(exception_form, width=12)
+        start_entry.grid(row=0, column=1, padx=5)
+        tk.Label(exception_form, text="Au", bg=self.colors["bg"]).grid(row=0, column=2)
+        end_entry = tk.Entry(exception_form, width=12)
+        end_entry.grid(row=0, column=3, padx=5)
+        tk.Label(exception_form, text="Motif", bg=self.colors["bg"]).grid(row=0, column=4)
+        reason_entry = tk.Entry(exception_form, width=20)
+        reason_entry.grid(row=0, column=5, padx=5)
+
+        def add_exception():
+            try:
+                start_date = datetime.strptime(start_entry.get().strip(), "%Y-%m-%d").date()
+                end_text = end_entry.get().strip()
+                end_date = datetime.strptime(end_text, "%Y-%m-%d").date() if end_text else start_date
+            except ValueError:
+                messagebox.showerror("Erreur", "Format de date invalide.")
+                return
+            if end_date < start_date:
+                messagebox.showerror("Erreur", "La date de fin précède la date de début.")
+                return
+            cancel_appointments = messagebox.askyesno(
+                "Absence", "Annuler aussi vos rendez-vous de cette période ?\nLes patients seront prévenus."
+            )
+            success, msg = DoctorDAO.add_availability_exception(
+                self.user["id"], start_date, end_date, reason_entry.get().strip(),
+                cancel_appointments=cancel_appointments
+            )
+            if not success:
+                messagebox.showerror("Erreur", msg)
+                return
+            self.show_availability_rules()
+
+        tk.Button(exception_form, text="Ajouter l'absence", bg="#6d6875", fg="white",
+                  command=add_exception).grid(row=0, column=6, padx=10)
 
     def show_schedule(self):
         self.clear_main()
@@ -455,7 +577,11 @@ class DoctorDashboard:
         canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
 
-        slots = DoctorDAO.get_doctor_slots(self.user["id"])
+        base_date = datetime.today().date()
+        monday = base_date - timedelta(days=base_date.weekday()) + timedelta(weeks=week_offset)
+        week_dates = [monday + timedelta(days=i) for i in range(7)]
+
+        slots = DoctorDAO.get_doctor_slots(self.user["id"], week_dates[0], week_dates[-1])
         appointments = AppointmentDAO.get_doctor_appointments(self.user["id"])
 
         slot_map = {}
@@ -472,10 +598,6 @@ class DoctorDashboard:
                 dt = datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
             urgent_map[(dt.date(), dt.hour)] = a.get("urgent", False)
 
-        base_date = datetime.today().date()
-        monday = base_date - timedelta(days=base_date.weekday()) + timedelta(weeks=week_offset)
-        week_dates = [monday + timedelta(days=i) for i in range(7)]
-
         header = tk.Frame(scroll_frame, bg=self.colors["bg"])
         header.pack(pady=10, fill="x")
 
@@ -5,6 +5,9 @@ from datetime import datetime
 from dao.appointment_dao import AppointmentDAO
 from dao.admin_dao import AdminDAO
 from dao.user_dao import UserDAO
+from dao.waitlist_dao import WaitlistDAO
+from dao.notification_dao import NotificationDAO
+from database.partitions import booking_horizon
 from datetime import timedelta
 
 class PatientDashboard:
@@ -121,8 +124,13 @@ class PatientDashboard:
         cal_container = tk.Frame(config_frame, bg=self.colors["card"])
         cal_container.pack(side="left")
         tk.Label(cal_container, text="3. Choisissez une date", bg=self.colors["card"], font=("Helvetica", 11, "bold")).pack(anchor="w")
-        self.cal = Calendar(cal_container, selectmode="day", date_pattern="yyyy-mm-dd", mindate=datetime.today())
+        self.cal = Calendar(cal_container, selectmode="day", date_pattern="yyyy-mm-dd", mindate=datetime.today(),
+                            maxdate=booking_horizon())
         self.cal.pack(pady=5)
+        # Jours avec des créneaux libres, du plus clair au plus foncé
+        for level, color in enumerate(("#e8f5e9", "#a5d6a7", "#66bb6a", "#2e7d32"), start=1):
+            self.cal.tag_config(f"free{level}", background=color, foreground="white" if level >= 3 else "black")
+        self.cal.bind("<<CalendarMonthChanged>>", lambda e: self.highlight_free_days())
 
         opt_container = tk.Frame(config_frame, bg=self.colors["card"], padx=30)
         opt_container.pack(side="left", fill="y", pady=20)
@@ -134,8 +142,12 @@ class PatientDashboard:
         tk.Label(opt_container, text="Les rendez-vous urgents sont prioritaires\ndans l'agenda du médecin.", 
                  bg=self.colors["card"], fg="gray", font=("Helvetica", 9, "italic"), justify="left").pack(anchor="w", pady=5)
 
-        tk.Button(card, text="Rechercher des créneaux disponibles", bg=self.colors["accent"], fg="white",
-                  command=lambda: self.show_slots(card, appointment), font=("Helvetica", 11, "bold"), pady=10).pack(pady=20)
+        buttons = tk.Frame(card, bg=self.colors["card"])
+        buttons.pack(pady=20)
+        tk.Button(buttons, text="Rechercher des créneaux disponibles", bg=self.colors["accent"], fg="white",
+                  command=lambda: self.show_slots(card, appointment), font=("Helvetica", 11, "bold"), pady=10).pack(side="left", padx=5)
+        tk.Button(buttons, text="⏭ Prochains créneaux", bg=self.colors["card"], fg=self.colors["accent"],
+                  command=lambda: self.show_next_slots(appointment), font=("Helvetica", 11, "bold"), pady=10).pack(side="left", padx=5)
 
         self.slots_container = tk.Frame(card, bg=self.colors["card"])
         self.slots_container.pack(fill="both", expand=True)
@@ -151,6 +163,29 @@ class PatientDashboard:
         doc_options = ["Peu importe (Premier disponible)"] + list(self.doctor_map.keys())
         self.doc_combo.config(state="readonly", values=doc_options)
         self.doc_combo.current(0)
+        self.doc_combo.bind("<<ComboboxSelected>>", lambda e: self.highlight_free_days())
+        self.highlight_free_days()
+
+    def highlight_free_days(self):
+        """Colore les jours du mois affiché selon leur nombre de créneaux libres (une requête par mois)."""
+        self.cal.calevent_remove("all")
+        spec_name = self.spec_combo.get()
+        if not spec_name:
+            return
+
+        month, year = self.cal.get_displayed_month()
+        first_day = datetime(year, month, 1).date()
+        doc_choice = self.doc_combo.get()
+        if doc_choice == "Peu importe (Premier disponible)":
+            days = self.dao.get_month_free_slots_by_specialty(self.spec_map[spec_name], first_day)
+        else:
+            days = self.dao.get_month_free_slots_for_doctor(self.doctor_map[doc_choice], first_day)
+
+        freest = max((d["free_slots"] for d in days), default=0)
+        for d in days:
+            level = -(-4 * d["free_slots"] // freest)
+            self.cal.calevent_create(datetime.strptime(d["date"], "%Y-%m-%d").date(),
+                                     f"{d['free_slots']} créneau(x) libre(s)", f"free{level}")
 
     def show_slots(self, parent, appointment):
         for w in self.slots_container.winfo_children():
@@ -167,8 +202,15 @@ class PatientDashboard:
         spec_id = self.spec_map[spec_name]
 
         if doc_choice == "Peu importe (Premier disponible)":
-            available_slots = self.dao.get_available_slots_by_specialty(spec_id, date_obj)
             doctor_id = "any"
+            if not appointment:
+                # Une heure par bouton : le docteur est choisi à la réservation
+                available_slots = [
+                    {"time": s["time"], "doctor_id": "any", "doctor_count": s["doctor_count"]}
+                    for s in self.dao.get_free_hours_by_specialty(spec_id, date_obj)
+                ]
+            else:
+                available_slots = self.dao.get_available_slots_by_specialty(spec_id, date_obj)
         else:
             doctor_id = self.doctor_map.get(doc_choice)
             available_slots = self.dao.get_available_slots_for_doctor(doctor_id, date_obj)
@@ -184,6 +226,10 @@ class PatientDashboard:
         if not available_slots:
             tk.Label(self.slots_container, text="Aucun créneau disponible pour cette sélection.", 
                      bg=self.colors["card"], fg=self.colors["urgent"], font=("Helvetica", 11, "bold")).pack(pady=10)
+            if not appointment:
+                tk.Button(self.slots_container, text="⏳ Rejoindre la liste d'attente (7 jours)", bg=self.colors["accent"],
+                          fg="white", relief="flat", font=("Helvetica", 10),
+                          command=lambda: self.join_waitlist(spec_id, doctor_id, date_obj)).pack(pady=5)
             return
 
         tk.Label(self.slots_container, text="Sélectionnez un horaire :", bg=self.colors["card"], font=("Helvetica", 10, "bold")).pack(anchor="w")
@@ -192,7 +238,11 @@ class PatientDashboard:
         grid_frame.pack(pady=10, fill="x")
 
         for i, slot_data in enumerate(available_slots):
-            if isinstance(slot_data, dict):
+            if isinstance(slot_data, dict) and slot_data["doctor_id"] == "any":
+                slot_time = slot_data["time"]
+                current_doc_id = "any"
+                btn_text = f"{slot_time}\n({slot_data['doctor_count']} médecin(s))"
+            elif isinstance(slot_data, dict):
                 slot_time = slot_data["time"]
                 current_doc_id = slot_data["doctor_id"]
                 btn_text = f"{slot_time}\n(Dr {slot_data['doctor_name']})"
@@ -204,6 +254,58 @@ class PatientDashboard:
             tk.Button(grid_frame, text=btn_text, width=15, height=2, bg=self.colors["accent"], fg="white", relief="flat",
                       font=("Helvetica", 9), command=lambda t=slot_time, d=current_doc_id: self.book_slot(d, date_obj, t, appointment)).grid(row=i//4, column=i%4, padx=5, pady=5)
 
+    def show_next_slots(self, appointment):
+        """Premiers créneaux libres des semaines à venir, sans choisir de date."""
+        for w in self.slots_container.winfo_children():
+            w.destroy()
+
+        spec_name = self.spec_combo.get()
+        if not spec_name:
+            messagebox.showwarning("Attention", "Veuillez choisir une spécialité")
+            return
+
+        doc_choice = self.doc_combo.get()
+        if doc_choice == "Peu importe (Premier disponible)":
+            doctor_id = "any"
+            next_slots = self.dao.get_next_slots_by_specialty(self.spec_map[spec_name])
+        else:
+            doctor_id = self.doctor_map.get(doc_choice)
+            next_slots = self.dao.get_next_slots_for_doctor(doctor_id)
+
+        if not next_slots:
+            tk.Label(self.slots_container, text="Aucun créneau disponible dans les semaines à venir.",
+                     bg=self.colors["card"], fg=self.colors["urgent"], font=("Helvetica", 11, "bold")).pack(pady=10)
+            return
+
+        tk.Label(self.slots_container, text="Prochains créneaux disponibles :", bg=self.colors["card"], font=("Helvetica", 10, "bold")).pack(anchor="w")
+
+        grid_frame = tk.Frame(self.slots_container, bg=self.colors["card"])
+        grid_frame.pack(pady=10, fill="x")
+
+        for i, slot in enumerate(next_slots):
+            slot_date = datetime.strptime(slot["date"], "%Y-%m-%d").date()
+            btn_text = f"{slot_date.strftime('%d/%m')} {slot['time']}"
+            if "doctor_count" in slot:
+                btn_text += f"\n({slot['doctor_count']} médecin(s))"
+            tk.Button(grid_frame, text=btn_text, width=15, height=2, bg=self.colors["accent"], fg="white", relief="flat",
+                      font=("Helvetica", 9),
+                      command=lambda d=slot_date, t=slot["time"]: self.book_slot(doctor_id, d, t, appointment)).grid(row=i//4, column=i%4, padx=5, pady=5)
+
+    def join_waitlist(self, spec_id, doctor_id, date_from):
+        if doctor_id == "any":
+            doctor_id, specialty_id = None, spec_id
+        else:
+            specialty_id = None
+        success, msg = WaitlistDAO.join_waitlist(
+            self.user["id"], date_from, date_from + timedelta(days=7),
+            doctor_id=doctor_id, specialty_id=specialty_id, urgent=self.urgent_var.get()
+        )
+        if success:
+            messagebox.showinfo("Liste d'attente",
+                                "Vous êtes sur la liste d'attente : le premier créneau libéré vous sera attribué.")
+        else:
+            messagebox.showerror("Erreur", msg)
+
     def book_slot(self, doctor_id, date, time, appointment):
         now = datetime.now()
         if date < now.date() or (date == now.date() and time <= now.strftime("%H:%M")):
@@ -211,8 +313,29 @@ class PatientDashboard:
             return
 
         is_urgent = self.urgent_var.get()
+        if doctor_id == "any" and appointment:
+            # Un déplacement vise un docteur : le premier libre à cette heure
+            free = [s for s in self.dao.get_available_slots_by_specialty(self.spec_map[self.spec_combo.get()], date)
+                    if s["time"] == time]
+            if not free:
+                messagebox.showerror("Erreur", "Ce créneau n'est plus disponible.")
+                return
+            doctor_id = free[0]["doctor_id"]
+
+        if doctor_id == "any":
+            success, doctor_name = self.dao.book_first_available(
+                self.user["id"], self.spec_map[self.spec_combo.get()], date, time, urgent=is_urgent
+            )
+            if success:
+                messagebox.showinfo("Succès", f"Rendez-vous enregistré avec le Dr {doctor_name} !")
+                self.show_appointments()
+            else:
+                messagebox.showerror("Erreur", doctor_name)
+            return
+
         if appointment:
-            success, msg = self.dao.modify_appointment(appointment["id"], doctor_id, date, time, urgent=is_urgent)
+            success, msg = self.dao.modify_appointment(appointment["id"], doctor_id, date, time, urgent=is_urgent,
+                                                       patient_id=self.user["id"])
         else:
             success, msg = self.dao.create_appointment(self.user["id"], doctor_id, date, time, urgent=is_urgent)
 
@@ -325,6 +448,16 @@ class PatientDashboard:
             
             messagebox.showinfo("Reminder", msg)
 
+        # Rendez-vous annulés par le médecin (absence, compte désactivé) depuis la dernière visite
+        notifications = NotificationDAO.get_unread_notifications(self.user["id"])
+        if notifications:
+            msg = "Rendez-vous annulés par le médecin :\n\n"
+            for n in notifications:
+                reason = "absence" if n["kind"] == "doctor_absence" else "ne consulte plus"
+                msg += f"• {n['appointment_date'].strftime('%d/%m/%Y %H:%M')} avec le Dr {n['doctor_name']} ({reason})\n"
+            messagebox.showwarning("Rendez-vous annulés", msg)
+            NotificationDAO.mark_notifications_read(self.user["id"])
+
     def toggle_theme(self):
         self.theme = "dark" if self.theme == "light" else "light"
         self.apply_theme()
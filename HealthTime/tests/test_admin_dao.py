@@ -1,5 +1,6 @@
 import unittest
 from dao.admin_dao import AdminDAO
+from dao.user_dao import UserDAO
 from database.db import get_connection
 
 
@@ -16,6 +17,31 @@ class TestAdminDAO(unittest.TestCase):
         self.cursor.close()
         self.conn.close()
 
+    def direct_counts(self):
+        self.cursor.execute("SELECT role, COUNT(*) FROM users GROUP BY role")
+        by_role = dict(self.cursor.fetchall())
+        self.cursor.execute("SELECT status, COUNT(*) FROM appointments GROUP BY status")
+        by_status = dict(self.cursor.fetchall())
+        self.conn.commit()
+        return by_role, by_status
+
+    def test_statistics_follow_writes(self):
+        UserDAO.register_user("Test Admin Stats", "test_admin_stats1", "1234", "patient")
+        stats = AdminDAO.get_statistics()
+        by_role, by_status = self.direct_counts()
+        self.assertEqual(stats["users_by_role"], by_role)
+        self.assertEqual(stats["appointments_by_status"], by_status)
+        self.assertEqual(stats["total_patients"], by_role.get("patient", 0))
+
+        self.cursor.execute("UPDATE users SET status='inactive' WHERE username='test_admin_stats1'")
+        self.conn.commit()
+        inactive = AdminDAO.get_statistics()["users_by_status"].get("inactive", 0)
+        self.assertEqual(inactive, stats["users_by_status"].get("inactive", 0) + 1)
+
+        self.cursor.execute("DELETE FROM users WHERE username='test_admin_stats1'")
+        self.conn.commit()
+        self.assertEqual(AdminDAO.get_statistics()["total_users"], stats["total_users"] - 1)
+
     def test_add_doctor_success(self):
         success, msg = AdminDAO.add_doctor(
             "Test Admin Doctor",
@@ -0,0 +1,680 @@
+import unittest
+import psycopg2
+import psycopg2.errors
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from database import availability_index, idempotency
+from dao.appointment_dao import AppointmentDAO, SLOT_TAKEN, PATIENT_BUSY, TOO_FAR_AHEAD
+from dao.admin_dao import AdminDAO
+from dao.doctor_dao import DoctorDAO
+from dao.notification_dao import NotificationDAO
+from dao.waitlist_dao import WaitlistDAO
+from database.db import ReplicaConnection, connection_kwargs, get_connection
+from database.partitions import booking_horizon
+
+
+class BookingFixture:
+    """Two doctors of one specialty, each with 10:00 open in 30 days, and eight patients."""
+
+    def setUp(self):
+        self.conn = get_connection()
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("DELETE FROM users WHERE username LIKE 'test_appt_%'")
+        self.cursor.execute("DELETE FROM specialties WHERE name = 'test_appt_specialty'")
+
+        self.day = (date.today() + timedelta(days=30)).strftime("%Y-%m-%d")
+        self.doctors = [self.add_user(f"test_appt_doc{i}", "doctor") for i in range(2)]
+        self.patients = [self.add_user(f"test_appt_pat{i}", "patient") for i in range(8)]
+        self.cursor.execute("INSERT INTO specialties (name) VALUES ('test_appt_specialty') RETURNING id")
+        self.specialty_id = self.cursor.fetchone()[0]
+        for doctor_id in self.doctors:
+            self.cursor.execute(
+                "INSERT INTO doctor_specialties (doctor_id, specialty_id) VALUES (%s, %s)",
+                (doctor_id, self.specialty_id)
+            )
+            self.cursor.execute(
+                "INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status) VALUES (%s, %s, 10, 'available')",
+                (doctor_id, self.day)
+            )
+        self.conn.commit()
+
+    def tearDown(self):
+        self.cursor.execute("DELETE FROM users WHERE username LIKE 'test_appt_%'")
+        self.cursor.execute("DELETE FROM specialties WHERE name = 'test_appt_specialty'")
+        self.conn.commit()
+        self.cursor.close()
+        self.conn.close()
+
+    def add_user(self, username, role):
+        self.cursor.execute(
+            "INSERT INTO users (name, username, password, role) VALUES (%s, %s, '1234', %s) RETURNING id",
+            (username, username, role)
+        )
+        return self.cursor.fetchone()[0]
+
+    def scheduled_count(self, doctor_id):
+        self.cursor.execute(
+            "SELECT COUNT(*) FROM appointments WHERE doctor_id=%s AND status='scheduled'", (doctor_id,)
+        )
+        count = self.cursor.fetchone()[0]
+        self.conn.commit()
+        return count
+
+
+class TestBooking(BookingFixture, unittest.TestCase):
+
+    def test_booking_claims_the_slot(self):
+        success, _ = AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00")
+        self.assertTrue(success)
+
+        self.cursor.execute("SELECT status FROM time_slots WHERE doctor_id=%s", (self.doctors[0],))
+        self.assertEqual(self.cursor.fetchone()[0], "booked")
+
+        self.assertEqual(
+            AppointmentDAO.create_appointment(self.patients[1], self.doctors[0], self.day, "10:00"),
+            (False, SLOT_TAKEN)
+        )
+
+    def test_patient_cannot_book_two_doctors_at_once(self):
+        self.assertTrue(AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00")[0])
+        self.assertEqual(
+            AppointmentDAO.create_appointment(self.patients[0], self.doctors[1], self.day, "10:00"),
+            (False, PATIENT_BUSY)
+        )
+
+    def test_no_slot_no_booking(self):
+        self.assertEqual(
+            AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "11:00"),
+            (False, SLOT_TAKEN)
+        )
+
+    def test_no_booking_past_the_horizon(self):
+        last = booking_horizon()
+        past = last + timedelta(days=1)
+        for day in (last, past):
+            self.cursor.execute(
+                "INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status) VALUES (%s, %s, 10, 'available')",
+                (self.doctors[0], day)
+            )
+        self.conn.commit()
+
+        # Its partition may not exist yet: nothing is offered nor booked
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctors[0], past), [])
+        self.assertEqual(AppointmentDAO.get_free_hours_by_specialty(self.specialty_id, past), [])
+        past = past.strftime("%Y-%m-%d")
+        self.assertEqual(AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], past, "10:00"),
+                         (False, TOO_FAR_AHEAD))
+        self.assertEqual(AppointmentDAO.book_first_available(self.patients[0], self.specialty_id, past, "10:00"),
+                         (False, TOO_FAR_AHEAD))
+
+        last = last.strftime("%Y-%m-%d")
+        self.assertTrue(AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], last, "10:00")[0])
+        appointment_id = AppointmentDAO.get_patient_appointments(self.patients[0])[0]["id"]
+        self.assertEqual(AppointmentDAO.modify_appointment(appointment_id, self.doctors[0], past, "10:00"),
+                         (False, TOO_FAR_AHEAD))
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 1)
+
+    def test_concurrent_bookings_of_one_slot(self):
+        with ThreadPoolExecutor(max_workers=len(self.patients)) as executor:
+            results = list(executor.map(
+                lambda patient_id: AppointmentDAO.create_appointment(patient_id, self.doctors[0], self.day, "10:00"),
+                self.patients
+            ))
+
+        self.assertEqual(sum(success for success, _ in results), 1)
+        self.assertTrue(all(msg == SLOT_TAKEN for success, msg in results if not success))
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 1)
+
+    def test_first_available_spreads_concurrent_bookers(self):
+        with ThreadPoolExecutor(max_workers=len(self.patients)) as executor:
+            results = list(executor.map(
+                lambda patient_id: AppointmentDAO.book_first_available(
+                    patient_id, self.specialty_id, self.day, "10:00"
+                ),
+                self.patients
+            ))
+
+        booked = [name for success, name in results if success]
+        self.assertEqual(sorted(booked), ["test_appt_doc0", "test_appt_doc1"])
+        self.assertTrue(all(msg == SLOT_TAKEN for success, msg in results if not success))
+        for doctor_id in self.doctors:
+            self.assertEqual(self.scheduled_count(doctor_id), 1)
+
+    def test_first_available_spreads_bookers_over_rule_hours(self):
+        # Hours opened by a weekly rule have no time_slots row to lock
+        weekday = date.fromisoformat(self.day).isoweekday()
+        for doctor_id in self.doctors:
+            self.assertTrue(DoctorDAO.add_availability_rule(doctor_id, weekday, 14, 15)[0])
+
+        with ThreadPoolExecutor(max_workers=len(self.patients)) as executor:
+            results = list(executor.map(
+                lambda patient_id: AppointmentDAO.book_first_available(
+                    patient_id, self.specialty_id, self.day, "14:00"
+                ),
+                self.patients
+            ))
+
+        booked = [name for success, name in results if success]
+        self.assertEqual(sorted(booked), ["test_appt_doc0", "test_appt_doc1"])
+        for doctor_id in self.doctors:
+            self.assertEqual(self.scheduled_count(doctor_id), 1)
+
+    def test_free_hours_count_free_doctors(self):
+        self.assertEqual(
+            AppointmentDAO.get_free_hours_by_specialty(self.specialty_id, self.day),
+            [{"time": "10:00", "doctor_count": 2}]
+        )
+        AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00")
+        self.assertEqual(
+            AppointmentDAO.get_free_hours_by_specialty(self.specialty_id, self.day),
+            [{"time": "10:00", "doctor_count": 1}]
+        )
+
+
+    def test_replayed_booking_returns_first_result(self):
+        key = idempotency.new_key()
+        first = AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00",
+                                                  idempotency_key=key)
+        self.assertTrue(first[0])
+        self.assertEqual(
+            AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00",
+                                              idempotency_key=key),
+            first
+        )
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 1)
+
+    def test_concurrent_duplicate_submits(self):
+        key = idempotency.new_key()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(
+                lambda _: AppointmentDAO.book_first_available(
+                    self.patients[0], self.specialty_id, self.day, "10:00", idempotency_key=key
+                ),
+                range(4)
+            ))
+
+        self.assertTrue(results[0][0])
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(sum(self.scheduled_count(doctor_id) for doctor_id in self.doctors), 1)
+
+    def test_replayed_cancel_does_not_free_a_rebooked_slot(self):
+        AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00")
+        appointment_id = AppointmentDAO.get_patient_appointments(self.patients[0])[0]["id"]
+        key = idempotency.new_key()
+        self.assertTrue(AppointmentDAO.cancel_appointment(appointment_id, self.patients[0], idempotency_key=key)[0])
+        self.assertTrue(AppointmentDAO.create_appointment(self.patients[1], self.doctors[0], self.day, "10:00")[0])
+
+        self.assertTrue(AppointmentDAO.cancel_appointment(appointment_id, self.patients[0], idempotency_key=key)[0])
+        self.cursor.execute("SELECT status FROM time_slots WHERE doctor_id=%s", (self.doctors[0],))
+        self.assertEqual(self.cursor.fetchone()[0], "booked")
+
+    def test_key_reused_for_another_action(self):
+        key = idempotency.new_key()
+        AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00", idempotency_key=key)
+        appointment_id = AppointmentDAO.get_patient_appointments(self.patients[0])[0]["id"]
+        self.assertEqual(
+            AppointmentDAO.cancel_appointment(appointment_id, self.patients[0], idempotency_key=key),
+            (False, idempotency.KEY_REUSED)
+        )
+
+
+class TestAvailabilityIndex(BookingFixture, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        availability_index.clear()
+
+    def open_hour_behind_the_index(self, doctor_id, hour):
+        # Written without a DAO, as another process would: the index is not told
+        self.cursor.execute(
+            "INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status) VALUES (%s, %s, %s, 'available')",
+            (doctor_id, self.day, hour)
+        )
+        self.conn.commit()
+
+    def free_hours(self):
+        return [s["time"] for s in AppointmentDAO.get_free_hours_by_specialty(self.specialty_id, self.day)]
+
+    def test_lists_are_served_from_the_index(self):
+        self.assertEqual(self.free_hours(), ["10:00"])
+        self.open_hour_behind_the_index(self.doctors[0], 11)
+        self.assertEqual(self.free_hours(), ["10:00"])
+
+        availability_index.clear()
+        self.assertEqual(self.free_hours(), ["10:00", "11:00"])
+
+    def test_booking_and_cancelling_invalidate_the_day(self):
+        slots = AppointmentDAO.get_available_slots_by_specialty(self.specialty_id, self.day)
+        self.assertEqual(len(slots), 2)
+        self.open_hour_behind_the_index(self.doctors[0], 11)
+
+        AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00")
+        slots = AppointmentDAO.get_available_slots_by_specialty(self.specialty_id, self.day)
+        self.assertEqual([(s["time"], s["doctor_id"]) for s in slots],
+                         [("10:00", self.doctors[1]), ("11:00", self.doctors[0])])
+
+        appointment_id = AppointmentDAO.get_patient_appointments(self.patients[0])[0]["id"]
+        AppointmentDAO.cancel_appointment_by_doctor(appointment_id)
+        self.assertEqual(len(AppointmentDAO.get_available_slots_by_specialty(self.specialty_id, self.day)), 3)
+
+    def test_patient_cancel_invalidates_the_day(self):
+        AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00")
+        self.assertEqual(
+            AppointmentDAO.get_free_hours_by_specialty(self.specialty_id, self.day),
+            [{"time": "10:00", "doctor_count": 1}]
+        )
+        appointment_id = AppointmentDAO.get_patient_appointments(self.patients[0])[0]["id"]
+        AppointmentDAO.cancel_appointment(appointment_id, self.patients[0])
+        self.assertEqual(
+            AppointmentDAO.get_free_hours_by_specialty(self.specialty_id, self.day),
+            [{"time": "10:00", "doctor_count": 2}]
+        )
+
+    def test_toggle_invalidates_only_that_day(self):
+        other_day = (date.today() + timedelta(days=31)).strftime("%Y-%m-%d")
+        self.assertEqual(self.free_hours(), ["10:00"])
+        self.assertEqual(AppointmentDAO.get_free_hours_by_specialty(self.specialty_id, other_day), [])
+        self.open_hour_behind_the_index(self.doctors[1], 12)
+
+        self.assertEqual(DoctorDAO.toggle_doctor_slot(self.doctors[0], self.day, 11), "added")
+        self.assertEqual(self.free_hours(), ["10:00", "11:00", "12:00"])
+        self.assertEqual(AppointmentDAO.get_free_hours_by_specialty(self.specialty_id, other_day), [])
+
+    def test_read_racing_a_write_is_not_stored(self):
+        started = availability_index.read_started()
+        stale = AppointmentDAO.get_free_hours_by_specialty(self.specialty_id, self.day)
+        AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00")
+
+        availability_index.store("free_hours", self.specialty_id, self.day, stale, started, self.conn)
+        self.assertIsNone(availability_index.get("free_hours", self.specialty_id, self.day))
+
+    def test_replica_reads_are_not_stored(self):
+        # A replica may still show the hours of an invalidated day
+        other_day = (date.today() + timedelta(days=31)).strftime("%Y-%m-%d")
+        started = availability_index.read_started()
+        hours = AppointmentDAO.get_free_hours_by_specialty(self.specialty_id, self.day)
+        replica = psycopg2.connect(connection_factory=ReplicaConnection, **connection_kwargs())
+
+        availability_index.store("free_hours", self.specialty_id, other_day, hours, started, replica)
+        self.assertIsNone(availability_index.get("free_hours", self.specialty_id, other_day))
+        availability_index.store("free_hours", self.specialty_id, other_day, hours, started, self.conn)
+        self.assertEqual(availability_index.get("free_hours", self.specialty_id, other_day), hours)
+        replica.close()
+
+
+class TestNextSlots(BookingFixture, unittest.TestCase):
+
+    def open_hour(self, doctor_id, day, hour):
+        self.cursor.execute(
+            "INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status) VALUES (%s, %s, %s, 'available')",
+            (doctor_id, day, hour)
+        )
+        self.conn.commit()
+
+    def test_earliest_slots_of_a_doctor(self):
+        next_day = (date.today() + timedelta(days=31)).strftime("%Y-%m-%d")
+        self.open_hour(self.doctors[0], next_day, 9)
+        self.open_hour(self.doctors[0], self.day, 15)
+        # The current hour has already started: it is not offered
+        now = datetime.now()
+        self.open_hour(self.doctors[0], now.date(), now.hour)
+
+        slots = AppointmentDAO.get_next_slots_for_doctor(self.doctors[0])
+        self.assertEqual([(s["date"], s["time"]) for s in slots],
+                         [(self.day, "10:00"), (self.day, "15:00"), (next_day, "09:00")])
+        self.assertEqual(len(AppointmentDAO.get_next_slots_for_doctor(self.doctors[0], limit=1)), 1)
+        self.assertEqual(AppointmentDAO.get_next_slots_for_doctor(self.doctors[0], days=29), [])
+
+    def test_booked_hours_are_skipped(self):
+        AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00")
+        self.assertEqual(AppointmentDAO.get_next_slots_for_doctor(self.doctors[0]), [])
+        self.assertEqual(AppointmentDAO.get_next_slots_by_specialty(self.specialty_id),
+                         [{"date": self.day, "time": "10:00", "doctor_count": 1}])
+
+    def test_specialty_search_stops_at_the_limit(self):
+        for offset in (31, 32):
+            day = (date.today() + timedelta(days=offset)).strftime("%Y-%m-%d")
+            self.open_hour(self.doctors[1], day, 8)
+
+        slots = AppointmentDAO.get_next_slots_by_specialty(self.specialty_id, limit=2)
+        self.assertEqual([(s["time"], s["doctor_count"]) for s in slots], [("10:00", 2), ("08:00", 1)])
+
+
+class TestMonthFreeSlots(BookingFixture, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        availability_index.clear()
+        # The day after the fixture's, or the day before when that leaves the month
+        day = date.fromisoformat(self.day)
+        other = day + timedelta(days=1)
+        if other.month != day.month:
+            other = day - timedelta(days=1)
+        self.other_day = other.strftime("%Y-%m-%d")
+        for hour in (9, 11):
+            self.cursor.execute(
+                "INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status) VALUES (%s, %s, %s, 'available')",
+                (self.doctors[0], self.other_day, hour)
+            )
+        self.conn.commit()
+
+    def counts(self, days):
+        return sorted((d["date"], d["free_slots"]) for d in days)
+
+    def test_free_slots_per_day(self):
+        self.assertEqual(self.counts(AppointmentDAO.get_month_free_slots_for_doctor(self.doctors[0], self.day)),
+                         sorted([(self.day, 1), (self.other_day, 2)]))
+        self.assertEqual(self.counts(AppointmentDAO.get_month_free_slots_by_specialty(self.specialty_id, self.day)),
+                         sorted([(self.day, 2), (self.other_day, 2)]))
+        last_month = date.today().replace(day=1) - timedelta(days=1)
+        self.assertEqual(AppointmentDAO.get_month_free_slots_for_doctor(self.doctors[0], last_month), [])
+
+    def test_booking_invalidates_the_month(self):
+        by_doctor = AppointmentDAO.get_month_free_slots_for_doctor(self.doctors[1], self.day)
+        self.assertEqual(by_doctor, [{"date": self.day, "free_slots": 1}])
+        AppointmentDAO.get_month_free_slots_by_specialty(self.specialty_id, self.day)
+        # Written behind the index: the stored heatmap is still served
+        self.cursor.execute(
+            "INSERT INTO time_slots (doctor_id, slot_date, slot_hour, status) VALUES (%s, %s, 15, 'available')",
+            (self.doctors[1], self.other_day)
+        )
+        self.conn.commit()
+        self.assertEqual(AppointmentDAO.get_month_free_slots_for_doctor(self.doctors[1], self.day), by_doctor)
+
+        AppointmentDAO.create_appointment(self.patients[0], self.doctors[1], self.day, "10:00")
+        self.assertEqual(AppointmentDAO.get_month_free_slots_for_doctor(self.doctors[1], self.day),
+                         [{"date": self.other_day, "free_slots": 1}])
+        self.assertEqual(self.counts(AppointmentDAO.get_month_free_slots_by_specialty(self.specialty_id, self.day)),
+                         sorted([(self.day, 1), (self.other_day, 3)]))
+
+
+class TestReschedule(BookingFixture, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.assertTrue(AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00")[0])
+        self.appointment_id = AppointmentDAO.get_patient_appointments(self.patients[0])[0]["id"]
+
+    def slot_status(self, doctor_id, day, hour):
+        self.cursor.execute(
+            "SELECT status FROM time_slots WHERE doctor_id=%s AND slot_date=%s AND slot_hour=%s",
+            (doctor_id, day, hour)
+        )
+        row = self.cursor.fetchone()
+        self.conn.commit()
+        return row[0] if row else None
+
+    def test_reschedule_moves_the_slot(self):
+        success, _ = AppointmentDAO.modify_appointment(self.appointment_id, self.doctors[1], self.day, "10:00",
+                                                       urgent=True, patient_id=self.patients[0])
+        self.assertTrue(success)
+
+        self.assertEqual(self.slot_status(self.doctors[0], self.day, 10), "available")
+        self.assertEqual(self.slot_status(self.doctors[1], self.day, 10), "booked")
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 0)
+        appointment = AppointmentDAO.get_patient_appointments(self.patients[0])[0]
+        self.assertEqual((appointment["id"], appointment["urgent"]), (self.appointment_id, True))
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctors[0], self.day), ["10:00"])
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctors[1], self.day), [])
+
+    def test_reschedule_to_another_month(self):
+        # Moves the row to another appointments partition
+        day = date.fromisoformat(self.day)
+        next_month = ((day.replace(day=1) + timedelta(days=32)).replace(day=1)).strftime("%Y-%m-%d")
+        DoctorDAO.toggle_doctor_slot(self.doctors[0], next_month, 9)
+
+        self.assertTrue(AppointmentDAO.modify_appointment(self.appointment_id, self.doctors[0], next_month, "09:00")[0])
+        self.assertEqual(AppointmentDAO.get_patient_appointments(self.patients[0])[0]["date"], next_month)
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctors[0], next_month), [])
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctors[0], self.day), ["10:00"])
+
+    def test_refused_reschedules_leave_the_appointment(self):
+        AppointmentDAO.create_appointment(self.patients[1], self.doctors[1], self.day, "10:00")
+        self.assertEqual(AppointmentDAO.modify_appointment(self.appointment_id, self.doctors[1], self.day, "10:00"),
+                         (False, SLOT_TAKEN))
+        self.assertEqual(AppointmentDAO.modify_appointment(self.appointment_id, self.doctors[1], self.day, "11:00"),
+                         (False, SLOT_TAKEN))
+
+        other_day = (date.today() + timedelta(days=31)).strftime("%Y-%m-%d")
+        for doctor_id in self.doctors:
+            DoctorDAO.toggle_doctor_slot(doctor_id, other_day, 10)
+        AppointmentDAO.create_appointment(self.patients[0], self.doctors[1], other_day, "10:00")
+        self.assertEqual(AppointmentDAO.modify_appointment(self.appointment_id, self.doctors[0], other_day, "10:00"),
+                         (False, PATIENT_BUSY))
+        self.assertFalse(AppointmentDAO.modify_appointment(self.appointment_id, self.doctors[0], other_day, "10:00",
+                                                           patient_id=self.patients[1])[0])
+
+        self.assertEqual(self.slot_status(self.doctors[0], self.day, 10), "booked")
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 1)
+
+    def test_freed_slot_goes_to_the_waitlist(self):
+        WaitlistDAO.join_waitlist(self.patients[1], self.day, self.day, doctor_id=self.doctors[0])
+        self.assertTrue(AppointmentDAO.modify_appointment(self.appointment_id, self.doctors[1], self.day, "10:00")[0])
+        self.assertEqual(WaitlistDAO.get_patient_waitlist(self.patients[1])[0]["status"], "assigned")
+        self.assertEqual(self.slot_status(self.doctors[0], self.day, 10), "booked")
+
+    def test_concurrent_reschedules_into_one_slot(self):
+        appointment_ids = []
+        for hour, patient_id in enumerate(self.patients[1:], start=11):
+            DoctorDAO.toggle_doctor_slot(self.doctors[0], self.day, hour)
+            AppointmentDAO.create_appointment(patient_id, self.doctors[0], self.day, f"{hour}:00")
+            appointment_ids.append(AppointmentDAO.get_patient_appointments(patient_id)[0]["id"])
+
+        with ThreadPoolExecutor(max_workers=len(appointment_ids)) as executor:
+            results = list(executor.map(
+                lambda appointment_id: AppointmentDAO.modify_appointment(
+                    appointment_id, self.doctors[1], self.day, "10:00"
+                ),
+                appointment_ids
+            ))
+
+        self.assertEqual(sum(success for success, _ in results), 1)
+        self.assertTrue(all(msg == SLOT_TAKEN for success, msg in results if not success))
+        self.assertEqual(self.scheduled_count(self.doctors[1]), 1)
+        self.assertEqual(self.scheduled_count(self.doctors[0]), len(appointment_ids))
+
+    def test_replayed_reschedule_returns_first_result(self):
+        AppointmentDAO.create_appointment(self.patients[1], self.doctors[1], self.day, "10:00")
+        key = idempotency.new_key()
+        first = AppointmentDAO.modify_appointment(self.appointment_id, self.doctors[1], self.day, "10:00",
+                                                  patient_id=self.patients[0], idempotency_key=key)
+        self.assertEqual(first, (False, SLOT_TAKEN))
+
+        other_id = AppointmentDAO.get_patient_appointments(self.patients[1])[0]["id"]
+        AppointmentDAO.cancel_appointment(other_id, self.patients[1])
+        replay = AppointmentDAO.modify_appointment(self.appointment_id, self.doctors[1], self.day, "10:00",
+                                                   patient_id=self.patients[0], idempotency_key=key)
+        self.assertEqual(replay, first)
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 1)
+
+    def test_cancelled_appointment_is_not_cancelled_again(self):
+        self.assertTrue(AppointmentDAO.cancel_appointment(self.appointment_id, self.patients[0])[0])
+        self.assertTrue(AppointmentDAO.create_appointment(self.patients[1], self.doctors[0], self.day, "10:00")[0])
+
+        self.assertFalse(AppointmentDAO.cancel_appointment(self.appointment_id, self.patients[0])[0])
+        self.assertFalse(AppointmentDAO.cancel_appointment_by_doctor(self.appointment_id)[0])
+        self.assertEqual(self.slot_status(self.doctors[0], self.day, 10), "booked")
+        self.assertEqual(AppointmentDAO.get_patient_appointments(self.patients[0])[0]["status"], "canceled")
+
+    def test_cancel_racing_a_reschedule_releases_the_new_slot(self):
+        lock_waiters = get_connection()
+        lock_waiters.autocommit = True
+
+        def wait_for_lock_waiters(count):
+            with lock_waiters.cursor() as cursor:
+                while True:
+                    cursor.execute("""
+                        SELECT COUNT(*) FROM pg_stat_activity
+                        WHERE datname = current_database() AND wait_event_type = 'Lock'
+                    """)
+                    if cursor.fetchone()[0] >= count:
+                        return
+
+        # The appointment is held while the reschedule, then the cancel, queue behind
+        self.cursor.execute("SELECT 1 FROM appointments WHERE id=%s FOR UPDATE", (self.appointment_id,))
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            rescheduled = executor.submit(AppointmentDAO.modify_appointment,
+                                          self.appointment_id, self.doctors[1], self.day, "10:00")
+            wait_for_lock_waiters(1)
+            canceled = executor.submit(AppointmentDAO.cancel_appointment, self.appointment_id, self.patients[0])
+            wait_for_lock_waiters(2)
+            self.conn.commit()
+            self.assertTrue(rescheduled.result()[0])
+            self.assertTrue(canceled.result()[0])
+        lock_waiters.close()
+
+        self.assertEqual(self.scheduled_count(self.doctors[0]) + self.scheduled_count(self.doctors[1]), 0)
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctors[0], self.day), ["10:00"])
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctors[1], self.day), ["10:00"])
+
+
+class TestBulkCancellation(BookingFixture, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.next_day = (date.today() + timedelta(days=31)).strftime("%Y-%m-%d")
+        self.later_day = (date.today() + timedelta(days=40)).strftime("%Y-%m-%d")
+        for day in (self.next_day, self.later_day):
+            DoctorDAO.toggle_doctor_slot(self.doctors[0], day, 10)
+        for patient_id, day in zip(self.patients, (self.day, self.next_day, self.later_day)):
+            self.assertTrue(AppointmentDAO.create_appointment(patient_id, self.doctors[0], day, "10:00")[0])
+        self.assertTrue(AppointmentDAO.create_appointment(self.patients[3], self.doctors[1], self.day, "10:00")[0])
+
+    def slot_statuses(self, doctor_id):
+        self.cursor.execute(
+            "SELECT slot_date::text, status FROM time_slots WHERE doctor_id=%s ORDER BY slot_date", (doctor_id,)
+        )
+        rows = self.cursor.fetchall()
+        self.conn.commit()
+        return rows
+
+    def test_absence_cancels_the_period(self):
+        yesterday = date.today() - timedelta(days=1)
+        self.assertEqual(AppointmentDAO.cancel_doctor_appointments(self.doctors[0], yesterday, self.next_day), (True, 2))
+
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 1)
+        self.assertEqual(self.scheduled_count(self.doctors[1]), 1)
+        self.assertEqual(self.slot_statuses(self.doctors[0]),
+                         [(self.day, "unavailable"), (self.next_day, "unavailable"), (self.later_day, "booked")])
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctors[0], self.day), [])
+        self.assertEqual(AppointmentDAO.get_patient_appointments(self.patients[0])[0]["status"], "canceled_by_doctor")
+
+        notifications = NotificationDAO.get_unread_notifications(self.patients[1])
+        self.assertEqual([(n["kind"], n["doctor_name"], n["appointment_date"].strftime("%Y-%m-%d"))
+                          for n in notifications], [("doctor_absence", "test_appt_doc0", self.next_day)])
+        self.assertEqual(NotificationDAO.get_unread_notifications(self.patients[2]), [])
+
+    def test_exception_can_cancel_its_appointments(self):
+        success, _ = DoctorDAO.add_availability_exception(self.doctors[0], self.next_day, self.later_day,
+                                                          cancel_appointments=True)
+        self.assertTrue(success)
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 1)
+        self.assertEqual(len(NotificationDAO.get_unread_notifications(self.patients[2])), 1)
+
+        self.assertTrue(DoctorDAO.add_availability_exception(self.doctors[1], self.day, self.day)[0])
+        self.assertEqual(self.scheduled_count(self.doctors[1]), 1)
+
+    def test_deactivation_cancels_upcoming_appointments(self):
+        self.assertTrue(AdminDAO.deactivate_doctor(self.doctors[0])[0])
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 0)
+        self.assertEqual(self.scheduled_count(self.doctors[1]), 1)
+
+        notifications = NotificationDAO.get_unread_notifications(self.patients[0])
+        self.assertEqual([n["kind"] for n in notifications], ["doctor_deactivated"])
+        self.assertEqual(NotificationDAO.mark_notifications_read(self.patients[0]), 1)
+        self.assertEqual(NotificationDAO.get_unread_notifications(self.patients[0]), [])
+
+    def test_user_list_deactivation_cancels_upcoming_appointments(self):
+        # The "Désactiver" buttons of both dashboards go through toggle_user_status
+        self.assertTrue(AdminDAO.toggle_user_status(self.patients[3], "active")[0])
+        self.assertEqual(self.scheduled_count(self.doctors[1]), 1)
+
+        self.assertTrue(AdminDAO.toggle_user_status(self.doctors[0], "active")[0])
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 0)
+        self.assertEqual([n["kind"] for n in NotificationDAO.get_unread_notifications(self.patients[1])],
+                         ["doctor_deactivated"])
+
+        # Reactivating does not bring the canceled appointments back
+        self.assertTrue(AdminDAO.toggle_user_status(self.doctors[0], "inactive")[0])
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 0)
+
+
+class TestShortAppointments(BookingFixture, unittest.TestCase):
+
+    def book(self, patient_id, time, minutes, doctor_id=None):
+        return AppointmentDAO.create_appointment(patient_id, doctor_id or self.doctors[0], self.day, time,
+                                                 duration_minutes=minutes)
+
+    def free_periods(self, minutes):
+        return AppointmentDAO.get_free_periods_for_doctor(self.doctors[0], self.day, minutes)
+
+    def test_short_appointments_share_the_hour(self):
+        self.assertEqual(self.free_periods(30), ["10:00", "10:30"])
+        self.assertTrue(self.book(self.patients[0], "10:00", 30)[0])
+
+        # The hour is started: no hour-long booking, its other half still free
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctors[0], self.day), [])
+        self.assertEqual(self.free_periods(15), ["10:30", "10:45"])
+        self.assertEqual(self.free_periods(30), ["10:30"])
+        self.assertEqual(AppointmentDAO.create_appointment(self.patients[1], self.doctors[0], self.day, "10:00"),
+                         (False, SLOT_TAKEN))
+
+        self.assertTrue(self.book(self.patients[1], "10:30", 30)[0])
+        self.assertEqual(self.free_periods(15), [])
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 2)
+
+    def test_overlapping_periods_are_refused(self):
+        self.assertTrue(self.book(self.patients[0], "10:00", 30)[0])
+        self.assertEqual(self.book(self.patients[1], "10:15", 30), (False, SLOT_TAKEN))
+        self.assertEqual(self.book(self.patients[0], "10:00", 15, doctor_id=self.doctors[1]), (False, PATIENT_BUSY))
+        self.assertFalse(self.book(self.patients[1], "10:45", 30)[0])
+
+        # The exclusion constraint holds even without the free period check
+        self.cursor.execute("""
+            INSERT INTO appointments (patient_id, doctor_id, appointment_date, duration_minutes, status)
+            VALUES (%s, %s, %s, 20, 'scheduled')
+        """, (self.patients[2], self.doctors[0], f"{self.day} 10:30"))
+        self.conn.commit()
+        with self.assertRaises(psycopg2.errors.ExclusionViolation):
+            self.cursor.execute("""
+                INSERT INTO appointments (patient_id, doctor_id, appointment_date, duration_minutes, status)
+                VALUES (%s, %s, %s, 15, 'scheduled')
+            """, (self.patients[3], self.doctors[0], f"{self.day} 10:45"))
+        self.conn.rollback()
+
+    def test_absence_closes_the_started_hour(self):
+        self.assertTrue(self.book(self.patients[0], "10:00", 15)[0])
+        self.assertTrue(DoctorDAO.add_availability_exception(self.doctors[0], self.day, self.day)[0])
+
+        # The kept appointment does not reopen the rest of its hour
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctors[0], self.day), [])
+        self.assertEqual(self.free_periods(15), [])
+        self.assertFalse(self.book(self.patients[1], "10:15", 15)[0])
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 1)
+
+    def test_concurrent_bookings_of_one_period(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda p: self.book(p, "10:15", 15), self.patients[:4]))
+        self.assertEqual(sum(1 for success, _ in results if success), 1)
+        self.assertEqual(self.scheduled_count(self.doctors[0]), 1)
+
+    def test_cancelling_one_keeps_the_hour_booked(self):
+        self.assertTrue(self.book(self.patients[0], "10:00", 30)[0])
+        self.assertTrue(self.book(self.patients[1], "10:30", 30)[0])
+        first_id = AppointmentDAO.get_patient_appointments(self.patients[0])[0]["id"]
+        self.assertTrue(AppointmentDAO.cancel_appointment(first_id, self.patients[0])[0])
+
+        self.assertEqual(self.free_periods(30), ["10:00"])
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctors[0], self.day), [])
+        self.cursor.execute("SELECT status FROM time_slots WHERE doctor_id=%s", (self.doctors[0],))
+        self.assertEqual(self.cursor.fetchone()[0], "booked")
+        self.conn.commit()
+
+        second_id = AppointmentDAO.get_patient_appointments(self.patients[1])[0]["id"]
+        self.assertTrue(AppointmentDAO.cancel_appointment(second_id, self.patients[1])[0])
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctors[0], self.day), ["10:00"])
+        self.assertEqual(self.free_periods(30), ["10:00", "10:30"])
+
+
+if __name__ == "__main__":
+    unittest.main()
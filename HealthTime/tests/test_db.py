@@ -1,5 +1,8 @@
 import unittest
-from database.db import get_connection
+from config import settings
+from database.db import get_connection, pooled_connection, ConnectionPool, connection_kwargs, UnitOfWork
+from database.db import DbSession, bind_db_session, unbind_db_session, choose_replica, get_replica_router
+from dao.user_dao import UserDAO
 
 class TestDatabaseConnection(unittest.TestCase):
 
@@ -8,5 +11,132 @@ class TestDatabaseConnection(unittest.TestCase):
         self.assertIsNotNone(conn, "Database connection should not be None")
         conn.close()
 
+    def test_pooled_connection_success(self):
+        with pooled_connection() as conn:
+            self.assertIsNotNone(conn, "Pooled connection should not be None")
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.close()
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool(1, 2, timeout=0.1, **connection_kwargs())
+
+    def tearDown(self):
+        self.pool.closeall()
+
+    def test_connection_is_reused(self):
+        conn = self.pool.getconn()
+        self.pool.putconn(conn)
+        self.assertIs(self.pool.getconn(), conn)
+
+    def test_uncommitted_work_is_rolled_back(self):
+        conn = self.pool.getconn()
+        conn.cursor().execute("SELECT 1")
+        self.pool.putconn(conn)
+        conn = self.pool.getconn()
+        self.assertEqual(conn.info.transaction_status, 0)
+        self.pool.putconn(conn)
+
+    def test_broken_connection_is_replaced(self):
+        conn = self.pool.getconn()
+        conn.close()
+        self.pool.putconn(conn)
+        new_conn = self.pool.getconn()
+        self.assertFalse(new_conn.closed)
+        self.pool.putconn(new_conn)
+
+    def test_exhausted_pool_raises(self):
+        first = self.pool.getconn()
+        second = self.pool.getconn()
+        with self.assertRaises(Exception):
+            self.pool.getconn()
+        self.pool.putconn(first)
+        self.pool.putconn(second)
+
+class TestUnitOfWork(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = get_connection()
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("DELETE FROM users WHERE username LIKE 'test_uow_%'")
+        self.conn.commit()
+
+    def tearDown(self):
+        self.cursor.close()
+        self.conn.close()
+
+    def test_dao_calls_share_one_checkout(self):
+        with UnitOfWork(snapshot=True) as unit_of_work:
+            UserDAO.get_all_specialties()
+            UserDAO.search_doctors_by_specialty(1)
+            UserDAO.search_doctors_by_name("x")
+        self.assertEqual(unit_of_work.checkouts, 1)
+
+    def test_no_checkout_without_dao_call(self):
+        with UnitOfWork() as unit_of_work:
+            pass
+        self.assertEqual(unit_of_work.checkouts, 0)
+
+    def test_transactional_commits_at_end(self):
+        with UnitOfWork(transactional=True):
+            success, _ = UserDAO.register_user("Test UoW", "test_uow_1", "1234", "patient")
+            self.assertTrue(success)
+
+            self.cursor.execute("SELECT 1 FROM users WHERE username='test_uow_1'")
+            self.assertIsNone(self.cursor.fetchone())
+            self.conn.rollback()
+
+        self.cursor.execute("SELECT 1 FROM users WHERE username='test_uow_1'")
+        self.assertIsNotNone(self.cursor.fetchone())
+
+    def test_transactional_rolls_back_on_failure(self):
+        with UnitOfWork(transactional=True):
+            UserDAO.register_user("Test UoW", "test_uow_2", "1234", "patient")
+            success, _ = UserDAO.register_user("Test UoW", "test_uow_2", "1234", "patient")
+            self.assertFalse(success)
+
+        self.cursor.execute("SELECT 1 FROM users WHERE username='test_uow_2'")
+        self.assertIsNone(self.cursor.fetchone())
+
+class TestDbSession(unittest.TestCase):
+
+    def test_recently_wrote(self):
+        db_session = DbSession()
+        self.assertFalse(db_session.recently_wrote())
+        db_session.mark_write()
+        self.assertTrue(db_session.recently_wrote())
+        self.assertFalse(DbSession(last_write=0).recently_wrote())
+
+
+@unittest.skipUnless(settings.DB_REPLICA_URLS, "no replica configured (DB_REPLICA_URLS)")
+class TestReplicaRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.token = bind_db_session(DbSession())
+
+    def tearDown(self):
+        unbind_db_session(self.token)
+
+    def test_reads_use_replica(self):
+        self.assertIsNotNone(choose_replica())
+
+    def test_reads_after_write_use_primary(self):
+        with pooled_connection():
+            pass
+        self.assertIsNone(choose_replica())
+
+    def test_lagging_replica_is_skipped(self):
+        router = get_replica_router()
+        saved = list(router.lags)
+        try:
+            router.lags = [router.max_lag + 1] * len(router.lags)
+            self.assertIsNone(choose_replica())
+        finally:
+            router.lags = saved
+
 if __name__ == "__main__":
     unittest.main()
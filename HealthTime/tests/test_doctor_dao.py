@@ -0,0 +1,234 @@
+import unittest
+from datetime import date, timedelta
+from dao.appointment_dao import AppointmentDAO
+from dao.doctor_dao import DoctorDAO
+from database import day_masks
+from database.db import get_connection
+
+
+class TestCreateTimeSlots(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = get_connection()
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("DELETE FROM users WHERE username = 'test_slots_doc'")
+        self.cursor.execute(
+            "INSERT INTO users (name, username, password, role) VALUES ('test_slots_doc', 'test_slots_doc', '1234', 'doctor') RETURNING id"
+        )
+        self.doctor_id = self.cursor.fetchone()[0]
+        self.conn.commit()
+        self.day = date.today() + timedelta(days=30)
+
+    def tearDown(self):
+        self.cursor.execute("DELETE FROM users WHERE username = 'test_slots_doc'")
+        self.conn.commit()
+        self.cursor.close()
+        self.conn.close()
+
+    def slots(self):
+        self.cursor.execute(
+            "SELECT slot_date, slot_hour, status FROM time_slots WHERE doctor_id=%s ORDER BY 1, 2", (self.doctor_id,)
+        )
+        rows = self.cursor.fetchall()
+        self.conn.commit()
+        return rows
+
+    def test_creates_every_slot(self):
+        next_day = self.day + timedelta(days=1)
+        self.assertEqual(
+            DoctorDAO.create_time_slots(self.doctor_id, [(self.day, 9), (self.day, 10), (next_day.isoformat(), 9)]),
+            (3, 0)
+        )
+        self.assertEqual(self.slots(), [
+            (self.day, 9, "available"), (self.day, 10, "available"), (next_day, 9, "available")
+        ])
+
+    def test_existing_slots_are_skipped(self):
+        DoctorDAO.toggle_doctor_slot(self.doctor_id, self.day, 9)
+        self.cursor.execute("UPDATE time_slots SET status='booked' WHERE doctor_id=%s", (self.doctor_id,))
+        self.conn.commit()
+
+        self.assertEqual(DoctorDAO.create_time_slots(self.doctor_id, [(self.day, 9), (self.day, 10), (self.day, 10)]), (1, 1))
+        self.assertEqual(self.slots(), [(self.day, 9, "booked"), (self.day, 10, "available")])
+
+    def test_nothing_to_create(self):
+        self.assertEqual(DoctorDAO.create_time_slots(self.doctor_id, []), (0, 0))
+
+    def test_invalid_hour_creates_nothing(self):
+        self.assertIsNone(DoctorDAO.create_time_slots(self.doctor_id, [(self.day, 9), (self.day, 24)]))
+        self.assertEqual(self.slots(), [])
+
+
+class TestAvailabilityRules(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = get_connection()
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("DELETE FROM users WHERE username LIKE 'test_rules_%'")
+        self.cursor.execute(
+            "INSERT INTO users (name, username, password, role) VALUES ('test_rules_doc', 'test_rules_doc', '1234', 'doctor') RETURNING id"
+        )
+        self.doctor_id = self.cursor.fetchone()[0]
+        self.cursor.execute(
+            "INSERT INTO users (name, username, password, role) VALUES ('test_rules_pat', 'test_rules_pat', '1234', 'patient') RETURNING id"
+        )
+        self.patient_id = self.cursor.fetchone()[0]
+        self.conn.commit()
+        self.day = date.today() + timedelta(days=30)
+        success, _ = DoctorDAO.add_availability_rule(self.doctor_id, self.day.isoweekday(), 9, 12)
+        self.assertTrue(success)
+
+    def tearDown(self):
+        self.cursor.execute("DELETE FROM users WHERE username LIKE 'test_rules_%'")
+        self.conn.commit()
+        self.cursor.close()
+        self.conn.close()
+
+    def rows(self):
+        self.cursor.execute(
+            "SELECT slot_hour, status FROM time_slots WHERE doctor_id=%s ORDER BY 1", (self.doctor_id,)
+        )
+        rows = self.cursor.fetchall()
+        self.conn.commit()
+        return rows
+
+    def test_rule_hours_are_bookable_without_rows(self):
+        self.assertEqual(
+            AppointmentDAO.get_available_slots_for_doctor(self.doctor_id, self.day), ["09:00", "10:00", "11:00"]
+        )
+        success, _ = AppointmentDAO.create_appointment(self.patient_id, self.doctor_id, str(self.day), "10:00")
+        self.assertTrue(success)
+        self.assertEqual(self.rows(), [(10, "booked")])
+
+        success, _ = AppointmentDAO.create_appointment(self.patient_id, self.doctor_id, str(self.day), "12:00")
+        self.assertFalse(success)
+
+    def test_get_doctor_slots_expands_rules(self):
+        week_later = self.day + timedelta(days=7)
+        slots = DoctorDAO.get_doctor_slots(self.doctor_id, self.day, week_later)
+        self.assertEqual(
+            [(s["slot_date"], s["slot_hour"], s["status"]) for s in slots],
+            [(d, h, "available") for d in (self.day, week_later) for h in (9, 10, 11)]
+        )
+
+    def test_exception_closes_rule_hours(self):
+        success, _ = DoctorDAO.add_availability_exception(self.doctor_id, self.day, self.day, "Congés")
+        self.assertTrue(success)
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctor_id, self.day), [])
+
+        exception_id = DoctorDAO.get_availability_exceptions(self.doctor_id)[0]["id"]
+        self.assertTrue(DoctorDAO.delete_availability_exception(self.doctor_id, exception_id))
+        self.assertEqual(len(AppointmentDAO.get_available_slots_for_doctor(self.doctor_id, self.day)), 3)
+
+    def test_toggle_closes_and_reopens_a_rule_hour(self):
+        self.assertEqual(DoctorDAO.toggle_doctor_slot(self.doctor_id, self.day, 10), "removed")
+        self.assertEqual(self.rows(), [(10, "unavailable")])
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctor_id, self.day), ["09:00", "11:00"])
+
+        self.assertEqual(DoctorDAO.toggle_doctor_slot(self.doctor_id, self.day, 10), "added")
+        self.assertEqual(self.rows(), [])
+
+    def test_cancel_gives_the_rule_hour_back(self):
+        AppointmentDAO.create_appointment(self.patient_id, self.doctor_id, str(self.day), "10:00")
+        appointment_id = AppointmentDAO.get_patient_appointments(self.patient_id)[0]["id"]
+
+        success, _ = AppointmentDAO.cancel_appointment(appointment_id, self.patient_id)
+        self.assertTrue(success)
+        self.assertEqual(self.rows(), [])
+        self.assertIn("10:00", AppointmentDAO.get_available_slots_for_doctor(self.doctor_id, self.day))
+
+    def test_rules_belong_to_their_doctor(self):
+        rule_id = DoctorDAO.get_availability_rules(self.doctor_id)[0]["id"]
+        self.assertFalse(DoctorDAO.delete_availability_rule(self.patient_id, rule_id))
+        self.assertTrue(DoctorDAO.delete_availability_rule(self.doctor_id, rule_id))
+        self.assertEqual(AppointmentDAO.get_available_slots_for_doctor(self.doctor_id, self.day), [])
+
+
+class TestDayMasks(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = get_connection()
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("DELETE FROM users WHERE username LIKE 'test_masks_%'")
+        self.cursor.execute(
+            "INSERT INTO users (name, username, password, role) VALUES ('test_masks_doc', 'test_masks_doc', '1234', 'doctor') RETURNING id"
+        )
+        self.doctor_id = self.cursor.fetchone()[0]
+        self.cursor.execute(
+            "INSERT INTO users (name, username, password, role) VALUES ('test_masks_pat', 'test_masks_pat', '1234', 'patient') RETURNING id"
+        )
+        self.patient_id = self.cursor.fetchone()[0]
+        self.conn.commit()
+        self.day = date.today() + timedelta(days=30)
+
+    def tearDown(self):
+        self.cursor.execute("DELETE FROM users WHERE username LIKE 'test_masks_%'")
+        self.conn.commit()
+        self.cursor.close()
+        self.conn.close()
+
+    def stored_masks(self):
+        self.cursor.execute(
+            "SELECT day, available_mask, closed_mask, booked_mask FROM doctor_day_masks WHERE doctor_id=%s ORDER BY day",
+            (self.doctor_id,)
+        )
+        rows = self.cursor.fetchall()
+        self.conn.commit()
+        return rows
+
+    def test_mask_helpers(self):
+        self.assertEqual(day_masks.hours_to_mask([0, 9, 23]), 1 | 1 << 9 | 1 << 23)
+        self.assertEqual(day_masks.mask_to_hours(day_masks.hours_to_mask([14, 9, 9])), [9, 14])
+        with self.assertRaises(ValueError):
+            day_masks.hours_to_mask([24])
+
+    def test_set_and_clear_hours(self):
+        self.assertEqual(DoctorDAO.set_available_hours(self.doctor_id, self.day, [9, 10, 11]), 3)
+        self.assertEqual(DoctorDAO.set_available_hours(self.doctor_id, self.day, [10]), 0)
+        self.assertEqual(DoctorDAO.get_open_hours(self.doctor_id, self.day), [9, 10, 11])
+
+        self.assertEqual(DoctorDAO.clear_available_hours(self.doctor_id, self.day, [9, 11]), 2)
+        self.assertEqual(DoctorDAO.get_open_hours(self.doctor_id, self.day), [10])
+
+        DoctorDAO.clear_available_hours(self.doctor_id, self.day, [10])
+        self.assertEqual(self.stored_masks(), [])
+
+    def test_rules_and_bookings_combine(self):
+        DoctorDAO.add_availability_rule(self.doctor_id, self.day.isoweekday(), 9, 12)
+        DoctorDAO.set_available_hours(self.doctor_id, self.day, [14])
+        DoctorDAO.clear_available_hours(self.doctor_id, self.day, [9])
+        AppointmentDAO.create_appointment(self.patient_id, self.doctor_id, str(self.day), "10:00")
+
+        masks = DoctorDAO.get_day_masks(self.doctor_id, self.day, self.day + timedelta(days=1))
+        self.assertEqual([m["day"] for m in masks], [self.day, self.day + timedelta(days=1)])
+        self.assertEqual(day_masks.mask_to_hours(masks[0]["open_mask"]), [11, 14])
+        self.assertEqual(day_masks.mask_to_hours(masks[0]["booked_mask"]), [10])
+        self.assertEqual(masks[1]["open_mask"], 0)
+
+    def test_masks_follow_appointment_changes(self):
+        DoctorDAO.set_available_hours(self.doctor_id, self.day, [10, 11])
+        AppointmentDAO.create_appointment(self.patient_id, self.doctor_id, str(self.day), "10:00")
+        appointment_id = AppointmentDAO.get_patient_appointments(self.patient_id)[0]["id"]
+        self.assertEqual(DoctorDAO.get_open_hours(self.doctor_id, self.day), [11])
+
+        self.cursor.execute(
+            "UPDATE appointments SET appointment_date = appointment_date + interval '1 hour' WHERE id=%s",
+            (appointment_id,)
+        )
+        self.conn.commit()
+        self.assertEqual(DoctorDAO.get_day_masks(self.doctor_id, self.day)[0]["booked_mask"], 1 << 11)
+
+        AppointmentDAO.cancel_appointment(appointment_id, self.patient_id)
+        self.assertEqual(DoctorDAO.get_day_masks(self.doctor_id, self.day)[0]["booked_mask"], 0)
+
+    def test_rebuild_matches_triggers(self):
+        DoctorDAO.set_available_hours(self.doctor_id, self.day, [8, 9])
+        AppointmentDAO.create_appointment(self.patient_id, self.doctor_id, str(self.day), "09:00")
+        maintained = self.stored_masks()
+
+        day_masks.rebuild(self.conn)
+        self.assertEqual(self.stored_masks(), maintained)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+from database import migrate
+from database.db import get_connection
+
+
+class TestSplitStatements(unittest.TestCase):
+
+    def test_splits_on_semicolons_and_drops_comments(self):
+        sql = "-- commentaire ; ignoré\nSELECT 1;\n/* bloc ; */ SELECT 2;\n"
+        self.assertEqual(migrate.split_statements(sql), ["SELECT 1", "SELECT 2"])
+
+    def test_keeps_quoted_semicolons(self):
+        sql = "SELECT 'a;b', \"c;d\"; CREATE FUNCTION f() RETURNS INT LANGUAGE sql AS $$ SELECT 1; $$;"
+        statements = migrate.split_statements(sql)
+        self.assertEqual(len(statements), 2)
+        self.assertIn("$$ SELECT 1; $$", statements[1])
+
+    def test_concurrent_migration_is_not_transactional(self):
+        migrations = {m.filename: m for m in migrate.load_migrations()}
+        self.assertFalse(migrations["001_appointment_indexes.sql"].transactional)
+
+
+class TestMigrate(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.conn = get_connection()
+        self.cursor = self.conn.cursor()
+        self.clean()
+
+    def tearDown(self):
+        self.clean()
+        self.cursor.close()
+        self.conn.close()
+        self.directory.cleanup()
+
+    def clean(self):
+        self.conn.autocommit = True
+        self.cursor.execute("DROP TABLE IF EXISTS test_migrate_items")
+        migrate.ensure_table(self.cursor)
+        self.cursor.execute("DELETE FROM schema_migrations WHERE filename LIKE '%test_migrate%'")
+
+    def write(self, filename, sql):
+        with open(os.path.join(self.directory.name, filename), "w", encoding="utf-8") as file:
+            file.write(sql)
+
+    def test_applies_pending_migrations_once(self):
+        self.write("901_test_migrate_table.sql", "CREATE TABLE test_migrate_items (id INT);")
+        self.write("902_test_migrate_index.sql",
+                   "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_test_migrate_items ON test_migrate_items (id);")
+        migrations = migrate.load_migrations(self.directory.name)
+
+        applied = migrate.migrate(self.conn, migrations, out=lambda *a: None)
+        self.assertEqual([m.version for m in applied], ["901", "902"])
+        self.assertEqual(migrate.migrate(self.conn, migrations, out=lambda *a: None), [])
+
+        self.cursor.execute("SELECT to_regclass('idx_test_migrate_items') IS NOT NULL")
+        self.assertTrue(self.cursor.fetchone()[0])
+
+    def test_dry_run_changes_nothing(self):
+        self.write("901_test_migrate_table.sql", "CREATE TABLE test_migrate_items (id INT);")
+        migrations = migrate.load_migrations(self.directory.name)
+
+        pending = migrate.migrate(self.conn, migrations, dry_run=True, out=lambda *a: None)
+        self.assertEqual(len(pending), 1)
+        self.cursor.execute("SELECT to_regclass('test_migrate_items') IS NULL")
+        self.assertTrue(self.cursor.fetchone()[0])
+
+    def test_failed_migration_is_not_recorded(self):
+        self.write("901_test_migrate_table.sql", "CREATE TABLE test_migrate_items (id INT); SELECT missing_column FROM test_migrate_items;")
+        migrations = migrate.load_migrations(self.directory.name)
+
+        with self.assertRaises(Exception):
+            migrate.migrate(self.conn, migrations, out=lambda *a: None)
+        self.conn.autocommit = True
+        self.cursor.execute("SELECT to_regclass('test_migrate_items') IS NULL")
+        self.assertTrue(self.cursor.fetchone()[0])
+        self.assertNotIn("901", migrate.applied_migrations(self.cursor))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from datetime import date
+from database import partitions
+from database.db import get_connection
+
+
+class TestAppointmentPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = get_connection()
+        self.cursor = self.conn.cursor()
+        self.drop_test_partitions()
+
+    def tearDown(self):
+        self.drop_test_partitions()
+        self.cursor.close()
+        self.conn.close()
+
+    def drop_test_partitions(self):
+        self.cursor.execute("DROP TABLE IF EXISTS appointments_2090_01, appointments_2090_02")
+        self.conn.commit()
+
+    def test_appointments_is_partitioned(self):
+        self.assertTrue(partitions.is_partitioned(self.cursor))
+
+    def test_ensure_partitions_creates_missing_months_once(self):
+        self.assertEqual(partitions.ensure_partitions(self.conn, 1, today=date(2090, 1, 15)), 2)
+        self.assertEqual(partitions.ensure_partitions(self.conn, 1, today=date(2090, 1, 15)), 0)
+
+        names = [name for name, _, _ in partitions.list_partitions(self.conn)]
+        self.assertIn("appointments_2090_01", names)
+        self.assertIn("appointments_2090_02", names)
+
+    def test_booking_horizon_stops_a_month_short_of_the_last_partition(self):
+        self.assertEqual(partitions.booking_horizon(date(2090, 1, 15), 1), date(2090, 1, 31))
+        self.assertEqual(partitions.booking_horizon(date(2090, 11, 1), 12), date(2091, 10, 31))
+
+    def test_partition_name(self):
+        self.assertEqual(partitions.partition_name(date(2026, 3, 1)), "appointments_2026_03")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from database import queries
+from database.db import get_connection
+
+
+class TestQueryCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = get_connection()
+        self.cursor = self.conn.cursor()
+        queries.reset_stats()
+
+    def tearDown(self):
+        self.cursor.close()
+        self.conn.close()
+
+    def test_prepared_once_per_connection(self):
+        for _ in range(3):
+            queries.execute(self.cursor, queries.SEARCH_DOCTORS_BY_SPECIALTY, (1,))
+            self.cursor.fetchall()
+
+        stats = queries.stats()["search_doctors_by_specialty"]
+        self.assertEqual(stats["executions"], 3)
+        self.assertEqual(stats["prepares"], 1)
+
+    def test_wrong_parameter_count(self):
+        with self.assertRaises(ValueError):
+            queries.execute(self.cursor, queries.AUTHENTICATE, ("only_username",))
+
+    def test_plain_sql_escapes_literal_percent(self):
+        query = queries.Query("percent_test", "SELECT 'a%' LIKE $1 || '%'")
+        self.cursor.execute(query.plain_sql, query.plain_params(("a",)))
+        self.assertTrue(self.cursor.fetchone()[0])
+
+    def test_plain_sql_repeated_parameter(self):
+        query = queries.Query("repeat_test", "SELECT $1::int + $2::int + $1::int")
+        self.cursor.execute(query.plain_sql, query.plain_params((1, 10)))
+        self.assertEqual(self.cursor.fetchone()[0], 12)
+
+    def test_query_names_are_unique(self):
+        names = [q.name for q in queries.ALL_QUERIES]
+        self.assertEqual(len(names), len(set(names)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -28,5 +28,67 @@ class TestUserDAO(unittest.TestCase):
         self.assertFalse(success)
         self.assertIn("only patients", msg.lower())
 
+
+class TestDoctorSearch(unittest.TestCase):
+    """Accent-insensitive and fuzzy search of migration 003."""
+
+    @classmethod
+    def setUpClass(cls):
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM pg_extension WHERE extname IN ('pg_trgm', 'unaccent')")
+        installed = cursor.fetchone()[0]
+        conn.close()
+        if installed < 2:
+            raise unittest.SkipTest("pg_trgm and unaccent are not installed")
+
+    def setUp(self):
+        self.conn = get_connection()
+        self.cursor = self.conn.cursor()
+        self.clean()
+        self.cursor.execute(
+            "INSERT INTO users (name, username, password, role, status) "
+            "VALUES ('Hélène Dupré', 'test_search_doc', '1234', 'doctor', 'active') RETURNING id"
+        )
+        self.doctor_id = self.cursor.fetchone()[0]
+        self.cursor.execute("INSERT INTO specialties (name) VALUES ('Test Pédiatrie Néonatale') RETURNING id")
+        self.specialty_id = self.cursor.fetchone()[0]
+        self.cursor.execute("INSERT INTO doctor_specialties (doctor_id, specialty_id) VALUES (%s, %s)",
+                            (self.doctor_id, self.specialty_id))
+        self.conn.commit()
+
+    def tearDown(self):
+        self.clean()
+        self.cursor.close()
+        self.conn.close()
+
+    def clean(self):
+        self.cursor.execute("DELETE FROM users WHERE username = 'test_search_doc'")
+        self.cursor.execute("DELETE FROM specialties WHERE name = 'Test Pédiatrie Néonatale'")
+        self.conn.commit()
+
+    def found(self, name):
+        return [d["id"] for d in UserDAO.search_doctors_by_name(name)]
+
+    def test_accents_and_case_are_ignored(self):
+        self.assertIn(self.doctor_id, self.found("helene"))
+        self.assertIn(self.doctor_id, self.found("HELENE DUPRE"))
+        self.assertIn(self.doctor_id, self.found("hélène"))
+
+    def test_typos_are_tolerated(self):
+        self.assertIn(self.doctor_id, self.found("helenne"))
+        self.assertIn(self.doctor_id, self.found("dupret"))
+        self.assertNotIn(self.doctor_id, self.found("zorglub"))
+
+    def test_specialty_matches_its_doctors(self):
+        self.assertIn(self.doctor_id, self.found("pediatrie"))
+
+    def test_autocomplete_ignores_accents(self):
+        suggestions = UserDAO.autocomplete("hele")
+        self.assertIn(self.doctor_id, [d["id"] for d in suggestions["doctors"]])
+        suggestions = UserDAO.autocomplete("neonat")
+        self.assertIn(self.specialty_id, [s["id"] for s in suggestions["specialties"]])
+
+
 if __name__ == "__main__":
     unittest.main()
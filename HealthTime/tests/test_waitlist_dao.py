@@ -0,0 +1,76 @@
+import unittest
+from datetime import date, timedelta
+from dao.appointment_dao import AppointmentDAO
+from dao.waitlist_dao import WaitlistDAO
+from test_appointment_dao import BookingFixture
+
+
+class TestWaitlist(BookingFixture, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.assertTrue(AppointmentDAO.create_appointment(self.patients[0], self.doctors[0], self.day, "10:00")[0])
+        self.appointment_id = AppointmentDAO.get_patient_appointments(self.patients[0])[0]["id"]
+
+    def wait_for(self, patient_id, doctor_id=None, specialty_id=None, urgent=False, day=None):
+        success, _ = WaitlistDAO.join_waitlist(patient_id, day or self.day, day or self.day,
+                                               doctor_id=doctor_id, specialty_id=specialty_id, urgent=urgent)
+        self.assertTrue(success)
+
+    def patient_of_doctor0_at_10(self):
+        self.cursor.execute("""
+            SELECT u.username FROM appointments a JOIN users u ON u.id = a.patient_id
+            WHERE a.doctor_id=%s AND a.slot_date=%s AND a.slot_hour=10 AND a.status='scheduled'
+        """, (self.doctors[0], self.day))
+        row = self.cursor.fetchone()
+        self.conn.commit()
+        return row[0] if row else None
+
+    def test_cancel_gives_the_slot_to_the_waiter(self):
+        self.wait_for(self.patients[0], doctor_id=self.doctors[0])
+        self.wait_for(self.patients[1], doctor_id=self.doctors[0])
+        self.assertTrue(AppointmentDAO.cancel_appointment(self.appointment_id, self.patients[0])[0])
+
+        self.assertEqual(self.patient_of_doctor0_at_10(), "test_appt_pat1")
+        self.cursor.execute("SELECT status FROM time_slots WHERE doctor_id=%s", (self.doctors[0],))
+        self.assertEqual(self.cursor.fetchone()[0], "booked")
+        entry = WaitlistDAO.get_patient_waitlist(self.patients[1])[0]
+        self.assertEqual(entry["status"], "assigned")
+        self.assertEqual(entry["appointment_date"].hour, 10)
+
+    def test_urgent_waiter_goes_first(self):
+        self.wait_for(self.patients[1], specialty_id=self.specialty_id)
+        self.wait_for(self.patients[2], specialty_id=self.specialty_id, urgent=True)
+        self.assertTrue(AppointmentDAO.cancel_appointment_by_doctor(self.appointment_id)[0])
+
+        self.assertEqual(self.patient_of_doctor0_at_10(), "test_appt_pat2")
+        self.assertEqual(WaitlistDAO.get_patient_waitlist(self.patients[1])[0]["status"], "waiting")
+
+    def test_busy_or_out_of_period_waiters_are_skipped(self):
+        self.assertTrue(AppointmentDAO.create_appointment(self.patients[1], self.doctors[1], self.day, "10:00")[0])
+        self.wait_for(self.patients[1], doctor_id=self.doctors[0])
+        other_day = (date.today() + timedelta(days=31)).strftime("%Y-%m-%d")
+        self.wait_for(self.patients[2], doctor_id=self.doctors[0], day=other_day)
+        AppointmentDAO.cancel_appointment(self.appointment_id, self.patients[0])
+
+        self.assertIsNone(self.patient_of_doctor0_at_10())
+        self.assertIn("10:00", AppointmentDAO.get_available_slots_for_doctor(self.doctors[0], self.day))
+
+    def test_left_entries_are_not_served(self):
+        self.wait_for(self.patients[1], doctor_id=self.doctors[0])
+        entry_id = WaitlistDAO.get_patient_waitlist(self.patients[1])[0]["id"]
+        self.assertTrue(WaitlistDAO.leave_waitlist(entry_id, self.patients[1]))
+        AppointmentDAO.cancel_appointment(self.appointment_id, self.patients[0])
+
+        self.assertIsNone(self.patient_of_doctor0_at_10())
+        self.assertEqual(WaitlistDAO.get_patient_waitlist(self.patients[1]), [])
+
+    def test_invalid_requests(self):
+        self.assertFalse(WaitlistDAO.join_waitlist(self.patients[1], self.day, self.day)[0])
+        yesterday = date.today() - timedelta(days=1)
+        self.assertFalse(WaitlistDAO.join_waitlist(self.patients[1], yesterday, yesterday,
+                                                   doctor_id=self.doctors[0])[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
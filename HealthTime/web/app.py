@@ -3,10 +3,16 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from flask import render_template, request, redirect, url_for, flash, session
-from flask import Flask, render_template, request, redirect, session
+from flask import Flask, render_template, request, redirect, session, g
+from database.db import UnitOfWork, DbSession, bind_db_session, unbind_db_session
+from database import idempotency
+from database.partitions import booking_horizon
+from config import settings
 from dao.user_dao import UserDAO
-from dao.appointment_dao import AppointmentDAO
+from dao.appointment_dao import AppointmentDAO, SLOT_TAKEN, PATIENT_BUSY, TOO_FAR_AHEAD
 from dao.admin_dao import AdminDAO
+from dao.waitlist_dao import WaitlistDAO
+from dao.notification_dao import NotificationDAO
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 
@@ -22,9 +28,46 @@ from flask import session, redirect, flash
 
 load_dotenv()
 
+
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY")
 
+
+@app.before_request
+def open_unit_of_work():
+    # Reads go to a replica unless this user wrote recently (read-your-writes);
+    # the time of the last write travels in the Flask session.
+    g.db_session = DbSession(session.get("db_last_write"))
+    g.db_session_token = bind_db_session(g.db_session)
+
+    # All DAO calls of a request share one pooled connection; GET pages also
+    # read from a single consistent snapshot, on a replica when possible.
+    is_get = request.method == "GET"
+    g.unit_of_work = UnitOfWork(snapshot=is_get, readonly=is_get).begin()
+
+@app.context_processor
+def idempotency_keys():
+    # Each booking / cancel form gets its own key, so a replayed submit is
+    # answered with the first result instead of being executed again
+    return {"new_idempotency_key": idempotency.new_key}
+
+@app.after_request
+def remember_last_write(response):
+    db_session = g.get("db_session")
+    if db_session is not None and db_session.last_write != session.get("db_last_write"):
+        session["db_last_write"] = db_session.last_write
+    return response
+
+@app.teardown_request
+def close_unit_of_work(exc):
+    unit_of_work = g.pop("unit_of_work", None)
+    if unit_of_work is not None:
+        unit_of_work.end(commit=exc is None)
+
+    token = g.pop("db_session_token", None)
+    if token is not None:
+        unbind_db_session(token)
+
 @app.route("/")
 def home():
     return render_template("home.html")
@@ -63,18 +106,19 @@ def patient_dashboard():
     user = session["user"]
     tab = request.args.get("tab", "dashboard")
     now = datetime.now()
-    dao = AppointmentDAO()
+    dao = AppointmentDAO
 
-    upcoming_alerts = dao.get_upcoming_appointments(user["id"], "patient", hours=24)
-    
     data = {
-        "user": user, "tab": tab, "upcoming_alerts": upcoming_alerts, "now": now,
+        "user": user, "tab": tab, "upcoming_alerts": [], "now": now, "booking_horizon": booking_horizon(),
         "specialties": [], "filtered_doctors": [], "slots": [], "upcoming": [], "past": [], "appt_map": {},
+        "waitlist": [], "next_slots": None, "month_weeks": [],
+        "durations": settings.APPOINTMENT_DURATIONS, "selected_duration": 60,
         "week_offset": int(request.args.get("week_offset", 0))
     }
 
     if tab == "dashboard":
         appointments = dao.get_patient_appointments(user["id"])
+        data["waitlist"] = WaitlistDAO.get_patient_waitlist(user["id"])
         for a in appointments:
             appt_dt = datetime.strptime(f"{a['date']} {a['time']}", "%Y-%m-%d %H:%M")
             a["is_canceled"] = str(a.get("status", "")).lower() in ("canceled", "cancel")
@@ -82,29 +126,78 @@ def patient_dashboard():
             else: data["past"].append(a)
 
     elif tab == "booking":
-        data["specialties"] = AdminDAO.get_specialties()
         spec_id = request.args.get("specialty_id")
         doc_id = request.args.get("doctor_id")
         date_str = request.args.get("date")
 
+        data["specialties"] = AdminDAO.get_specialties()
         if spec_id:
             data["selected_specialty"] = spec_id
+            data["selected_doctor"] = doc_id or "any"
             data["filtered_doctors"] = UserDAO.search_doctors_by_specialty(spec_id)
-            if date_str:
+            # Heatmap of the month shown under the date field, in one query
+            month_start = datetime.strptime(
+                request.args.get("month") or (date_str or now.strftime("%Y-%m-%d"))[:7], "%Y-%m"
+            ).date()
+            if doc_id and doc_id != "any":
+                data["month_free_slots"] = dao.get_month_free_slots_for_doctor(doc_id, month_start)
+            else:
+                data["month_free_slots"] = dao.get_month_free_slots_by_specialty(spec_id, month_start)
+            if request.args.get("next"):
+                # First free slots over the coming weeks, instead of one day
+                data["selected_doctor"] = doc_id or "any"
+                if doc_id and doc_id != "any":
+                    data["next_slots"] = dao.get_next_slots_for_doctor(doc_id)
+                else:
+                    data["next_slots"] = dao.get_next_slots_by_specialty(spec_id)
+            elif date_str:
                 data["selected_date"] = date_str
                 date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
+                data["waitlist_until"] = (date_obj + timedelta(days=7)).strftime("%Y-%m-%d")
                 if doc_id and doc_id != "any":
                     data["selected_doctor"] = doc_id
-                    data["slots"] = dao.get_available_slots_for_doctor(doc_id, date_obj)
+                    # Consultations shorter than an hour share the hours already started
+                    duration = request.args.get("duration", type=int)
+                    if duration in settings.APPOINTMENT_DURATIONS and duration < 60:
+                        data["selected_duration"] = duration
+                        data["slots"] = dao.get_free_periods_for_doctor(doc_id, date_obj, duration)
+                    else:
+                        data["slots"] = dao.get_available_slots_for_doctor(doc_id, date_obj)
                 else:
                     data["selected_doctor"] = "any"
-                    data["slots"] = dao.get_available_slots_by_specialty(spec_id, date_obj)
+                    data["slots"] = dao.get_free_hours_by_specialty(spec_id, date_obj)
+
+        if spec_id:
+            free = {d["date"]: d["free_slots"] for d in data.pop("month_free_slots")}
+            freest = max(free.values(), default=0)
+            data["month_start"] = month_start
+            data["heatmap_doctor"] = doc_id or "any"
+            data["prev_month"] = (month_start - timedelta(days=1)).strftime("%Y-%m")
+            data["next_month"] = (month_start + timedelta(days=31)).strftime("%Y-%m")
+            for week in calendar.Calendar().monthdatescalendar(month_start.year, month_start.month):
+                cells = []
+                for day in week:
+                    free_slots = free.get(day.strftime("%Y-%m-%d"), 0)
+                    cells.append({
+                        "day": day, "in_month": day.month == month_start.month, "free_slots": free_slots,
+                        # 0 (nothing free) to 4 (as free as the freest day of the month)
+                        "level": -(-4 * free_slots // freest) if free_slots else 0,
+                    })
+                data["month_weeks"].append(cells)
+
+        if data.get("selected_doctor") == "any":
+            # One button per hour: the doctor is picked when booking
+            data["slots"] = [
+                {"time": s["time"], "doctor_id": "any", "doctor_name": "", "doctor_count": s["doctor_count"]}
+                for s in data["slots"]
+            ]
 
     elif tab == "calendar":
         monday = (now.date() - timedelta(days=now.date().weekday())) + timedelta(weeks=data["week_offset"])
         data["week_dates"] = [monday + timedelta(days=i) for i in range(7)]
         
         appointments = dao.get_patient_appointments(user["id"])
+        data["doctors"] = dao.get_active_doctors()
         for a in appointments:
             appt_dt = datetime.strptime(f"{a['date']} {a['time']}", "%Y-%m-%d %H:%M")
             d_obj = appt_dt.date()
@@ -117,8 +210,8 @@ def patient_dashboard():
             
             data["appt_map"][(d_obj, h_obj)] = a
 
-        data["doctors"] = dao.get_active_doctors()
-
+    data["upcoming_alerts"] = dao.get_upcoming_appointments(user["id"], "patient", hours=24)
+    data["notifications"] = NotificationDAO.get_unread_notifications(user["id"])
     return render_template("patient/dashboard.html", **data)
 
 
@@ -131,25 +224,94 @@ def book_appointment():
     date = request.form.get("date")
     time = request.form.get("time")
     urgent = request.form.get("urgent") == "on"
+    idempotency_key = request.form.get("idempotency_key") or None
+    duration = request.form.get("duration", 60, type=int)
+    if duration not in settings.APPOINTMENT_DURATIONS:
+        duration = 60
 
     if datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M") < datetime.now():
         flash("Impossible de réserver dans le passé.", "danger")
         return redirect(url_for("patient_dashboard", tab="booking"))
 
-    success, msg = AppointmentDAO.create_appointment(patient_id, doc_id, date, time, urgent=urgent)
-    if success:
-        flash("Rendez-vous confirmé !", "success")
-        return redirect("/patient_dashboard?tab=dashboard")
-    flash(f"Erreur : {msg}", "danger")
+    if doc_id == "any":
+        success, msg = AppointmentDAO.book_first_available(
+            patient_id, request.form.get("specialty_id"), date, time, urgent=urgent,
+            idempotency_key=idempotency_key
+        )
+        if success:
+            flash(f"Rendez-vous confirmé avec le Dr. {msg} !", "success")
+            return redirect("/patient_dashboard?tab=dashboard")
+    else:
+        success, msg = AppointmentDAO.create_appointment(
+            patient_id, doc_id, date, time, urgent=urgent, idempotency_key=idempotency_key,
+            duration_minutes=duration
+        )
+        if success:
+            flash("Rendez-vous confirmé !", "success")
+            return redirect("/patient_dashboard?tab=dashboard")
+    if msg == SLOT_TAKEN:
+        flash("Ce créneau vient d'être réservé par un autre patient, choisissez-en un autre.", "danger")
+    elif msg == PATIENT_BUSY:
+        flash("Vous avez déjà un rendez-vous à cette heure-là.", "danger")
+    elif msg == TOO_FAR_AHEAD:
+        flash(f"Les réservations sont ouvertes jusqu'au {booking_horizon().strftime('%d/%m/%Y')}, choisissez une date plus proche.", "danger")
+    else:
+        flash(f"Erreur : {msg}", "danger")
     return redirect("/patient_dashboard?tab=booking")
 
 @app.route("/cancel_appointment/<int:appt_id>", methods=["POST"])
 def cancel_appointment(appt_id):
     if "user" not in session: return redirect("/login")
-    success, msg = AppointmentDAO.cancel_appointment(appt_id, session["user"]["id"])
+    success, msg = AppointmentDAO.cancel_appointment(
+        appt_id, session["user"]["id"], idempotency_key=request.form.get("idempotency_key") or None
+    )
     flash("Rendez-vous annulé." if success else msg, "success" if success else "danger")
     return redirect(request.referrer or "/patient_dashboard")
 
+@app.route("/join_waitlist", methods=["POST"])
+def join_waitlist():
+    if "user" not in session or session["user"]["role"] != "patient":
+        return redirect("/login")
+
+    doc_id = request.form.get("doctor_id")
+    if doc_id and doc_id != "any":
+        doctor_id, specialty_id = doc_id, None
+    else:
+        doctor_id, specialty_id = None, request.form.get("specialty_id") or None
+
+    try:
+        success, msg = WaitlistDAO.join_waitlist(
+            session["user"]["id"], request.form.get("date_from"), request.form.get("date_to"),
+            doctor_id=doctor_id, specialty_id=specialty_id, urgent=request.form.get("urgent") == "on"
+        )
+    except ValueError:
+        success, msg = False, "Dates invalides"
+
+    if success:
+        flash("Vous êtes sur la liste d'attente : le premier créneau libéré sur cette période vous sera attribué.", "success")
+        return redirect("/patient_dashboard?tab=dashboard")
+    flash(f"Erreur : {msg}", "danger")
+    return redirect("/patient_dashboard?tab=booking")
+
+@app.route("/leave_waitlist/<int:entry_id>", methods=["POST"])
+def leave_waitlist(entry_id):
+    if "user" not in session or session["user"]["role"] != "patient":
+        return redirect("/login")
+
+    if WaitlistDAO.leave_waitlist(entry_id, session["user"]["id"]):
+        flash("Inscription retirée de la liste d'attente.", "success")
+    else:
+        flash("Inscription introuvable.", "danger")
+    return redirect("/patient_dashboard?tab=dashboard")
+
+@app.route("/dismiss_notifications", methods=["POST"])
+def dismiss_notifications():
+    if "user" not in session or session["user"]["role"] != "patient":
+        return redirect("/login")
+
+    NotificationDAO.mark_notifications_read(session["user"]["id"])
+    return redirect(request.referrer or "/patient_dashboard")
+
 @app.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
@@ -182,7 +344,6 @@ def search():
         doctors = UserDAO.search_doctors_by_name(search_name)
     elif search_specialty_id:
         doctors = UserDAO.search_doctors_by_specialty(search_specialty_id)
-        
     specialties_list = UserDAO.get_all_specialties()
 
     selected_spec_id = int(search_specialty_id) if search_specialty_id.isdigit() else None
@@ -197,6 +358,15 @@ def search():
     )
 
 
+@app.route("/search/autocomplete")
+def search_autocomplete():
+    # Suggestions JSON pour la barre de recherche (à partir de 2 caractères)
+    term = request.args.get("q", "").strip()
+    if len(term) < 2:
+        return jsonify({"doctors": [], "specialties": []})
+
+    return jsonify(UserDAO.autocomplete(term))
+
 
 @app.route("/doctor_dashboard")
 def doctor_dashboard():
@@ -214,7 +384,8 @@ def doctor_dashboard():
     week_offset = int(request.args.get("week_offset", 0))
     monday = (now.date() - timedelta(days=now.date().weekday())) + timedelta(weeks=week_offset)
     week_dates = [monday + timedelta(days=i) for i in range(7)]
-    slots = DoctorDAO.get_doctor_slots(user["id"])
+    # Rules are expanded into slots only over the requested dates
+    slots = DoctorDAO.get_doctor_slots(user["id"], week_dates[0], week_dates[-1])
     slot_map = {f"{s['slot_date']}-{s['slot_hour']}": s["status"] for s in slots}
 
     appointments = AppointmentDAO.get_doctor_appointments(user["id"])
@@ -253,8 +424,14 @@ def doctor_dashboard():
         "slot_map": slot_map,
         "appt_map": appointment_map,
         "upcoming_appts": upcoming_appts,
-        "now": now
+        "now": now,
+        "rules": [],
+        "exceptions": []
     }
+
+    if tab == "calendar_planner":
+        data["rules"] = DoctorDAO.get_availability_rules(user["id"])
+        data["exceptions"] = DoctorDAO.get_availability_exceptions(user["id"])
     
     return render_template("doctor/dashboard.html", **data)
 
@@ -274,13 +451,101 @@ def doctor_create_slots():
     if not selected_days or not selected_hours:
         return redirect(f"/doctor_dashboard?tab=calendar_planner&year={year}&month={month}")
 
-    for day in selected_days:
-        for hour in selected_hours:
-            date_str = f"{year}-{int(month):02d}-{int(day):02d}"
-            DoctorDAO.create_time_slot_day_hour(user_id, date_str, int(hour))
-            
+    slots = [
+        (f"{year}-{int(month):02d}-{int(day):02d}", int(hour))
+        for day in selected_days
+        for hour in selected_hours
+    ]
+    result = DoctorDAO.create_time_slots(user_id, slots)
+    if result is None:
+        flash("Erreur lors de l'enregistrement des disponibilités.", "danger")
+    else:
+        created, skipped = result
+        flash(f"{created} créneau(x) ouvert(s), {skipped} déjà existant(s).", "success")
+
     return redirect(f"/doctor_dashboard?tab=calendar_planner&year={year}&month={month}")
 
+@app.route("/doctor_add_rule", methods=["POST"])
+def doctor_add_rule():
+    if "user" not in session or session["user"]["role"] != "doctor":
+        return redirect("/login")
+
+    try:
+        weekdays = [int(d) for d in request.form.getlist("weekdays")]
+        start_hour = int(request.form.get("start_hour"))
+        end_hour = int(request.form.get("end_hour"))
+        valid_from = request.form.get("valid_from") or None
+        valid_until = request.form.get("valid_until") or None
+    except (TypeError, ValueError):
+        flash("Horaires invalides.", "danger")
+        return redirect("/doctor_dashboard?tab=calendar_planner")
+
+    if not weekdays or end_hour <= start_hour:
+        flash("Choisissez au moins un jour et une heure de fin après l'heure de début.", "danger")
+        return redirect("/doctor_dashboard?tab=calendar_planner")
+
+    for weekday in weekdays:
+        success, _ = DoctorDAO.add_availability_rule(
+            session["user"]["id"], weekday, start_hour, end_hour, valid_from, valid_until
+        )
+        if not success:
+            flash("Erreur lors de l'enregistrement de la règle.", "danger")
+            break
+    else:
+        flash(f"{len(weekdays)} règle(s) hebdomadaire(s) enregistrée(s).", "success")
+
+    return redirect("/doctor_dashboard?tab=calendar_planner")
+
+
+@app.route("/doctor_delete_rule/<int:rule_id>", methods=["POST"])
+def doctor_delete_rule(rule_id):
+    if "user" not in session or session["user"]["role"] != "doctor":
+        return redirect("/login")
+
+    if DoctorDAO.delete_availability_rule(session["user"]["id"], rule_id):
+        flash("Règle supprimée.", "success")
+    else:
+        flash("Règle introuvable.", "danger")
+    return redirect("/doctor_dashboard?tab=calendar_planner")
+
+
+@app.route("/doctor_add_exception", methods=["POST"])
+def doctor_add_exception():
+    if "user" not in session or session["user"]["role"] != "doctor":
+        return redirect("/login")
+
+    start_date = request.form.get("start_date")
+    end_date = request.form.get("end_date") or start_date
+    if not start_date or end_date < start_date:
+        flash("Période invalide.", "danger")
+        return redirect("/doctor_dashboard?tab=calendar_planner")
+
+    cancel_appointments = request.form.get("cancel_appointments") == "on"
+    success, _ = DoctorDAO.add_availability_exception(
+        session["user"]["id"], start_date, end_date, request.form.get("reason", "").strip(),
+        cancel_appointments=cancel_appointments
+    )
+    if success and cancel_appointments:
+        flash("Absence enregistrée : vos rendez-vous de la période sont annulés et les patients prévenus.", "success")
+    elif success:
+        flash("Absence enregistrée : vos règles sont suspendues sur cette période.", "success")
+    else:
+        flash("Erreur lors de l'enregistrement de l'absence.", "danger")
+    return redirect("/doctor_dashboard?tab=calendar_planner")
+
+
+@app.route("/doctor_delete_exception/<int:exception_id>", methods=["POST"])
+def doctor_delete_exception(exception_id):
+    if "user" not in session or session["user"]["role"] != "doctor":
+        return redirect("/login")
+
+    if DoctorDAO.delete_availability_exception(session["user"]["id"], exception_id):
+        flash("Absence supprimée.", "success")
+    else:
+        flash("Absence introuvable.", "danger")
+    return redirect("/doctor_dashboard?tab=calendar_planner")
+
+
 @app.route("/doctor_cancel_appt/<int:appt_id>", methods=["POST"])
 def doctor_cancel_appt(appt_id):
     if "user" not in session or session["user"]["role"] != "doctor":
@@ -315,12 +580,7 @@ def admin_dashboard():
     }
 
     if tab == "dashboard":
-        users_list = AdminDAO.get_all_users()
-        data["stats"] = {
-            "total_users": len(users_list),
-            "total_doctors": len([u for u in users_list if u['role'] == 'doctor']),
-            "total_patients": len([u for u in users_list if u['role'] == 'patient'])
-        }
+        data["stats"] = AdminDAO.get_statistics()
 
     elif tab == "view_users":
         data["all_users"] = AdminDAO.get_all_users()
@@ -396,7 +656,7 @@ def admin_doctor_action(action, doctor_id):
         
     if action == "deactivate":
         AdminDAO.deactivate_doctor(doctor_id)
-        flash("Le compte du docteur a été désactivé.", "success")
+        flash("Le compte du docteur a été désactivé ; ses rendez-vous à venir sont annulés et les patients prévenus.", "success")
     elif action == "reactivate":
         AdminDAO.reactivate_doctor(doctor_id)
         flash("Le compte du docteur a été réactivé.", "success")